@@ -1,37 +1,68 @@
-from database import get_idp_log 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
-from datetime import datetime
-import fitz
-import pytesseract
-from PIL import Image
-import spacy
+import uuid
 from database import get_document_status_counts
-
-# Try to load spaCy model, but make it optional
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Warning: spaCy model 'en_core_web_sm' not found. AI processing will be disabled.")
-    nlp = None
 from database import get_document_details
 from database import (
-    init_db, create_user, get_user_by_email, get_user_documents,
-    create_document, update_document_status, get_pending_documents,
-    get_document_by_id, add_audit_log, get_recent_activity, get_user_stats
+    init_db, create_user, get_user_by_email,
+    create_document, get_pending_documents, get_pending_uploaders,
+    get_document_by_id, get_recent_activity, get_user_stats,
+    close_request_connection, enqueue_idp_job, clone_idp_result, delete_document,
+    create_upload_session, get_upload_session, advance_upload_session, delete_upload_session,
+    search_documents, list_documents, update_document,
+    count_documents, bulk_update_document_status, BULK_STATUS_MAX_IDS,
+    find_documents_by_entity, get_entity_facets, get_search_facets, SEARCH_FACETS,
+    get_status_timeseries, rebuild_status_rollups, encode_cursor, decode_cursor
 )
+import click
+import audit
+import reprocess
+import storage
+from idp import PIPELINE_VERSION
+import events
+from cache import dashboard_cache, activity_cache, count_cache, etag_for, invalidate_user
 
 app = Flask(__name__)
 app.secret_key = 'your_super_secret_key'
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Dashboard sirf pehla page render karta hai; baaki /api/documents se cursor ke saath aata hai
+DASHBOARD_PAGE_SIZE = 50
+ADMIN_PAGE_SIZE = 50
+# Audit log durability: 'sync', 'group' (default) ya 'async' -- audit.py dekhein
+app.config['AUDIT_MODE'] = os.environ.get('AUDIT_MODE', audit.AUDIT_MODE)
+audit.configure(mode=app.config['AUDIT_MODE'])
+
+# Har request ke end par uska pooled DB connection wapas pool mein jata hai
+app.teardown_appcontext(close_request_connection)
 
 # Ensure the upload folder exists and initialize the database
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 init_db()
 
+def conditional_json(payload):
+    """JSON response with an ETag; an unchanged payload becomes an empty 304."""
+    etag = etag_for(payload)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def format_document(doc):
+    """Document row ko frontend table ke format mein badalta hai."""
+    return {
+        'id': doc['id'],
+        'name': doc['filename'],
+        'status': doc['status'],
+        'modified': doc['upload_date'],
+        'type': doc['file_type'].upper() if doc['file_type'] else 'FILE'
+    }
+
 @app.route('/')
 def home():
     """Homepage ko render karta hai."""
@@ -54,7 +85,7 @@ def register():
         user_id = create_user(full_name, email, hashed_password)
         if user_id:
             flash('Registration successful! Please log in.', 'success')
-            add_audit_log(user_id, 'register', 'user', user_id)
+            audit.log(user_id, 'register', 'user', user_id)
             return redirect(url_for('login'))
         else:
             flash('An error occurred during registration.', 'error')
@@ -74,7 +105,7 @@ def login():
             session['user_id'] = user['id']
             session['user_name'] = user['full_name']
             session['user_role'] = user['role']
-            add_audit_log(user['id'], 'login', 'user', user['id'])
+            audit.log(user['id'], 'login', 'user', user['id'])
             return redirect(url_for('dashboard'))
         else:
             flash("Invalid email or password.", 'error')
@@ -97,36 +128,16 @@ def dashboard():
     user_name = session.get('user_name', 'Guest')
     user_role = session.get('user_role', 'user')
 
-    # Fetch all data needed for the dashboard
-    stats = get_user_stats(user_id)
-    documents_raw = get_user_documents(user_id)
-    recent_activity_raw = get_recent_activity(5)
-
-    # Format documents for the frontend table
-    formatted_docs = []
-    for doc in documents_raw:
-        formatted_docs.append({
-            'id': doc['id'],
-            'name': doc['filename'],
-            'status': doc['status'],
-            'modified': doc['upload_date'],
-            'type': doc['file_type'].upper() if doc['file_type'] else 'FILE'
-        })
-        
-    # Format recent activity for the frontend feed
-    formatted_activity = []
-    for activity in recent_activity_raw:
-        formatted_activity.append({
-            'user': activity['full_name'],
-            'action': activity['action'],
-            'target': activity['details'] if activity['details'] else f"{activity['target_type']} #{activity['target_id']}",
-            'ts': activity['timestamp']
-        })
-        idp_log = get_idp_log(5)
+    # Fetch all data needed for the dashboard (cached per user, invalidated on writes)
+    data, _ = get_dashboard_data(user_id)
+    stats = data['stats']
+    formatted_docs = data['documents']
+    formatted_activity, _ = get_activity_feed()
     return render_template('dashboard.html', 
                            user_name=user_name, 
                            user_role=user_role, 
                            documents=formatted_docs,
+                           next_cursor=data['next_cursor'],
                            stats=stats,
                            recent_activity=formatted_activity,
                            # Pass empty lists for components not yet implemented
@@ -134,6 +145,60 @@ def dashboard():
                            workflows=[],
                            reports=[])
 
+def format_activity(activity):
+    """Audit log row ko activity feed ke format mein badalta hai."""
+    return {
+        'user': activity['full_name'],
+        'action': activity['action'],
+        'target': activity['details'] if activity['details'] else f"{activity['target_type']} #{activity['target_id']}",
+        'ts': activity['timestamp']
+    }
+
+def get_dashboard_data(user_id):
+    """Returns (data, etag) for a user's stats and documents, served from cache when fresh."""
+    def build():
+        documents, next_cursor = list_documents(user_id, limit=DASHBOARD_PAGE_SIZE)
+        data = {
+            'stats': get_user_stats(user_id),
+            'documents': [format_document(doc) for doc in documents],
+            'next_cursor': next_cursor
+        }
+        return data, etag_for(data)
+    return dashboard_cache.get_or_set(user_id, build)
+
+def get_activity_feed():
+    """Returns (activity, etag) for the shared recent activity feed."""
+    def build():
+        activity = [format_activity(a) for a in get_recent_activity(5)]
+        return activity, etag_for(activity)
+    return activity_cache.get_or_set('recent', build)
+
+def register_upload(user_id, filename, file_type, tmp_path, content_hash, file_size):
+    """Stores a hashed upload as a blob, creates its document and queues IDP processing."""
+    file_path, is_new = storage.store_blob(app.config['UPLOAD_FOLDER'], tmp_path, content_hash, file_size, file_type)
+
+    doc_id = create_document(
+        filename=filename,
+        uploader_id=user_id,
+        file_type=file_type,
+        file_size=file_size,
+        content_hash=content_hash
+    )
+    # Same content is pipeline version se pehle process ho chuka hai to uska IDP result reuse hota hai,
+    # warna AI processing background worker (worker.py) karega
+    if is_new or not clone_idp_result(doc_id, content_hash, PIPELINE_VERSION):
+        enqueue_idp_job(doc_id, file_path)
+
+    audit.log(
+        user_id=user_id,
+        action='upload',
+        target_type='document',
+        target_id=doc_id,
+        details=f'Uploaded file: {filename}'
+    )
+    invalidate_user(user_id)
+    return doc_id
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """User dashboard se file uploads ko handle karta hai."""
@@ -152,32 +217,88 @@ def upload_file():
 
     if file:
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-
-        file_size = os.path.getsize(file_path)
-        file_type = filename.split('.-')[-1] if '.' in filename else None
-
-        user_id = session['user_id']
-        doc_id = create_document(
-            filename=filename,
-            uploader_id=user_id,
-            file_type=file_type,     
-            file_size=file_size
-        )
-        process_document_with_ai(file_path, doc_id)
-
-        add_audit_log(
-            user_id=user_id,
-            action='upload',
-            target_type='document',
-            target_id=doc_id,
-            details=f'Uploaded file: {filename}'
-        )
+        file_type = filename.rsplit('.', 1)[-1].lower() if '.' in filename else None
+
+        # File disk par likhte waqt hi hash hoti hai; same bytes dobara store nahi hote
+        tmp_path, content_hash, file_size = storage.save_stream(file.stream, app.config['UPLOAD_FOLDER'])
+        register_upload(session['user_id'], filename, file_type, tmp_path, content_hash, file_size)
 
         flash(f'File "{filename}" uploaded successfully! It is now pending approval.', 'success')
     return redirect(url_for('dashboard'))
 
+@app.route('/api/uploads', methods=['POST'])
+def api_upload_init():
+    """Starts a chunked, resumable upload."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename', ''))
+    if not filename:
+        return jsonify({'error': 'filename is required'}), 400
+    total_size = data.get('size')
+    if total_size is not None and (not isinstance(total_size, int) or total_size < 0):
+        return jsonify({'error': 'size must be a non-negative integer'}), 400
+
+    storage.cleanup_stale_uploads(app.config['UPLOAD_FOLDER'])
+    upload_id = uuid.uuid4().hex
+    file_type = filename.rsplit('.', 1)[-1].lower() if '.' in filename else None
+    storage.start_partial(app.config['UPLOAD_FOLDER'], upload_id)
+    create_upload_session(upload_id, session['user_id'], filename, file_type, total_size)
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'chunk_size': storage.CHUNK_SIZE}), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    """Reports how many bytes have arrived, so a dropped upload can resume."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    upload = get_upload_session(upload_id, session['user_id'])
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify({'upload_id': upload_id, 'offset': upload['received'], 'size': upload['total_size']})
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def api_upload_chunk(upload_id):
+    """Appends the request body at ?offset=N (must equal the bytes received so far)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    upload = get_upload_session(upload_id, session['user_id'])
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    offset = request.args.get('offset', type=int)
+    if offset != upload['received']:
+        return jsonify({'error': 'Offset mismatch', 'offset': upload['received']}), 409
+
+    max_bytes = upload['total_size'] - offset if upload['total_size'] is not None else None
+    try:
+        # Body seedha temp file mein stream hota hai, poora memory mein nahi aata
+        written = storage.write_chunk(app.config['UPLOAD_FOLDER'], upload_id, offset, request.stream, max_bytes)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'offset': offset}), 400
+    if not advance_upload_session(upload_id, offset, offset + written):
+        return jsonify({'error': 'Offset mismatch', 'offset': get_upload_session(upload_id, session['user_id'])['received']}), 409
+    return jsonify({'upload_id': upload_id, 'offset': offset + written})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def api_upload_finalize(upload_id):
+    """Completes a chunked upload and creates the document."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id = session['user_id']
+    upload = get_upload_session(upload_id, user_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload['total_size'] is not None and upload['received'] != upload['total_size']:
+        return jsonify({'error': 'Upload incomplete', 'offset': upload['received']}), 409
+
+    tmp_path, content_hash = storage.finish_partial(app.config['UPLOAD_FOLDER'], upload_id, upload['received'])
+    doc_id = register_upload(user_id, upload['filename'], upload['file_type'], tmp_path, content_hash, upload['received'])
+    delete_upload_session(upload_id)
+    return jsonify({'success': True, 'document_id': doc_id, 'sha256': content_hash})
+
 @app.route('/admin')
 def admin_dashboard():
     """Document management ke liye admin panel display karta hai."""
@@ -185,43 +306,35 @@ def admin_dashboard():
         flash('You do not have permission to access this page.', 'error')
         return redirect(url_for('dashboard'))
 
-    pending_docs_raw = get_pending_documents()
-    
-    formatted_docs = []
-    for doc in pending_docs_raw:
-        doc_dict = dict(doc)
-        doc_dict['full_name'] = doc_dict.pop('uploader_name', 'Unknown Uploader')
-        
-        # --- YEH HAI FIX ---
-        # Database se aaye date string ko Python ke datetime object mein badalna
-        if doc_dict.get('upload_date'):
-            try:
-                # Format ko database ke timestamp format se match karna
-                doc_dict['upload_date'] = datetime.strptime(doc_dict['upload_date'], '%Y-%m-%d %H:%M:%S')
-            except (ValueError, TypeError):
-                # Agar conversion fail ho, to use None set kar dena
-                doc_dict['upload_date'] = None
-        # --- FIX END ---
-        
-        formatted_docs.append(doc_dict)
-        
-    return render_template('admin.html', documents=formatted_docs)
+    filters = {
+        'uploader_id': request.args.get('uploader', type=int),
+        'file_type': (request.args.get('type') or '').lower() or None,
+        'older_than_days': request.args.get('older_than', type=int)
+    }
+    try:
+        documents, next_cursor = get_pending_documents(
+            limit=ADMIN_PAGE_SIZE, cursor=request.args.get('cursor'), **filters
+        )
+    except ValueError:
+        flash('Invalid page link, showing the first page.', 'error')
+        documents, next_cursor = get_pending_documents(limit=ADMIN_PAGE_SIZE, **filters)
+
+    return render_template('admin.html',
+                           documents=documents,
+                           next_cursor=next_cursor,
+                           uploaders=get_pending_uploaders(),
+                           filters=filters)
 @app.route('/approve/<int:doc_id>')
 def approve_document(doc_id):
     """Pending document ko approve karta hai."""
     if session.get('user_role') != 'manager':
         return redirect(url_for('dashboard'))
 
-    doc = get_document_by_id(doc_id)
-    if doc:
-        update_document_status(doc_id, 'Approved')
-        add_audit_log(
-            user_id=session['user_id'],
-            action='approve',
-            target_type='document',
-            target_id=doc_id,
-            details=f"Approved '{doc['filename']}'"
-        )
+    # Status, counters aur audit row ek hi transaction mein
+    updated, skipped = bulk_update_document_status([doc_id], 'Approved', session['user_id'], 'approve')
+    for doc in updated:
+        invalidate_user(doc['uploader_id'])
+    if updated or skipped[0]['reason'] == 'unchanged':
         flash('Document has been approved.', 'success')
     else:
         flash('Error approving document.', 'error')
@@ -233,21 +346,79 @@ def reject_document(doc_id):
     if session.get('user_role') != 'manager':
         return redirect(url_for('dashboard'))
 
-    doc = get_document_by_id(doc_id)
-    if doc:
-        update_document_status(doc_id, 'Rejected')
-        add_audit_log(
-            user_id=session['user_id'],
-            action='reject',
-            target_type='document',
-            target_id=doc_id,
-            details=f"Rejected '{doc['filename']}'"
-        )
+    # Status, counters aur audit row ek hi transaction mein
+    updated, skipped = bulk_update_document_status([doc_id], 'Rejected', session['user_id'], 'reject')
+    for doc in updated:
+        invalidate_user(doc['uploader_id'])
+    if updated or skipped[0]['reason'] == 'unchanged':
         flash('Document has been rejected.', 'success')
     else:
         flash('Error rejecting document.', 'error')
     return redirect(url_for('admin_dashboard'))
 
+# Bulk status API ke allowed statuses aur unke audit actions
+BULK_STATUS_ACTIONS = {'Approved': 'approve', 'Rejected': 'reject'}
+
+@app.route('/api/documents/bulk_status', methods=['POST'])
+def api_bulk_status():
+    """Approves or rejects many documents in one transaction."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    if session.get('user_role') != 'manager':
+        return jsonify({'error': 'Forbidden'}), 403
+
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    doc_ids = data.get('ids')
+    if status not in BULK_STATUS_ACTIONS:
+        return jsonify({'error': f"status must be one of {', '.join(BULK_STATUS_ACTIONS)}"}), 400
+    if not isinstance(doc_ids, list) or not all(type(i) is int for i in doc_ids):
+        return jsonify({'error': 'ids must be a list of document ids'}), 400
+    if len(doc_ids) > BULK_STATUS_MAX_IDS:
+        return jsonify({'error': f'At most {BULK_STATUS_MAX_IDS} ids per request'}), 400
+
+    updated, skipped = bulk_update_document_status(
+        doc_ids, status, session['user_id'], BULK_STATUS_ACTIONS[status]
+    )
+    for uploader_id in {doc['uploader_id'] for doc in updated}:
+        invalidate_user(uploader_id)
+    return jsonify({
+        'success': True,
+        'updated': [doc['id'] for doc in updated],
+        'skipped': skipped
+    })
+
+@app.route('/api/audit')
+def api_audit_log():
+    """Audit trail query across the live table and archives (managers only)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    if session.get('user_role') != 'manager':
+        return jsonify({'error': 'Forbidden'}), 403
+
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    # Default newest first; ?order=asc purane se naye ki taraf
+    desc = request.args.get('order', 'desc') != 'asc'
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    entries = list(audit.query(
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        user_id=request.args.get('user_id', type=int),
+        action=request.args.get('action'),
+        target_type=request.args.get('target_type'),
+        target_id=request.args.get('target_id', type=int),
+        after=after, desc=desc, limit=limit + 1
+    ))
+    truncated = len(entries) > limit
+    entries = entries[:limit]
+    next_cursor = encode_cursor(entries[-1]['timestamp'], entries[-1]['id']) if truncated else None
+    return jsonify({'entries': entries, 'truncated': truncated, 'next_cursor': next_cursor})
+
 @app.route('/api/dashboard')
 def api_dashboard_data():
     """Provides dashboard data as JSON for dynamic frontend updates."""
@@ -255,36 +426,37 @@ def api_dashboard_data():
         return jsonify({'error': 'Not logged in'}), 401
 
     user_id = session['user_id']
-    documents_raw = get_user_documents(user_id)
-    stats = get_user_stats(user_id)
-    recent_activity_raw = get_recent_activity(5)
-
-    # Format documents
-    formatted_docs = []
-    for doc in documents_raw:
-        formatted_docs.append({
-            'id': doc['id'],
-            'name': doc['filename'],
-            'status': doc['status'],
-            'modified': doc['upload_date'],
-            'type': doc['file_type'].upper() if doc['file_type'] else 'FILE'
-        })
-    
-    # Format recent activity
-    formatted_activity = []
-    for activity in recent_activity_raw:
-        formatted_activity.append({
-            'user': activity['full_name'],
-            'action': activity['action'],
-            'target': activity['details'] if activity['details'] else f"{activity['target_type']} #{activity['target_id']}",
-            'ts': activity['timestamp']
+    data, data_etag = get_dashboard_data(user_id)
+    activity, activity_etag = get_activity_feed()
+
+    # Kuch nahi badla to 304, bina body ke
+    etag = f"{data_etag[:20]}-{activity_etag[:20]}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = jsonify({
+            'stats': data['stats'],
+            'documents': data['documents'],
+            'next_cursor': data['next_cursor'],
+            'recent_activity': activity,
+            'idp_log': []  # Mock data for now
         })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-    return jsonify({
-        'stats': stats,
-        'documents': formatted_docs,
-        'recent_activity': formatted_activity,
-        'idp_log': []  # Mock data for now
+@app.route('/api/events')
+def api_events():
+    """Server-sent events: live document status, IDP results and activity feed."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    # Stream request context ke bahar chalta hai, taaki pooled DB connection hold na ho
+    events.start_idp_result_watcher()
+    subscriber = events.bus.subscribe(session['user_id'])
+    return Response(events.stream(subscriber), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
 
 @app.route('/api/charts/document_status')
@@ -294,21 +466,29 @@ def api_document_status_chart():
         return jsonify({'error': 'Not authorized'}), 401
     
     user_id = session['user_id']
+    # Rollup table se chhota indexed read; ETag se unchanged chart 304 ho jaata hai
     status_counts = get_document_status_counts(user_id)
     
     # Format data for Chart.js
-    labels = []
-    data = []
     colors = ['#22c55e', '#facc15', '#3b82f6', '#6b7280', '#ef4444']
-    
-    for status, count in status_counts.items():
-        labels.append(status)
-        data.append(count)
-    
-    return jsonify({
-        'labels': labels,
-        'data': data,
-        'colors': colors[:len(labels)]
+    return conditional_json({
+        'labels': list(status_counts),
+        'data': list(status_counts.values()),
+        'colors': colors[:len(status_counts)]
+    })
+
+@app.route('/api/charts/document_timeseries')
+def api_document_timeseries_chart():
+    """Uploads and approvals/rejections per day over the last N days (default 30)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authorized'}), 401
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    series = get_status_timeseries(session['user_id'], days)
+    return conditional_json({
+        'labels': [point['date'] for point in series],
+        'datasets': {status: [point.get(status, 0) for point in series]
+                     for status in ('Uploaded', 'Approved', 'Rejected')}
     })
 
 @app.route('/api/document/<int:doc_id>')
@@ -325,6 +505,68 @@ def api_document_details(doc_id):
     
     return jsonify(doc_details)
 
+@app.route('/api/documents')
+def api_documents():
+    """Cursor-paginated document listing with selectable columns."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id = session['user_id']
+    limit = min(max(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), 1), 200)
+    fields = request.args.get('fields')
+    columns = [c.strip() for c in fields.split(',') if c.strip()] if fields else None
+    filters = {
+        'status': request.args.get('status') or None,
+        'file_type': (request.args.get('type') or '').lower() or None,
+        'date': request.args.get('date') or None
+    }
+
+    try:
+        documents, next_cursor = list_documents(
+            user_id, limit=limit, cursor=request.args.get('cursor'), columns=columns, **filters
+        )
+        # Total: bina filter ke counters se (exact, O(1)), filters ke saath 30s cached count
+        if any(filters.values()):
+            key = (user_id, tuple(sorted(filters.items())))
+            total, exact = count_cache.get_or_set(key, lambda: count_documents(user_id, **filters)), False
+        else:
+            total, exact = get_user_stats(user_id)['total_documents'], True
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'documents': documents,
+        'next_cursor': next_cursor,
+        'total': total,
+        'total_exact': exact
+    })
+
+@app.route('/api/entities')
+def api_entities():
+    """Documents and facet counts for extracted entities (e.g. label=ORG&value=acme)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    user_id = session['user_id']
+    query = {
+        'label': request.args.get('label') or None,
+        'value': request.args.get('value') or None,
+        'prefix': request.args.get('match') == 'prefix'
+    }
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    try:
+        documents, next_cursor = find_documents_by_entity(
+            user_id, limit=limit, cursor=request.args.get('cursor'), **query
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'documents': [format_document(doc) for doc in documents],
+        'next_cursor': next_cursor,
+        'facets': get_entity_facets(user_id, **query)
+    })
+
 @app.route('/api/search')
 def api_search():
     """Search documents by filename, content, or tags."""
@@ -336,40 +578,44 @@ def api_search():
     status_filter = request.args.get('status', 'all')
     type_filter = request.args.get('type', 'all')
     date_filter = request.args.get('date', '')
-    
-    # Get all user documents
-    documents_raw = get_user_documents(user_id)
-    
-    # Apply filters
-    filtered_docs = []
-    for doc in documents_raw:
-        # Text search
-        if query and query.lower() not in doc['filename'].lower():
-            continue
-            
-        # Status filter
-        if status_filter != 'all' and doc['status'] != status_filter:
-            continue
-            
-        # Type filter
-        if type_filter != 'all' and doc['file_type'] != type_filter.lower():
-            continue
-            
-        # Date filter (simplified)
-        if date_filter:
-            doc_date = doc['upload_date'].split(' ')[0] if ' ' in doc['upload_date'] else doc['upload_date']
-            if doc_date != date_filter:
-                continue
-        
-        filtered_docs.append({
-            'id': doc['id'],
-            'name': doc['filename'],
-            'status': doc['status'],
-            'modified': doc['upload_date'],
-            'type': doc['file_type'].upper() if doc['file_type'] else 'FILE'
-        })
-    
-    return jsonify({'documents': filtered_docs})
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    filters = {
+        'status': None if status_filter == 'all' else status_filter,
+        'file_type': None if type_filter == 'all' else type_filter.lower(),
+        'date': date_filter or None
+    }
+
+    # facets=status,type,classification,month (default sab); khaali facets= ho to koi nahi
+    facet_names = request.args.get('facets', ','.join(SEARCH_FACETS))
+    facet_names = [f.strip() for f in facet_names.split(',') if f.strip()]
+
+    try:
+        facets = get_search_facets(user_id, query.strip() or None, facets=facet_names, **filters)
+        # Text query FTS5 index se BM25 ranking ke saath chalti hai
+        if query.strip():
+            documents_raw, total = search_documents(user_id, query, page=page, per_page=per_page, **filters)
+            return jsonify({
+                'documents': [dict(format_document(doc), snippet=doc['snippet'], score=round(doc['score'], 4))
+                              for doc in documents_raw],
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'facets': facets
+            })
+
+        # Sirf filters: SQL mein WHERE + keyset pagination (upload_date, id)
+        documents_raw, next_cursor = list_documents(
+            user_id, limit=per_page, cursor=request.args.get('cursor'), **filters
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'documents': [format_document(doc) for doc in documents_raw],
+        'next_cursor': next_cursor,
+        'facets': facets
+    })
 
 @app.route('/api/update_document/<int:doc_id>', methods=['POST'])
 def api_update_document(doc_id):
@@ -378,15 +624,20 @@ def api_update_document(doc_id):
         return jsonify({'error': 'Not logged in'}), 401
     
     user_id = session['user_id']
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     
     # Verify document belongs to user
     doc = get_document_by_id(doc_id)
-    if not doc or doc['user_id'] != user_id:
+    if not doc or doc['uploader_id'] != user_id:
         return jsonify({'error': 'Document not found'}), 404
     
-    # Update document (you'll need to implement this in database.py)
-    # For now, just return success
+    filename = data.get('filename')
+    if filename is not None:
+        filename = secure_filename(filename)
+        if not filename:
+            return jsonify({'error': 'Invalid filename'}), 400
+    update_document(doc_id, filename=filename, description=data.get('description'))
+    invalidate_user(user_id)
     return jsonify({'success': True, 'message': 'Document updated successfully'})
 
 @app.route('/api/delete_document/<int:doc_id>', methods=['DELETE'])
@@ -399,86 +650,38 @@ def api_delete_document(doc_id):
     
     # Verify document belongs to user
     doc = get_document_by_id(doc_id)
-    if not doc or doc['user_id'] != user_id:
+    if not doc or doc['uploader_id'] != user_id:
         return jsonify({'error': 'Document not found'}), 404
     
-    # Delete document (you'll need to implement this in database.py)
-    # For now, just return success
+    content_hash = delete_document(doc_id)
+    if content_hash:
+        storage.release(content_hash)
+    invalidate_user(user_id)
     return jsonify({'success': True, 'message': 'Document deleted successfully'})
-# app.py
-
-def process_document_with_ai(file_path, doc_id):
-    """Extracts text and entities from a document and saves the results."""
-    text = ""
-    file_type = file_path.split('.')[-1].lower()
-
-    try:
-        # 1. Extract Text (OCR for images, text extraction for PDF)
-        if file_type == 'pdf':
-            doc = fitz.open(file_path)
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-        elif file_type in ['png', 'jpg', 'jpeg', 'tiff']:
-            text = pytesseract.image_to_string(Image.open(file_path))
-
-        if not text:
-            return # Skip if no text could be extracted
-
-        # 2. Extract Entities using spaCy (if available)
-        entities = {}
-        if nlp:
-            doc_nlp = nlp(text)
-            for ent in doc_nlp.ents:
-                if ent.label_ not in entities:
-                    entities[ent.label_] = []
-                entities[ent.label_].append(ent.text)
-        
-        # Make entity lists unique
-        for label, items in entities.items():
-            entities[label] = list(set(items))
-
-        # 3. Save to Database
-        # (This is a simple classification, you can make it smarter)
-        classification = "Invoice" if "invoice" in text.lower() else "General Document"
-        
-        # Import the function from your database file
-        from database import create_idp_result
-        create_idp_result(doc_id, classification, entities, status='Success')
-        print(f"IDP Processing successful for doc_id: {doc_id}")
 
-    except Exception as e:
-        print(f"Error during AI processing for {file_path}: {e}")
-        from database import create_idp_result
-        create_idp_result(doc_id, "Unknown", {}, status='Failed')
-# app.py
-
-@app.route('/api/charts/document_status')
-def chart_document_status():
-    """Provides data for the document status pie chart."""
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authorized'}), 401
-
-    status_counts = get_document_status_counts()
-
-    labels = list(status_counts.keys())
-    data = list(status_counts.values())
-
-    # --- YEH HAI FIX ---
-    # Ek JSON response banayein aur usmein caching ko disable karne ke liye headers add karein
-    response_data = jsonify({
-        'labels': labels,
-        'data': data
-    })
-
-    response = make_response(response_data)
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-
-    return response
-    # --- FIX END ---
-   
+@app.cli.command('archive-audit')
+@click.option('--days', default=audit.AUDIT_RETENTION_DAYS, show_default=True,
+              help='Isse purane audit rows archive honge.')
+def archive_audit_command(days):
+    """Purane audit_log rows ko monthly compressed archive files mein move karta hai."""
+    moved = audit.archive_old_entries(retention_days=days)
+    print(f"Archived {moved} audit log entries older than {days} days.")
+
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Dashboard stats aur charts ke status rollups documents table se dobara banata hai."""
+    drifted = rebuild_status_rollups()
+    print(f"Document counters rebuilt ({drifted} user(s) had drifted).")
+
+@app.cli.command('reprocess')
+@click.option('--processes', default=os.cpu_count() or 1, show_default=True, help='Parallel worker processes.')
+@click.option('--batch-size', default=reprocess.BATCH_SIZE, show_default=True, help='Documents per batch.')
+@click.option('--stale-before', default=None, help='Is UTC timestamp se purane results bhi dobara banenge.')
+@click.option('--restart', is_flag=True, help='Saved checkpoint ko ignore karta hai.')
+def reprocess_command(processes, batch_size, stale_before, restart):
+    """Purane documents ke IDP results current pipeline version se backfill karta hai."""
+    reprocess.reprocess(processes, batch_size, stale_before, restart=restart,
+                        upload_folder=app.config['UPLOAD_FOLDER'])
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,325 @@
+"""
+Batched audit-log writer.
+
+Entries are queued in memory and a background thread writes them with one
+executemany per transaction, flushing when a batch fills or the flush
+interval passes. AUDIT_MODE picks the durability trade-off:
+
+    sync   - write and commit inside the caller, one transaction per entry
+    group  - queue, then wait until the batch holding the entry is committed
+             (concurrent requests share one commit)
+    async  - queue and return at once; up to AUDIT_FLUSH_INTERVAL of entries
+             can be lost if the process dies
+
+Rows older than AUDIT_RETENTION_DAYS are moved out of the live table into
+monthly gzip'd JSONL files by archive_old_entries(); query() reads across
+both so audits don't need to know where a row lives.
+"""
+import atexit
+import gzip
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from database import add_audit_logs, delete_audit_logs, get_audit_logs, get_pool
+
+AUDIT_MODE = 'group'
+AUDIT_MODES = ('sync', 'group', 'async')
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0
+AUDIT_QUEUE_SIZE = 10000
+
+# Retention: isse purane rows monthly archive files mein chale jaate hain
+AUDIT_RETENTION_DAYS = 90
+AUDIT_ARCHIVE_DIR = os.path.join('archive', 'audit')
+AUDIT_ARCHIVE_BATCH = 5000
+# query() live table ko itne rows ke pages mein padhta hai
+AUDIT_QUERY_PAGE = 500
+
+_STOP = object()
+
+def _utc_timestamp(delta=timedelta()):
+    """UTC 'YYYY-MM-DD HH:MM:SS', same format as CURRENT_TIMESTAMP."""
+    return (datetime.now(timezone.utc) - delta).strftime('%Y-%m-%d %H:%M:%S')
+
+class _Waiter:
+    """Lets a group-mode caller (or flush) block until its batch is committed."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+class AuditSink:
+    """Queues audit entries and writes them in batches from one thread."""
+
+    def __init__(self, mode=AUDIT_MODE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, queue_size=AUDIT_QUEUE_SIZE):
+        if mode not in AUDIT_MODES:
+            raise ValueError(f"Unknown audit mode: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def log(self, user_id, action, target_type, target_id, details=None):
+        """Records one audit entry according to the sink's mode."""
+        # Timestamp abhi lete hain, flush ke time nahi
+        entry = (user_id, action, target_type, target_id, details, _utc_timestamp())
+        if self.mode == 'sync':
+            add_audit_logs([entry])
+            return
+
+        self._ensure_thread()
+        waiter = _Waiter() if self.mode == 'group' else None
+        # Queue bhari ho to caller ruk jaata hai (backpressure), entry drop nahi hoti
+        self._queue.put((entry, waiter))
+        if waiter:
+            waiter.done.wait()
+            if waiter.error:
+                raise waiter.error
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is committed."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        waiter = _Waiter()
+        self._queue.put((None, waiter))
+        waiter.done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flushes pending entries and stops the writer thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._queue.put((_STOP, None))
+        thread.join(timeout)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _connection(self):
+        """Writer ka apna connection, taaki pool ke saare slots busy hon tab bhi flush ho sake.
+
+        Group mode mein requests apna pooled connection pakde hue wait karti hain.
+        """
+        pool = get_pool()
+        if self._conn is None or self._conn.pool is not pool:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = pool.dedicated_connection()
+        return self._conn
+
+    def _next_batch(self):
+        """Waits for the first entry, then collects more until the batch is full.
+
+        async mode waits up to flush_interval for the batch to fill; group mode
+        only takes what is already queued so callers are not kept waiting.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1][0] is not _STOP and batch[-1][0] is not None:
+            try:
+                if self.mode == 'async':
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            entries = [entry for entry, _ in batch if entry is not None and entry is not _STOP]
+            error = None
+            if entries:
+                try:
+                    add_audit_logs(entries, conn=self._connection())
+                except Exception as e:
+                    print(f"Audit log flush failed, {len(entries)} entries lost: {e}")
+                    error = e
+            for entry, waiter in batch:
+                if waiter:
+                    waiter.error = error if entry is not None else None
+                    waiter.done.set()
+            if batch[-1][0] is _STOP:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+                return
+
+sink = AuditSink()
+
+def configure(mode=AUDIT_MODE, batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL):
+    """Replaces the process-wide sink, committing whatever the old one had queued."""
+    global sink
+    old, sink = sink, AuditSink(mode, batch_size, flush_interval)
+    old.close()
+
+def _reset_after_fork():
+    """Parent ki queue aur writer thread child process mein kaam ke nahi."""
+    global sink
+    sink = AuditSink(sink.mode, sink.batch_size, sink.flush_interval)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def log(user_id, action, target_type, target_id, details=None):
+    """Records an audit entry on the process-wide sink."""
+    sink.log(user_id, action, target_type, target_id, details)
+
+def flush(timeout=None):
+    """Commits everything queued on the process-wide sink."""
+    sink.flush(timeout)
+
+def close():
+    """Shutdown par queued entries commit karke writer band karta hai."""
+    sink.close()
+
+atexit.register(close)
+
+
+def archive_path(month, archive_dir=AUDIT_ARCHIVE_DIR):
+    """Archive file for a 'YYYY-MM' month."""
+    return os.path.join(archive_dir, f"audit-{month}.jsonl.gz")
+
+def _append_archive(path, rows):
+    """Appends rows as a new gzip member and fsyncs before the caller deletes them."""
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+            for row in rows:
+                gz.write((json.dumps(row) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+def archive_old_entries(retention_days=AUDIT_RETENTION_DAYS, archive_dir=AUDIT_ARCHIVE_DIR,
+                        batch_size=AUDIT_ARCHIVE_BATCH):
+    """Moves audit rows older than retention_days into monthly archive files.
+
+    Rows are written (and fsynced) before being deleted, so a crash can at
+    worst leave a row in both places; query() skips such duplicates.
+    Returns the number of rows moved.
+    """
+    flush()
+    cutoff = _utc_timestamp(timedelta(days=retention_days))
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+    while True:
+        rows = get_audit_logs(end=cutoff, limit=batch_size)
+        if not rows:
+            return moved
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['timestamp'][:7], []).append(row)
+        for month, month_rows in sorted(by_month.items()):
+            _append_archive(archive_path(month, archive_dir), month_rows)
+        delete_audit_logs([row['id'] for row in rows])
+        moved += len(rows)
+
+def _archive_months(start, end, archive_dir):
+    """Archive files whose month overlaps [start, end), oldest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        if name.startswith('audit-') and name.endswith('.jsonl.gz'):
+            month = name[len('audit-'):-len('.jsonl.gz')]
+            if (start is None or month >= start[:7]) and (end is None or month <= end[:7]):
+                months.append(month)
+    return sorted(months)
+
+def _key(row):
+    return (row['timestamp'], row['id'])
+
+def _live_rows(start, end, filters, after, desc, page_size=AUDIT_QUERY_PAGE):
+    """Pages through the live table by keyset, so only one page is in memory at a time."""
+    while True:
+        rows = get_audit_logs(start, end, limit=page_size, after=after, desc=desc, **filters)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = _key(rows[-1])
+
+def _month_rows(month, archive_dir, keep):
+    """Streams one month file oldest first, yielding rows for which keep(row) is true.
+
+    Batches are archived in (timestamp, id) order, so the file is already
+    sorted; a row out of order can only be a crash duplicate and is skipped.
+    """
+    last = None
+    with gzip.open(archive_path(month, archive_dir), 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if last is not None and _key(row) <= last:
+                continue
+            last = _key(row)
+            if keep(row):
+                yield row
+
+def _archive_rows(months, archive_dir, keep, desc, limit):
+    """Rows from the month files in the requested order.
+
+    Newest-first needs each month reversed; with a limit only the last
+    limit matching rows of a month are held, otherwise the month's matches.
+    """
+    if not desc:
+        for month in months:
+            yield from _month_rows(month, archive_dir, keep)
+        return
+    for month in reversed(months):
+        rows = deque(_month_rows(month, archive_dir, keep), maxlen=limit)
+        while rows:
+            yield rows.pop()
+
+def query(start=None, end=None, user_id=None, action=None, target_type=None, target_id=None,
+          archive_dir=AUDIT_ARCHIVE_DIR, after=None, desc=False, limit=None):
+    """Yields audit entries in [start, end) from the archives and the live table.
+
+    start and end are 'YYYY-MM-DD[ HH:MM:SS]' strings (UTC); the other filters
+    match audit_log columns exactly. Entries come oldest first, or newest
+    first with desc; after is a (timestamp, id) keyset from the last entry
+    of a previous page. Both sources are streamed and merged, so memory
+    stays bounded by a page (plus limit rows per month for desc).
+    """
+    flush()
+    filters = {'user_id': user_id, 'action': action, 'target_type': target_type, 'target_id': target_id}
+    wanted = {k: v for k, v in filters.items() if v is not None}
+
+    def keep(row):
+        if (start and row['timestamp'] < start) or (end and row['timestamp'] >= end):
+            return False
+        if after is not None and (_key(row) >= tuple(after) if desc else _key(row) <= tuple(after)):
+            return False
+        return all(row.get(k) == v for k, v in wanted.items())
+
+    months = _archive_months(start, end, archive_dir)
+    if after is not None:
+        # Cursor ke peeche wale months padhne ki zaroorat nahi
+        months = [m for m in months if (m <= after[0][:7] if desc else m >= after[0][:7])]
+    archived = _archive_rows(months, archive_dir, keep, desc, limit)
+    live = _live_rows(start, end, filters, after, desc, min(limit or AUDIT_QUERY_PAGE, AUDIT_QUERY_PAGE))
+    last_id = emitted = 0
+    for row in heapq.merge(archived, live, key=_key, reverse=desc):
+        # Crash ke baad archive aur live table dono mein bacha row merge mein saath-saath aata hai
+        if row['id'] == last_id:
+            continue
+        last_id = row['id']
+        yield row
+        emitted += 1
+        if limit is not None and emitted >= limit:
+            return
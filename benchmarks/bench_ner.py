@@ -0,0 +1,66 @@
+"""
+NER throughput benchmark: per-document nlp(text) vs batched nlp.pipe.
+
+    python benchmarks/bench_ner.py --docs 200 --batch-size 32
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spacy
+from idp import extract_entities_batch, load_ner_model
+
+WORDS = ("Kochi Metro Rail Limited invoice purchase order signed by Anurag Singh on "
+         "12 March 2024 for 45,000 rupees at Aluva station safety circular drawing").split()
+
+def make_texts(count, words_per_doc):
+    rng = random.Random(42)
+    return [' '.join(rng.choice(WORDS) for _ in range(words_per_doc)) + '.' for _ in range(count)]
+
+def load_models(name):
+    """Returns (full pipeline, NER-only pipeline); falls back to an untrained ner."""
+    try:
+        return spacy.load(name), load_ner_model(name)
+    except OSError:
+        print(f"Model '{name}' not installed, using blank 'en' + untrained ner")
+        model = spacy.blank('en')
+        model.add_pipe('ner')
+        model.initialize()
+        return model, model
+
+def per_doc(model, texts):
+    for text in texts:
+        doc = model(text)
+        [ent.text for ent in doc.ents]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='en_core_web_sm')
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--words', type=int, default=400)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    full, trimmed = load_models(args.model)
+    texts = make_texts(args.docs, args.words)
+    per_doc(full, texts[:10])  # warm up
+
+    start = time.perf_counter()
+    per_doc(full, texts)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extract_entities_batch(texts, model=trimmed, batch_size=args.batch_size, n_process=args.processes)
+    after = time.perf_counter() - start
+
+    print(f"per-doc nlp(text):     {args.docs / before:8.1f} docs/sec")
+    print(f"batched nlp.pipe:      {args.docs / after:8.1f} docs/sec")
+    print(f"speedup:               {before / after:8.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+PDF text extraction benchmark: string concatenation vs page-range process pool.
+
+    python benchmarks/bench_pdf_extract.py --pages 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+import idp
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    line = "KMRL maintenance manual section with safety instructions and part numbers. "
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 756), f"Page {i}\n" + line * 40)
+    doc.save(path)
+
+def concat(path):
+    text = ""
+    doc = fitz.open(path)
+    for page in doc:
+        text += page.get_text()
+    doc.close()
+    return text
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    idp.PDF_PROCESSES = args.processes
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'manual.pdf')
+        make_pdf(path, args.pages)
+        idp.extract_text(path)  # warm up the process pool
+
+        start = time.perf_counter()
+        before = concat(path)
+        concat_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        after = idp.extract_text(path)
+        pool_time = time.perf_counter() - start
+
+    assert before == after
+    print(f"text += page.get_text():   {concat_time * 1000:8.1f} ms")
+    print(f"page ranges, {args.processes} processes: {pool_time * 1000:8.1f} ms")
+    print(f"speedup:                   {concat_time / pool_time:8.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Startup benchmark: wall time and peak RSS of `import app` in a fresh interpreter.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('fitz', 'pytesseract', 'PIL.Image', 'spacy') if m in sys.modules]
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, ','.join(heavy))
+"""
+
+def measure(module, runs):
+    times, rss = [], []
+    heavy = ''
+    with tempfile.TemporaryDirectory() as cwd:  # app.py creates uploads/ and the DB in cwd
+        env = dict(os.environ, PYTHONPATH=REPO)
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, '-c', PROBE.format(module=module)],
+                cwd=cwd, env=env, capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1].split(' ')
+            times.append(float(out[0]))
+            rss.append(int(out[1]) / 1024)
+            heavy = out[2] if len(out) > 2 else ''
+    return statistics.median(times), statistics.median(rss), heavy
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('modules', nargs='*', default=['app'])
+    args = parser.parse_args()
+    for module in args.modules:
+        elapsed, rss, heavy = measure(module, args.runs)
+        print(f"import {module:8} {elapsed * 1000:8.1f} ms  {rss:7.1f} MB peak RSS  heavy loaded: {heavy or 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+In-process response caches for KMRL DMS dashboard payloads.
+
+Each cache is an LRU with a TTL. Write paths invalidate entries explicitly;
+the TTL only bounds staleness for writes from other processes (e.g. other
+gunicorn workers) and for audit events that do not invalidate.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, build):
+        """Returns the cached value, building and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def etag_for(value):
+    """Stable ETag for a JSON-serialisable value."""
+    raw = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha1(raw).hexdigest()
+
+# Per-user dashboard data (stats + documents), key = user_id
+dashboard_cache = TTLCache(maxsize=1024, ttl=60)
+# Filtered document counts for /api/documents, key = (user_id, filters)
+count_cache = TTLCache(maxsize=4096, ttl=30)
+# Recent activity feed sab users ke liye same hai, isliye ek shared entry
+activity_cache = TTLCache(maxsize=4, ttl=5)
+
+def invalidate_user(user_id):
+    """Drops a user's cached dashboard and the shared activity feed."""
+    dashboard_cache.invalidate(user_id)
+    activity_cache.clear()
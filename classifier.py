@@ -0,0 +1,114 @@
+"""
+Rule-based document classification for the IDP pipeline.
+
+A rule set maps each class to weighted keyword/regex patterns. All patterns
+are compiled into a single alternation anchored at word starts, so a
+document is scanned once no matter how many classes or patterns there are,
+and the per-class hit weights give both the label and a confidence score.
+
+Any object with classify_batch(texts) -> [(label, confidence), ...] can be
+plugged in with set_classifier().
+"""
+import re
+
+DEFAULT_LABEL = "General Document"
+
+# Class dar class (pattern, weight). Patterns lowercase mein, word ke shuru se match hote hain,
+# aur sirf non-capturing groups (?:...) chalenge. Ek position par pehla matching pattern
+# jeetta hai, isliye specific patterns pehle. Word end par \b hai, isliye plural/-ed forms
+# pattern mein likhne padte hain (jaise invoice[sd]?).
+DEFAULT_RULES = {
+    "Invoice": [
+        (r"invoice\s+(?:no|number|date)\b", 4.0),
+        (r"(?:tax\s+)?invoice[sd]?\b", 3.0),
+        (r"amount\s+(?:due|payable)\b", 2.0),
+        (r"bill\s+to\b", 1.5),
+        (r"gstin\b", 1.0),
+        (r"(?:cgst|sgst|igst)\b", 1.0),
+    ],
+    "Purchase Order": [
+        (r"purchase\s+orders?\b", 3.0),
+        (r"p\.?\s?o\.?\s+(?:no|number)\b", 2.0),
+        (r"delivery\s+(?:schedules?|terms|dates?)\b", 1.5),
+        (r"vendor\s+(?:codes?|names?)\b", 1.0),
+        (r"terms\s+and\s+conditions\b", 0.5),
+    ],
+    "Safety Circular": [
+        (r"safety\s+circulars?\b", 3.0),
+        (r"circular\s+(?:no|number)\b", 2.0),
+        (r"(?:all\s+staff|all\s+concerned)\b", 1.0),
+        (r"(?:hazard|precaution|ppe|protective\s+equipment)s?\b", 1.0),
+        (r"(?:accident|incident)\s+reports?\b", 1.0),
+    ],
+    "Drawing": [
+        (r"(?:drawing|drg)s?\.?\s+(?:no|number)s?\b", 3.0),
+        (r"scale\s+1\s?:\s?\d+\b", 2.0),
+        (r"sheet\s+\d+\s+of\s+\d+\b", 1.5),
+        (r"(?:elevation|cross[\s-]section|plan\s+view)s?\b", 1.0),
+        (r"rev(?:ision)?\.?\s+[a-z0-9]\b", 0.5),
+    ],
+}
+
+# Sirf shuru ke itne characters scan hote hain; document type wahin se pata chal jaata hai
+CLASSIFY_MAX_CHARS = 50000
+# Ek kamzor hit par 100% confidence na aaye, isliye denominator mein prior
+CONFIDENCE_PRIOR = 1.0
+
+class RuleClassifier:
+    """Scores every class in one regex pass per document."""
+
+    def __init__(self, rules=DEFAULT_RULES, default_label=DEFAULT_LABEL,
+                 max_chars=CLASSIFY_MAX_CHARS, prior=CONFIDENCE_PRIOR):
+        self.labels = list(rules)
+        self.default_label = default_label
+        self.max_chars = max_chars
+        self.prior = prior
+        parts = []
+        # group number -> (class index, weight)
+        self._groups = [None]
+        for class_index, label in enumerate(self.labels):
+            for pattern, weight in rules[label]:
+                if re.compile(pattern).groups:
+                    raise ValueError(f"Pattern for {label!r} must not use capturing groups: {pattern}")
+                parts.append(f"({pattern})")
+                self._groups.append((class_index, weight))
+        # Sirf word starts par alternation try hoti hai; IGNORECASE ki jagah scanned hissa
+        # ek baar lowercase hota hai, jo sre ke liye kaafi tez hai
+        self._regex = re.compile(r"(?=\w)\b(?:" + '|'.join(parts) + ")")
+
+    def scores(self, text):
+        """Summed pattern weights per class for one text."""
+        totals = [0.0] * len(self.labels)
+        for match in self._regex.finditer(text[:self.max_chars].lower()):
+            class_index, weight = self._groups[match.lastindex]
+            totals[class_index] += weight
+        return totals
+
+    def classify(self, text):
+        """Returns (label, confidence) for one text; confidence is in [0, 1)."""
+        totals = self.scores(text)
+        best = max(range(len(totals)), key=totals.__getitem__, default=None)
+        if best is None or totals[best] == 0:
+            return self.default_label, 0.0
+        return self.labels[best], round(totals[best] / (sum(totals) + self.prior), 4)
+
+    def classify_batch(self, texts):
+        return [self.classify(text) for text in texts]
+
+_classifier = None
+
+def get_classifier():
+    """Process-wide classifier, compiled from DEFAULT_RULES on first use."""
+    global _classifier
+    if _classifier is None:
+        _classifier = RuleClassifier()
+    return _classifier
+
+def set_classifier(classifier):
+    """Plugs in a different classifier (anything with classify_batch)."""
+    global _classifier
+    _classifier = classifier
+
+def classify_batch(texts):
+    """Classifies many texts with the current classifier."""
+    return get_classifier().classify_batch(texts)
@@ -1,14 +1,270 @@
+import base64
+import html
 import json
+import os
+import queue
 import sqlite3
+import threading
+from datetime import datetime, timedelta
+from flask import g, has_app_context
 from werkzeug.security import generate_password_hash
+import events
 
 DATABASE_NAME = 'database.db'
 
+# Connection pool settings
+POOL_MAX_SIZE = 8
+POOL_TIMEOUT = 30.0
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+# True: dashboard stats doc_status_by_uploader/doc_status_daily rollups (triggers se sync) se
+# O(1) mein padhe jaate hain; False: documents table par ek grouped query
+USE_STATUS_ROLLUPS = True
+
+def _convert_timestamp(value):
+    """SQLite converter: 'YYYY-MM-DD HH:MM:SS' text -> datetime."""
+    return datetime.fromisoformat(value.decode())
+
+# Query mein 'col AS "col [timestamp_dt]"' likhne par value datetime ban kar aati hai
+sqlite3.register_converter('timestamp_dt', _convert_timestamp)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection jo yaad rakhta hai ki wo kis pool ka hai."""
+    pool = None
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of configured SQLite connections."""
+
+    def __init__(self, database, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'checkouts': 0, 'waits': 0, 'in_use': 0, 'peak_in_use': 0}
+
+    def _connect(self):
+        """Naya connection kholta hai aur PRAGMAs sirf ek baar set karta hai."""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=PooledConnection,
+            detect_types=sqlite3.PARSE_COLNAMES,
+        )
+        conn.pool = self
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def dedicated_connection(self):
+        """Pool slot liye bina ek configured connection, long-lived background writers ke liye.
+
+        Caller hi ise close karta hai.
+        """
+        return self._connect()
+
+    def acquire(self):
+        """Pool se ek connection nikalta hai, zarurat ho to wait karta hai."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['waits'] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise TimeoutError(f"No database connection available after {self.timeout}s")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+        return conn
+
+    def release(self, conn):
+        """Connection ko wapas pool mein rakhta hai."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        with self._lock:
+            self._stats['in_use'] -= 1
+        self._slots.release()
+
+    def close(self):
+        """Saare idle connections band karta hai."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        """Pool usage counters ka snapshot."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['idle'] = self._idle.qsize()
+        snapshot['max_size'] = self.max_size
+        return snapshot
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Current DATABASE_NAME ke liye shared pool return karta hai."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database != DATABASE_NAME:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE_NAME)
+        return _pool
+
+def _reset_pool_after_fork():
+    """Fork ke baad child process parent ke connections share nahi karta."""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def get_pool_stats():
+    """Connection pool ke stats (checkouts, waits, peak in use)."""
+    return get_pool().stats()
+
 def get_db_connection():
-    """Database se connection banata hai."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Database connection deta hai; Flask request ke andar ek hi connection reuse hota hai."""
+    pool = get_pool()
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None or conn.pool is not pool:
+            close_request_connection()
+            conn = g._db_conn = pool.acquire()
+        return conn
+    return pool.acquire()
+
+def release_db_connection(conn):
+    """Request ke bahar liya gaya connection pool ko wapas karta hai."""
+    if has_app_context() and g.get('_db_conn') is conn:
+        return
+    conn.pool.release(conn)
+
+def close_request_connection(exception=None):
+    """app.teardown_appcontext hook: request ka connection pool ko lautata hai."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.pool.release(conn)
+
+def _add_column_if_missing(cursor, table, column, definition):
+    """Purane databases mein nayi column jodta hai (CREATE TABLE IF NOT EXISTS ise nahi karta)."""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+def _sync_triggers(cursor, triggers, obsolete=()):
+    """CREATE TRIGGER statements ko database se milata hai.
+
+    Sirf wahi trigger dobara banta hai jiska sqlite_master wala sql alag hai,
+    aur saare drop/create ek BEGIN IMMEDIATE transaction mein hote hain: beech
+    mein kisi doosre process ka insert trigger ke bina nahi chal sakta.
+    """
+    existing = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    statements = []
+    for sql in triggers:
+        sql = sql.strip()
+        name = sql.split()[2]
+        if existing.get(name) != sql:
+            statements.append(f"DROP TRIGGER IF EXISTS {name};\n{sql};")
+    statements.extend(f"DROP TRIGGER {name};" for name in obsolete if name in existing)
+    if statements:
+        cursor.executescript("BEGIN IMMEDIATE;\n" + "\n".join(statements) + "\nCOMMIT;")
+
+def _rebuild_search_index(cursor):
+    """documents_fts ka index documents_search view (documents, tags, latest IDP result) se dobara banata hai."""
+    cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+
+_FTS_COLUMNS = "filename, description, tags, content, entities"
+
+def _fts_reindex_sql(op, id_expr):
+    """Trigger statement for documents_fts: 'delete' drops a document's current
+    documents_search row from the index, 'insert' adds it back."""
+    if op == 'delete':
+        return (f"INSERT INTO documents_fts (documents_fts, rowid, {_FTS_COLUMNS}) "
+                f"SELECT 'delete', id, {_FTS_COLUMNS} FROM documents_search WHERE id = {id_expr};")
+    return (f"INSERT INTO documents_fts (rowid, {_FTS_COLUMNS}) "
+            f"SELECT id, {_FTS_COLUMNS} FROM documents_search WHERE id = {id_expr};")
+
+# Rollups documents table se kya hone chahiye: maujooda status counts, aur per day
+# 'Uploaded' events plus har non-Pending document ka status jis din set hua.
+# Rebuild aur drift check dono yahi queries use karte hain.
+_STATUS_COUNTS_SQL = "SELECT uploader_id, status, COUNT(*) FROM documents GROUP BY uploader_id, status"
+_STATUS_DAILY_SQL = """
+    SELECT uploader_id, date(upload_date), 'Uploaded', COUNT(*) FROM documents
+    GROUP BY uploader_id, date(upload_date)
+    UNION ALL
+    SELECT uploader_id, date(status_changed_at), status, COUNT(*) FROM documents
+    WHERE status != 'Pending' AND status_changed_at IS NOT NULL
+    GROUP BY uploader_id, date(status_changed_at), status"""
+
+def _rebuild_status_rollups(cursor):
+    """Status rollup tables ko documents table se dobara banata hai."""
+    cursor.execute("DELETE FROM doc_status_by_uploader")
+    cursor.execute("DELETE FROM doc_status_daily")
+    cursor.execute(f"INSERT INTO doc_status_by_uploader (uploader_id, status, count) {_STATUS_COUNTS_SQL}")
+    cursor.execute(f"INSERT INTO doc_status_daily (uploader_id, day, status, count) {_STATUS_DAILY_SQL}")
+
+def normalize_entity(value):
+    """Entity value ka lookup form: casefold, whitespace collapse, kinaron ki punctuation hatao."""
+    return ' '.join(str(value).casefold().split()).strip(' .,;:()[]{}"\'')
+
+def _entity_rows(document_id, extracted_data):
+    """(document_id, label, value, value_norm) rows for an entities dict, deduplicated."""
+    rows = {}
+    for label, values in (extracted_data or {}).items():
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, (list, tuple, set)):
+            continue
+        for value in values:
+            value_norm = normalize_entity(value)
+            if value_norm:
+                rows.setdefault((label, value_norm), (document_id, label, str(value).strip(), value_norm))
+    return list(rows.values())
+
+def _rebuild_entity_index(cursor):
+    """document_entities ko har document ke latest successful IDP result se bharta hai."""
+    cursor.execute("DELETE FROM document_entities")
+    results = cursor.execute(
+        """SELECT ir.document_id, ir.extracted_data FROM idp_results ir
+           WHERE ir.status = 'Success' AND ir.id = (SELECT MAX(id) FROM idp_results
+                                                    WHERE document_id = ir.document_id AND status = 'Success')"""
+    ).fetchall()
+    for document_id, extracted_data in results:
+        try:
+            data = json.loads(extracted_data) if extracted_data else {}
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            cursor.executemany(_INSERT_ENTITY_SQL, _entity_rows(document_id, data))
+
+_INSERT_ENTITY_SQL = """INSERT OR IGNORE INTO document_entities (document_id, label, value, value_norm)
+                        VALUES (?, ?, ?, ?)"""
 
 def init_db():
     """Database tables ko initialize karta hai, agar wo exist nahi karti hain."""
@@ -146,6 +402,259 @@ def init_db():
         )
     ''')
     
+    # IDP Jobs table (background processing queue)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idp_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            locked_by TEXT,
+            locked_at TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (document_id) REFERENCES documents (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idp_jobs_claim ON idp_jobs (status, run_after)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idp_jobs_document ON idp_jobs (document_id)")
+    
+    # Blobs table (content-addressed upload storage)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            storage_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _add_column_if_missing(cursor, 'documents', 'content_hash', 'TEXT')
+    # Status kab badla; last_modified rename/description edit par bhi badalta hai. Purane
+    # documents ke liye last_modified hi sabse achha andaaza hai.
+    if _add_column_if_missing(cursor, 'documents', 'status_changed_at', 'TIMESTAMP'):
+        cursor.execute("""UPDATE documents SET status_changed_at = coalesce(last_modified, upload_date)
+                          WHERE status != 'Pending'""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)")
+    
+    # Upload Sessions table (chunked, resumable uploads)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            file_type TEXT,
+            total_size INTEGER,
+            received INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    _add_column_if_missing(cursor, 'idp_results', 'extracted_text', 'TEXT')
+    # Entity values ek space-separated string mein: FTS5 external content view mein
+    # json_tree jaisa table-valued function nahi chal sakta
+    if _add_column_if_missing(cursor, 'idp_results', 'entity_text', 'TEXT'):
+        cursor.execute("""UPDATE idp_results SET entity_text = (
+                              SELECT group_concat(value, ' ') FROM json_tree(idp_results.extracted_data)
+                              WHERE type = 'text')""")
+    # Result kis pipeline version ne kis content (sha256) par banaya; same (hash, version) dobara process nahi hota
+    _add_column_if_missing(cursor, 'idp_results', 'pipeline_version', 'TEXT')
+    if _add_column_if_missing(cursor, 'idp_results', 'content_hash', 'TEXT'):
+        cursor.execute("""UPDATE idp_results SET content_hash = (
+                              SELECT content_hash FROM documents WHERE id = idp_results.document_id)""")
+
+    # Indexes for per-user listing/search filters (rowid id har index ke end mein hota hai)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploader_date ON documents (uploader_id, upload_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploader_status_date ON documents (uploader_id, status, upload_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploader_type_date ON documents (uploader_id, file_type, upload_date)")
+    # Admin pending queue: WHERE status = 'Pending' ORDER BY upload_date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_status_date ON documents (status, upload_date)")
+    # Document ka latest successful IDP result (facets, clone, entity rebuild)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idp_results_document_status ON idp_results (document_id, status, id)")
+    # Skip-if-current lookup: is content ka is pipeline version wala result pehle se hai?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idp_results_hash_version ON idp_results (content_hash, pipeline_version, status)")
+    # Activity feed (ORDER BY timestamp DESC) aur retention/archival ke range scans
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log (timestamp)")
+
+    # Purane Python-maintained counters; dashboard stats ab neeche ke rollups se aate hain
+    cursor.execute("DROP TABLE IF EXISTS user_doc_counters")
+
+    # Status rollups: status counts per uploader, aur per day status events ('Uploaded' = naya document).
+    # Triggers inhe documents ke saath sync rakhte hain; dashboard stats aur charts dono
+    # sirf inka chhota indexed read karte hain.
+    rollups_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'doc_status_by_uploader'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doc_status_by_uploader (
+            uploader_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (uploader_id, status)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doc_status_daily (
+            uploader_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (uploader_id, day, status)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_doc_status_daily_day ON doc_status_daily (day, status)")
+    _sync_triggers(cursor, [
+        """CREATE TRIGGER documents_rollup_insert AFTER INSERT ON documents BEGIN
+            INSERT INTO doc_status_by_uploader (uploader_id, status, count) VALUES (new.uploader_id, new.status, 1)
+            ON CONFLICT (uploader_id, status) DO UPDATE SET count = count + 1;
+            INSERT INTO doc_status_daily (uploader_id, day, status, count)
+            VALUES (new.uploader_id, date(coalesce(new.upload_date, 'now')), 'Uploaded', 1)
+            ON CONFLICT (uploader_id, day, status) DO UPDATE SET count = count + 1;
+        END""",
+        # Daily rollup mein document sirf apne maujooda status ke din gina jaata hai
+        """CREATE TRIGGER documents_rollup_status AFTER UPDATE OF status ON documents
+        WHEN old.status IS NOT new.status BEGIN
+            UPDATE doc_status_by_uploader SET count = count - 1
+            WHERE uploader_id = old.uploader_id AND status = old.status;
+            INSERT INTO doc_status_by_uploader (uploader_id, status, count) VALUES (new.uploader_id, new.status, 1)
+            ON CONFLICT (uploader_id, status) DO UPDATE SET count = count + 1;
+            UPDATE doc_status_daily SET count = count - 1
+            WHERE old.status != 'Pending' AND uploader_id = old.uploader_id
+              AND day = date(old.status_changed_at) AND status = old.status;
+            INSERT INTO doc_status_daily (uploader_id, day, status, count)
+            SELECT new.uploader_id, date('now'), new.status, 1 WHERE new.status != 'Pending'
+            ON CONFLICT (uploader_id, day, status) DO UPDATE SET count = count + 1;
+            UPDATE documents SET status_changed_at = CURRENT_TIMESTAMP WHERE id = new.id;
+        END""",
+        # Delete par events bhi wapas, taaki rollups rebuild (jo sirf maujooda documents ginta hai) se match karein
+        """CREATE TRIGGER documents_rollup_delete AFTER DELETE ON documents BEGIN
+            UPDATE doc_status_by_uploader SET count = count - 1
+            WHERE uploader_id = old.uploader_id AND status = old.status;
+            UPDATE doc_status_daily SET count = count - 1
+            WHERE uploader_id = old.uploader_id AND day = date(old.upload_date) AND status = 'Uploaded';
+            UPDATE doc_status_daily SET count = count - 1
+            WHERE old.status != 'Pending' AND uploader_id = old.uploader_id
+              AND day = date(old.status_changed_at) AND status = old.status;
+        END""",
+    ])
+    if not rollups_exist:
+        _rebuild_status_rollups(cursor)
+
+    # Normalized entity store: "vendor X ka zikr kin documents mein hai" index se answer hota hai
+    entities_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_entities'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_entities (
+            document_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            value TEXT NOT NULL,
+            value_norm TEXT NOT NULL,
+            PRIMARY KEY (label, value_norm, document_id),
+            FOREIGN KEY (document_id) REFERENCES documents (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_entities_document ON document_entities (document_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_document_entities_value ON document_entities (value_norm)")
+    if not entities_exist:
+        _rebuild_entity_index(cursor)
+
+    # Har document ka latest successful IDP result; document_id PRIMARY KEY hai, isliye pointer ek hi hota hai
+    latest_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'idp_latest'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idp_latest (
+            document_id INTEGER PRIMARY KEY,
+            result_id INTEGER NOT NULL,
+            FOREIGN KEY (document_id) REFERENCES documents (id),
+            FOREIGN KEY (result_id) REFERENCES idp_results (id)
+        )
+    ''')
+    if not latest_exists:
+        cursor.execute("""INSERT INTO idp_latest (document_id, result_id)
+                          SELECT document_id, MAX(id) FROM idp_results WHERE status = 'Success'
+                          GROUP BY document_id""")
+
+    # Full-text search index (rowid = documents.id). External content: text sirf
+    # idp_results.extracted_text mein rehta hai, FTS sirf index rakhta hai aur snippet()
+    # documents_search view se padhta hai. Purani content-storing table hata di jaati hai.
+    fts_sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'documents_fts'"
+    ).fetchone()
+    fts_current = fts_sql is not None and 'documents_search' in fts_sql[0]
+    if fts_sql is not None and not fts_current:
+        cursor.execute("DROP TABLE documents_fts")
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS documents_search AS
+        SELECT d.id, d.filename, coalesce(d.description, '') AS description,
+               coalesce((SELECT group_concat(t.tag_name, ' ') FROM document_tags t
+                         WHERE t.document_id = d.id), '') AS tags,
+               coalesce(ir.extracted_text, '') AS content,
+               coalesce(ir.entity_text, '') AS entities
+        FROM documents d
+        LEFT JOIN idp_latest l ON l.document_id = d.id
+        LEFT JOIN idp_results ir ON ir.id = l.result_id
+    ''')
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            filename, description, tags, content, entities,
+            content = 'documents_search', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    # External content index ko 'delete' mein wahi values chahiye jo index hui thi, isliye
+    # har change se pehle view ki purani row delete hoti hai aur baad mein nayi insert.
+    # Trigger bodies badal sakti hain; _sync_triggers sirf badle hue triggers ko atomically dobara banata hai.
+    _sync_triggers(cursor, [
+        f"""CREATE TRIGGER documents_fts_insert AFTER INSERT ON documents BEGIN
+            {_fts_reindex_sql('insert', 'new.id')}
+        END""",
+        f"""CREATE TRIGGER documents_fts_before_update BEFORE UPDATE OF filename, description ON documents BEGIN
+            {_fts_reindex_sql('delete', 'old.id')}
+        END""",
+        f"""CREATE TRIGGER documents_fts_update AFTER UPDATE OF filename, description ON documents BEGIN
+            {_fts_reindex_sql('insert', 'new.id')}
+        END""",
+        f"""CREATE TRIGGER documents_fts_delete BEFORE DELETE ON documents BEGIN
+            {_fts_reindex_sql('delete', 'old.id')}
+        END""",
+        f"""CREATE TRIGGER document_tags_fts_before_insert BEFORE INSERT ON document_tags BEGIN
+            {_fts_reindex_sql('delete', 'new.document_id')}
+        END""",
+        f"""CREATE TRIGGER document_tags_fts_insert AFTER INSERT ON document_tags BEGIN
+            {_fts_reindex_sql('insert', 'new.document_id')}
+        END""",
+        f"""CREATE TRIGGER document_tags_fts_before_delete BEFORE DELETE ON document_tags BEGIN
+            {_fts_reindex_sql('delete', 'old.document_id')}
+        END""",
+        f"""CREATE TRIGGER document_tags_fts_delete AFTER DELETE ON document_tags BEGIN
+            {_fts_reindex_sql('insert', 'old.document_id')}
+        END""",
+        # Latest pointer aur index ek hi trigger mein, taaki delete purane result ki values se ho
+        f"""CREATE TRIGGER idp_results_latest AFTER INSERT ON idp_results
+        WHEN new.status = 'Success' BEGIN
+            {_fts_reindex_sql('delete', 'new.document_id')}
+            INSERT INTO idp_latest (document_id, result_id) VALUES (new.document_id, new.id)
+            ON CONFLICT (document_id) DO UPDATE SET result_id = excluded.result_id;
+            {_fts_reindex_sql('insert', 'new.document_id')}
+        END""",
+        f"""CREATE TRIGGER idp_latest_fts_before_delete BEFORE DELETE ON idp_latest BEGIN
+            {_fts_reindex_sql('delete', 'old.document_id')}
+        END""",
+        f"""CREATE TRIGGER idp_latest_fts_delete AFTER DELETE ON idp_latest BEGIN
+            {_fts_reindex_sql('insert', 'old.document_id')}
+        END""",
+    ], obsolete=('idp_results_fts_insert',))
+    if not fts_current:
+        _rebuild_search_index(cursor)
+
     # Check if a manager user exists, if not, create one
     cursor.execute("SELECT id FROM users WHERE role = 'manager'")
     if cursor.fetchone() is None:
@@ -155,7 +664,7 @@ def init_db():
         """, ('Admin Manager', 'manager@kmrl.com', generate_password_hash('password', method='pbkdf2:sha256'), 'manager'))
 
     conn.commit()
-    conn.close()
+    release_db_connection(conn)
     print("Database initialized.")
 
 # User related functions
@@ -163,14 +672,14 @@ def get_user_by_email(email):
     """Get user details by email."""
     conn = get_db_connection()
     user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-    conn.close()
+    release_db_connection(conn)
     return user
 
 def get_user_by_id(user_id):
     """Get user details by ID."""
     conn = get_db_connection()
     user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-    conn.close()
+    release_db_connection(conn)
     return user
 
 def create_user(full_name, email, password, role='user'):
@@ -187,7 +696,7 @@ def create_user(full_name, email, password, role='user'):
     except sqlite3.IntegrityError:
         return None
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 # Document related functions
 def get_user_documents(user_id):
@@ -201,50 +710,174 @@ def get_user_documents(user_id):
            ORDER BY d.upload_date DESC""",
         (user_id,)
     ).fetchall()
-    conn.close()
+    release_db_connection(conn)
     return [dict(doc) for doc in documents]
 
-def get_pending_documents():
-    """Get all pending documents with uploader information."""
+def get_pending_documents(uploader_id=None, file_type=None, older_than_days=None, limit=50, cursor=None):
+    """Newest-first page of pending documents with uploader names.
+
+    Filters by uploader, file type and minimum age in days; pages with a
+    keyset cursor on (upload_date, id). upload_date comes back as a datetime.
+    Returns (documents, next_cursor). Raises ValueError on a bad cursor.
+    """
+    where = ["d.status = 'Pending'"]
+    params = []
+    if uploader_id:
+        where.append("d.uploader_id = ?")
+        params.append(uploader_id)
+    if file_type:
+        where.append("d.file_type = ?")
+        params.append(file_type)
+    if older_than_days:
+        where.append("d.upload_date < datetime('now', ?)")
+        params.append(f"-{int(older_than_days)} days")
+    if cursor:
+        where.append("(d.upload_date, d.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
     conn = get_db_connection()
-    documents = conn.execute(
-        """SELECT d.*, u.full_name as uploader_name 
-           FROM documents d 
-           JOIN users u ON d.uploader_id = u.id 
-           WHERE d.status = 'Pending' 
-           ORDER BY d.upload_date DESC"""
+    rows = conn.execute(
+        f"""SELECT d.id, d.filename, d.file_type, d.file_size, d.uploader_id,
+                   d.upload_date AS "upload_date [timestamp_dt]", u.full_name
+            FROM documents d
+            JOIN users u ON d.uploader_id = u.id
+            WHERE {' AND '.join(where)}
+            ORDER BY d.upload_date DESC, d.id DESC
+            LIMIT ?""",
+        params + [limit + 1]
     ).fetchall()
-    conn.close()
-    return [dict(doc) for doc in documents]
+    release_db_connection(conn)
+
+    documents = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = documents[-1]
+        next_cursor = encode_cursor(last['upload_date'].strftime('%Y-%m-%d %H:%M:%S'), last['id'])
+    return documents, next_cursor
+
+def get_pending_uploaders():
+    """Users who currently have pending documents, for the admin filter."""
+    conn = get_db_connection()
+    rows = conn.execute(
+        """SELECT u.id, u.full_name FROM users u
+           WHERE EXISTS (SELECT 1 FROM documents d WHERE d.uploader_id = u.id AND d.status = 'Pending')
+           ORDER BY u.full_name"""
+    ).fetchall()
+    release_db_connection(conn)
+    return [dict(row) for row in rows]
 
-def create_document(filename, uploader_id, file_type=None, file_size=None, description=None):
+def create_document(filename, uploader_id, file_type=None, file_size=None, description=None, content_hash=None):
     """Create a new document record."""
     conn = get_db_connection()
     try:
         cursor = conn.execute(
             """INSERT INTO documents 
-               (filename, uploader_id, file_type, file_size, description) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (filename, uploader_id, file_type, file_size, description)
+               (filename, uploader_id, file_type, file_size, description, content_hash) 
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (filename, uploader_id, file_type, file_size, description, content_hash)
         )
         doc_id = cursor.lastrowid
         conn.commit()
         return doc_id
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def update_document_status(doc_id, status):
     """Update document status."""
     conn = get_db_connection()
     try:
+        old = conn.execute("SELECT uploader_id, status FROM documents WHERE id = ?", (doc_id,)).fetchone()
         conn.execute(
             "UPDATE documents SET status = ?, last_modified = CURRENT_TIMESTAMP WHERE id = ?",
             (status, doc_id)
         )
         conn.commit()
+        if old:
+            events.publish('document_status', {'document_id': doc_id, 'status': status},
+                           user_id=old['uploader_id'])
         return True
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+# Ek bulk request mein kitne documents allowed hain
+BULK_STATUS_MAX_IDS = 1000
+
+def bulk_update_document_status(doc_ids, status, actor_id, action):
+    """Sets status on many documents and writes their audit rows in one transaction.
+
+    Documents that don't exist or already have the status are skipped.
+    Returns (updated, skipped): updated is a list of {id, uploader_id, filename},
+    skipped a list of {id, reason}.
+    """
+    doc_ids = list(dict.fromkeys(doc_ids))
+    conn = get_db_connection()
+    try:
+        # Write lock pehle le lo taaki SELECT aur UPDATE ke beech koi status na badle
+        conn.execute("BEGIN IMMEDIATE")
+        found = {}
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT id, uploader_id, filename, status FROM documents WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            found.update((row['id'], row) for row in rows)
+
+        updated, skipped = [], []
+        for doc_id in doc_ids:
+            row = found.get(doc_id)
+            if row is None:
+                skipped.append({'id': doc_id, 'reason': 'not_found'})
+            elif row['status'] == status:
+                skipped.append({'id': doc_id, 'reason': 'unchanged'})
+            else:
+                updated.append({'id': doc_id, 'uploader_id': row['uploader_id'], 'filename': row['filename']})
+
+        conn.executemany(
+            "UPDATE documents SET status = ?, last_modified = CURRENT_TIMESTAMP WHERE id = ?",
+            [(status, doc['id']) for doc in updated]
+        )
+        conn.executemany(
+            """INSERT INTO audit_log (user_id, action, target_type, target_id, details)
+               VALUES (?, ?, 'document', ?, ?)""",
+            [(actor_id, action, doc['id'], f"{status} '{doc['filename']}'") for doc in updated]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+
+    for doc in updated:
+        events.publish('document_status', {'document_id': doc['id'], 'status': status},
+                       user_id=doc['uploader_id'])
+    # Bade batch ke liye ek summary event, taaki subscribers ki queue overflow na ho
+    if len(updated) == 1:
+        events.publish('activity', {
+            'user_id': actor_id, 'action': action, 'target_type': 'document',
+            'target_id': updated[0]['id'], 'details': f"{status} '{updated[0]['filename']}'"
+        })
+    elif updated:
+        events.publish('activity', {
+            'user_id': actor_id, 'action': action, 'target_type': 'document',
+            'target_id': None, 'details': f"{status} {len(updated)} documents"
+        })
+    return updated, skipped
+
+def update_document(doc_id, filename=None, description=None):
+    """Updates a document's filename and/or description (None leaves a field as is)."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """UPDATE documents SET filename = coalesce(?, filename), description = coalesce(?, description),
+               last_modified = CURRENT_TIMESTAMP WHERE id = ?""",
+            (filename, description, doc_id)
+        )
+        conn.commit()
+        return True
+    finally:
+        release_db_connection(conn)
 
 def get_document_by_id(doc_id):
     """Get document details by ID."""
@@ -256,9 +889,215 @@ def get_document_by_id(doc_id):
            WHERE d.id = ?""",
         (doc_id,)
     ).fetchone()
-    conn.close()
+    release_db_connection(conn)
     return dict(document) if document else None
 
+def delete_document(doc_id):
+    """Deletes a document with its dependent rows.
+
+    Returns the document's content hash (or None) so the caller can release the blob.
+    """
+    conn = get_db_connection()
+    try:
+        doc = conn.execute(
+            "SELECT content_hash, uploader_id, status FROM documents WHERE id = ?", (doc_id,)
+        ).fetchone()
+        if not doc:
+            return None
+        for table in ('document_tags', 'document_versions', 'comments', 'document_workflows', 'idp_latest',
+                      'idp_results', 'idp_jobs', 'document_entities'):
+            conn.execute(f"DELETE FROM {table} WHERE document_id = ?", (doc_id,))
+        conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        conn.commit()
+        return doc['content_hash']
+    finally:
+        release_db_connection(conn)
+
+# Blob (content-addressed storage) functions
+def acquire_blob(sha256, storage_path, size):
+    """Adds a reference to a blob, creating its row on first use.
+
+    Returns (storage_path, refcount) as stored in the table.
+    """
+    conn = get_db_connection()
+    try:
+        blob = conn.execute(
+            """INSERT INTO blobs (sha256, storage_path, size, refcount) VALUES (?, ?, ?, 1)
+               ON CONFLICT(sha256) DO UPDATE SET refcount = refcount + 1
+               RETURNING storage_path, refcount""",
+            (sha256, storage_path, size)
+        ).fetchone()
+        conn.commit()
+        return blob['storage_path'], blob['refcount']
+    finally:
+        release_db_connection(conn)
+
+def release_blob(sha256):
+    """Drops a reference to a blob.
+
+    Returns the storage path if this was the last reference (row removed), else None.
+    """
+    conn = get_db_connection()
+    try:
+        blob = conn.execute(
+            "UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ? RETURNING storage_path, refcount",
+            (sha256,)
+        ).fetchone()
+        if blob and blob['refcount'] <= 0:
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+        conn.commit()
+        return blob['storage_path'] if blob and blob['refcount'] <= 0 else None
+    finally:
+        release_db_connection(conn)
+
+# IDP results jinke baad document dobara process nahi hota. 'Empty' = is pipeline version
+# ko file mein koi text nahi mila; warna backfill har run mein unhe phir uthata.
+IDP_DONE_SQL = "status IN ('Success', 'Empty')"
+
+def _find_reusable_result(conn, content_hash, pipeline_version=None, exclude_document_id=None, stale_before=None):
+    """Latest successful (or empty) IDP result for this content (and pipeline version, if given,
+    processed at or after stale_before, if given)."""
+    sql = f"""SELECT classification, extracted_data, confidence_score, extracted_text, pipeline_version, status
+              FROM idp_results WHERE content_hash = ? AND {IDP_DONE_SQL}"""
+    params = [content_hash]
+    if pipeline_version is not None:
+        sql += " AND pipeline_version = ?"
+        params.append(pipeline_version)
+    if exclude_document_id is not None:
+        sql += " AND document_id != ?"
+        params.append(exclude_document_id)
+    if stale_before:
+        sql += " AND processed_at >= ?"
+        params.append(stale_before)
+    return conn.execute(sql + " ORDER BY id DESC LIMIT 1", params).fetchone()
+
+def _copied_result(document_id, content_hash, row):
+    """create_idp_results tuple that copies a found result onto another document."""
+    data = json.loads(row['extracted_data']) if row['extracted_data'] else {}
+    return (document_id, row['classification'], data, row['status'], row['confidence_score'],
+            row['extracted_text'], row['pipeline_version'], content_hash)
+
+def clone_idp_result(document_id, content_hash, pipeline_version=None):
+    """Copies the latest successful IDP result of another document with the same content.
+
+    With pipeline_version, only a result produced by that version is reused.
+    Returns True if a result was reused.
+    """
+    conn = get_db_connection()
+    try:
+        row = _find_reusable_result(conn, content_hash, pipeline_version, exclude_document_id=document_id)
+        if row is None:
+            return False
+        _insert_idp_results(conn, [_copied_result(document_id, content_hash, row)])
+        conn.commit()
+        return True
+    finally:
+        release_db_connection(conn)
+
+def reuse_idp_results(items, pipeline_version, stale_before=None):
+    """Skip-if-current for a batch of (document_id, content_hash) pairs.
+
+    A document that already has a result for this (hash, version), no older
+    than its latest successful one, is left alone; otherwise a matching
+    result of any document is copied onto it. With stale_before, results
+    processed before that timestamp do not count.
+    Returns the set of document ids that need no processing.
+    """
+    conn = get_db_connection()
+    try:
+        covered, copies = set(), []
+        for document_id, content_hash in items:
+            if not content_hash:
+                continue
+            current = conn.execute(
+                f"""SELECT 1 FROM idp_results
+                    WHERE document_id = ?1 AND content_hash = ?2 AND pipeline_version = ?3 AND {IDP_DONE_SQL}
+                      AND id >= coalesce((SELECT result_id FROM idp_latest WHERE document_id = ?1), 0)
+                      AND (?4 IS NULL OR processed_at >= ?4)""",
+                (document_id, content_hash, pipeline_version, stale_before or None)
+            ).fetchone()
+            if current:
+                covered.add(document_id)
+                continue
+            row = _find_reusable_result(conn, content_hash, pipeline_version, stale_before=stale_before)
+            if row is not None:
+                copies.append(_copied_result(document_id, content_hash, row))
+                covered.add(document_id)
+        _insert_idp_results(conn, copies)
+        conn.commit()
+        return covered
+    finally:
+        release_db_connection(conn)
+
+def get_document_content_hashes(doc_ids):
+    """{document id: content_hash} for the given documents (None for pre-blob uploads)."""
+    conn = get_db_connection()
+    hashes = {}
+    for start in range(0, len(doc_ids), 500):
+        chunk = list(doc_ids[start:start + 500])
+        rows = conn.execute(
+            f"SELECT id, content_hash FROM documents WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        hashes.update((row['id'], row['content_hash']) for row in rows)
+    release_db_connection(conn)
+    return hashes
+
+# Upload session functions
+def create_upload_session(session_id, user_id, filename, file_type=None, total_size=None):
+    """Starts a chunked upload."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """INSERT INTO upload_sessions (id, user_id, filename, file_type, total_size)
+               VALUES (?, ?, ?, ?, ?)""",
+            (session_id, user_id, filename, file_type, total_size)
+        )
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def get_upload_session(session_id, user_id):
+    """Gets a user's upload session."""
+    conn = get_db_connection()
+    upload = conn.execute(
+        "SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?", (session_id, user_id)
+    ).fetchone()
+    release_db_connection(conn)
+    return dict(upload) if upload else None
+
+def advance_upload_session(session_id, old_offset, new_offset):
+    """Moves the received offset forward, only if nobody else moved it first."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            """UPDATE upload_sessions SET received = ?, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ? AND received = ?""",
+            (new_offset, session_id, old_offset)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        release_db_connection(conn)
+
+def delete_upload_session(session_id):
+    """Removes a finished or abandoned upload session."""
+    conn = get_db_connection()
+    try:
+        conn.execute("DELETE FROM upload_sessions WHERE id = ?", (session_id,))
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def get_stale_upload_sessions(max_age_hours=24):
+    """Gets upload sessions with no activity for max_age_hours."""
+    conn = get_db_connection()
+    uploads = conn.execute(
+        "SELECT id FROM upload_sessions WHERE updated_at <= datetime('now', ?)",
+        (f'-{int(max_age_hours)} hours',)
+    ).fetchall()
+    release_db_connection(conn)
+    return [row['id'] for row in uploads]
+
 # Comment related functions
 def add_comment(document_id, user_id, comment_text):
     """Add a comment to a document."""
@@ -272,7 +1111,7 @@ def add_comment(document_id, user_id, comment_text):
         conn.commit()
         return comment_id
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_document_comments(document_id):
     """Get all comments for a document."""
@@ -285,23 +1124,82 @@ def get_document_comments(document_id):
            ORDER BY c.created_at DESC""",
         (document_id,)
     ).fetchall()
-    conn.close()
+    release_db_connection(conn)
     return [dict(comment) for comment in comments]
 
 # Audit log functions
 def add_audit_log(user_id, action, target_type, target_id, details=None):
     """Add an entry to the audit log."""
-    conn = get_db_connection()
+    add_audit_logs([(user_id, action, target_type, target_id, details, None)])
+
+def add_audit_logs(entries, conn=None):
+    """Writes many audit entries in one transaction.
+
+    entries are (user_id, action, target_type, target_id, details, timestamp)
+    tuples; a None timestamp means CURRENT_TIMESTAMP. conn is an optional
+    caller-owned connection (e.g. the audit writer's dedicated one).
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     try:
-        conn.execute(
+        conn.executemany(
             """INSERT INTO audit_log 
-               (user_id, action, target_type, target_id, details) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (user_id, action, target_type, target_id, details)
+               (user_id, action, target_type, target_id, details, timestamp) 
+               VALUES (?, ?, ?, ?, ?, coalesce(?, CURRENT_TIMESTAMP))""",
+            entries
         )
         conn.commit()
+    except Exception:
+        if not own_conn:
+            conn.rollback()
+        raise
     finally:
-        conn.close()
+        if own_conn:
+            release_db_connection(conn)
+    for user_id, action, target_type, target_id, details, _ in entries:
+        events.publish('activity', {
+            'user_id': user_id, 'action': action, 'target_type': target_type,
+            'target_id': target_id, 'details': details
+        })
+
+def get_audit_logs(start=None, end=None, user_id=None, action=None, target_type=None,
+                   target_id=None, limit=None, after=None, desc=False):
+    """Audit rows in [start, end) ordered by timestamp, id (newest first if desc); all filters optional.
+
+    start and end are 'YYYY-MM-DD[ HH:MM:SS]' strings. after is a
+    (timestamp, id) keyset: only rows past it in the chosen order are returned.
+    """
+    where, params = [], []
+    if after is not None:
+        where.append(f"(timestamp, id) {'<' if desc else '>'} (?, ?)")
+        params.extend(after)
+    for clause, value in (("timestamp >= ?", start), ("timestamp < ?", end),
+                          ("user_id = ?", user_id), ("action = ?", action),
+                          ("target_type = ?", target_type), ("target_id = ?", target_id)):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+    sql = "SELECT * FROM audit_log"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC, id DESC" if desc else " ORDER BY timestamp, id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    conn = get_db_connection()
+    rows = conn.execute(sql, params).fetchall()
+    release_db_connection(conn)
+    return [dict(row) for row in rows]
+
+def delete_audit_logs(ids):
+    """Deletes audit rows by id (after they have been archived)."""
+    conn = get_db_connection()
+    try:
+        conn.executemany("DELETE FROM audit_log WHERE id = ?", [(i,) for i in ids])
+        conn.commit()
+    finally:
+        release_db_connection(conn)
 
 def get_recent_activity(limit=10):
     """Get recent activity from audit log."""
@@ -314,58 +1212,142 @@ def get_recent_activity(limit=10):
            LIMIT ?""",
         (limit,)
     ).fetchall()
-    conn.close()
+    release_db_connection(conn)
     return [dict(activity) for activity in activities]
 
 # Statistics functions
 def get_user_stats(user_id):
-    """Get document statistics for a user."""
+    """Get document statistics for a user.
+
+    Reads the status rollups when enabled, otherwise one grouped query.
+    """
     conn = get_db_connection()
-    stats = {}
-    
-    # Total documents
-    total = conn.execute(
-        "SELECT COUNT(*) FROM documents WHERE uploader_id = ?",
-        (user_id,)
-    ).fetchone()[0]
-    stats['total_documents'] = total
-    
-    # Documents uploaded today
-    today = conn.execute(
-        """SELECT COUNT(*) FROM documents 
-           WHERE uploader_id = ? 
-           AND date(upload_date) = date('now')""",
-        (user_id,)
-    ).fetchone()[0]
-    stats['uploaded_today'] = today
-    
-    # Pending documents
-    pending = conn.execute(
-        """SELECT COUNT(*) FROM documents 
-           WHERE uploader_id = ? AND status = 'Pending'""",
-        (user_id,)
-    ).fetchone()[0]
-    stats['pending_approval'] = pending
-    
-    # Add a mock value for archived count as the frontend expects it
-    stats['archived_count'] = 0 
+    if USE_STATUS_ROLLUPS:
+        row = conn.execute(
+            """SELECT coalesce(SUM(count), 0) AS total_documents,
+                      coalesce(SUM(CASE WHEN status = 'Pending' THEN count END), 0) AS pending_approval,
+                      (SELECT coalesce(SUM(count), 0) FROM doc_status_daily
+                       WHERE uploader_id = ?1 AND day = date('now') AND status = 'Uploaded') AS uploaded_today
+               FROM doc_status_by_uploader WHERE uploader_id = ?1""",
+            (user_id,)
+        ).fetchone()
+    else:
+        # Total, aaj ke uploads aur pending ek hi pass mein (conditional aggregation)
+        row = conn.execute(
+            """SELECT COUNT(*) AS total_documents,
+                      coalesce(SUM(upload_date >= date('now')), 0) AS uploaded_today,
+                      coalesce(SUM(status = 'Pending'), 0) AS pending_approval
+               FROM documents WHERE uploader_id = ?""",
+            (user_id,)
+        ).fetchone()
+    release_db_connection(conn)
 
-    conn.close()
+    stats = {
+        'total_documents': row['total_documents'],
+        'uploaded_today': row['uploaded_today'],
+        'pending_approval': row['pending_approval'],
+    }
+    # Add a mock value for archived count as the frontend expects it
+    stats['archived_count'] = 0
     return stats
 
-def create_idp_result(document_id, classification, extracted_data, status='Success', confidence=0.0):
-    """Saves the result of an IDP process."""
+def create_idp_result(document_id, classification, extracted_data, status='Success', confidence=0.0, text=None,
+                      pipeline_version=None, content_hash=None):
+    """Saves the result of an IDP process (text is kept for full-text search).
+
+    Successful results also refresh the document's rows in document_entities.
+    """
+    create_idp_results([(document_id, classification, extracted_data, status, confidence, text,
+                         pipeline_version, content_hash)])
+
+def create_idp_results(results):
+    """Saves many IDP results in one transaction.
+
+    results are (document_id, classification, extracted_data, status,
+    confidence, text, pipeline_version, content_hash) tuples; a missing
+    content_hash defaults to the document's own.
+    """
     conn = get_db_connection()
     try:
-        conn.execute(
-            """INSERT INTO idp_results 
-               (document_id, classification, extracted_data, confidence_score, status) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (document_id, classification, json.dumps(extracted_data), confidence, status)
-        )
+        _insert_idp_results(conn, results)
         conn.commit()
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def _insert_idp_results(conn, results):
+    """create_idp_results ka kaam, caller ke transaction mein."""
+    conn.executemany(
+        """INSERT INTO idp_results
+           (document_id, classification, extracted_data, confidence_score, status, extracted_text,
+            pipeline_version, content_hash, entity_text)
+           VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, coalesce(?8, (SELECT content_hash FROM documents WHERE id = ?1)),
+                   (SELECT group_concat(value, ' ') FROM json_tree(?3) WHERE type = 'text'))""",
+        [(document_id, classification, json.dumps(extracted_data), confidence, status, text,
+          pipeline_version, content_hash)
+         for document_id, classification, extracted_data, status, confidence, text, pipeline_version, content_hash
+         in results]
+    )
+    # Naya successful result purane entities ko replace karta hai
+    succeeded = [(r[0], r[2]) for r in results if r[3] == 'Success']
+    conn.executemany("DELETE FROM document_entities WHERE document_id = ?", [(doc_id,) for doc_id, _ in succeeded])
+    conn.executemany(_INSERT_ENTITY_SQL, [row for doc_id, data in succeeded for row in _entity_rows(doc_id, data)])
+
+def _reprocess_filter(stale_before, pipeline_version=None):
+    """Documents with no successful or empty IDP result (or only ones older than stale_before,
+    or not produced by pipeline_version)."""
+    sql = f"""NOT EXISTS (SELECT 1 FROM idp_results ir
+                          WHERE ir.document_id = d.id AND ir.{IDP_DONE_SQL}"""
+    params = []
+    if stale_before:
+        sql += " AND ir.processed_at >= ?"
+        params.append(stale_before)
+    if pipeline_version:
+        sql += " AND ir.pipeline_version = ?"
+        params.append(pipeline_version)
+    return sql + ")", params
+
+def get_documents_for_reprocessing(after_id=0, limit=500, stale_before=None, pipeline_version=None):
+    """Next page (by id) of documents whose IDP result is missing or stale, with their stored path."""
+    where_sql, params = _reprocess_filter(stale_before, pipeline_version)
+    conn = get_db_connection()
+    rows = conn.execute(
+        f"""SELECT d.id, d.filename, d.file_type, d.content_hash, b.storage_path
+            FROM documents d LEFT JOIN blobs b ON b.sha256 = d.content_hash
+            WHERE d.id > ? AND {where_sql}
+            ORDER BY d.id LIMIT ?""",
+        [after_id] + params + [limit]
+    ).fetchall()
+    release_db_connection(conn)
+    return [dict(row) for row in rows]
+
+def count_documents_for_reprocessing(after_id=0, stale_before=None, pipeline_version=None):
+    """How many documents get_documents_for_reprocessing would still return."""
+    where_sql, params = _reprocess_filter(stale_before, pipeline_version)
+    conn = get_db_connection()
+    total = conn.execute(
+        f"SELECT COUNT(*) FROM documents d WHERE d.id > ? AND {where_sql}", [after_id] + params
+    ).fetchone()[0]
+    release_db_connection(conn)
+    return total
+
+def get_latest_idp_result_id():
+    """Highest idp_results id so far (0 if none)."""
+    conn = get_db_connection()
+    latest = conn.execute("SELECT coalesce(MAX(id), 0) FROM idp_results").fetchone()[0]
+    release_db_connection(conn)
+    return latest
+
+def get_idp_results_since(last_id, limit=500):
+    """IDP results newer than last_id, with the owning uploader."""
+    conn = get_db_connection()
+    results = conn.execute(
+        """SELECT ir.id, ir.document_id, ir.status, ir.classification, d.uploader_id
+           FROM idp_results ir JOIN documents d ON ir.document_id = d.id
+           WHERE ir.id > ? ORDER BY ir.id LIMIT ?""",
+        (last_id, limit)
+    ).fetchall()
+    release_db_connection(conn)
+    return [dict(r) for r in results]
 
 def get_idp_log(limit=5):
     """Gets the most recent IDP processing logs."""
@@ -378,18 +1360,21 @@ def get_idp_log(limit=5):
            LIMIT ?""",
         (limit,)
     ).fetchall()
-    conn.close()
+    release_db_connection(conn)
     return [dict(log) for log in logs]
 # database.py
 
-def get_document_details(doc_id):
-    """Gets all details for a single document, including IDP results."""
+def get_document_details(doc_id, user_id=None):
+    """Gets all details for a single document, including IDP results.
+
+    If user_id is given, only that user's own document is returned.
+    """
     conn = get_db_connection()
     
     # Get basic document info
     doc = conn.execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
-    if not doc:
-        conn.close()
+    if not doc or (user_id is not None and doc['uploader_id'] != user_id):
+        release_db_connection(conn)
         return None
     
     doc_details = dict(doc)
@@ -402,27 +1387,454 @@ def get_document_details(doc_id):
     ).fetchall()
     doc_details['comments'] = [dict(c) for c in comments]
     
-    # Get IDP extracted data
-    idp_data = conn.execute("SELECT extracted_data FROM idp_results WHERE document_id = ?", (doc_id,)).fetchone()
-    if idp_data and idp_data['extracted_data']:
-        doc_details['metadata'] = json.loads(idp_data['extracted_data'])
-    else:
-        doc_details['metadata'] = {} # No data extracted
+    # Latest IDP result ke entities, document_entities index se (JSON parse nahi)
+    metadata = {}
+    for row in conn.execute(
+        "SELECT label, value FROM document_entities WHERE document_id = ? ORDER BY label, value_norm", (doc_id,)
+    ):
+        metadata.setdefault(row['label'], []).append(row['value'])
+    doc_details['metadata'] = metadata
+
+    # Latest pointer se ek hi result; kaunsa pipeline version aur kab
+    result = conn.execute(
+        """SELECT ir.classification, ir.confidence_score, ir.pipeline_version, ir.processed_at
+           FROM idp_latest l JOIN idp_results ir ON ir.id = l.result_id
+           WHERE l.document_id = ?""", (doc_id,)
+    ).fetchone()
+    doc_details['idp'] = dict(result) if result else None
+
+    # Get background processing state (queued/running/done/failed)
+    job = conn.execute(
+        """SELECT status, attempts, last_error, updated_at FROM idp_jobs
+           WHERE document_id = ? ORDER BY id DESC LIMIT 1""", (doc_id,)
+    ).fetchone()
+    doc_details['processing'] = dict(job) if job else None
         
-    conn.close()
+    release_db_connection(conn)
     return doc_details
 # database.py
 
-def get_document_status_counts():
-    """Counts documents grouped by their status."""
+def get_document_status_counts(user_id=None):
+    """Counts documents by status, for one uploader or everyone, from the rollup table."""
     conn = get_db_connection()
-    counts = conn.execute(
-        "SELECT status, COUNT(*) as count FROM documents GROUP BY status"
-    ).fetchall()
-    conn.close()
+    if user_id is None:
+        counts = conn.execute(
+            """SELECT status, SUM(count) AS count FROM doc_status_by_uploader
+               GROUP BY status HAVING SUM(count) > 0 ORDER BY status"""
+        ).fetchall()
+    else:
+        counts = conn.execute(
+            """SELECT status, count FROM doc_status_by_uploader
+               WHERE uploader_id = ? AND count > 0 ORDER BY status""", (user_id,)
+        ).fetchall()
+    release_db_connection(conn)
     
     # Convert the database rows into a dictionary for easier use
     return {row['status']: row['count'] for row in counts}
 
+def get_status_timeseries(user_id=None, days=30):
+    """Per-day uploads and status changes for the last `days` days (today included).
+
+    Returns [{'date': 'YYYY-MM-DD', 'Uploaded': n, 'Approved': n, ...}, ...]
+    oldest first, with zero-filled days, from the doc_status_daily rollup.
+    """
+    today = datetime.utcnow().date()
+    start = (today - timedelta(days=days - 1)).isoformat()
+    sql = "SELECT day, status, SUM(count) AS count FROM doc_status_daily WHERE day >= ?"
+    params = [start]
+    if user_id is not None:
+        sql += " AND uploader_id = ?"
+        params.append(user_id)
+    sql += " GROUP BY day, status"
+
+    conn = get_db_connection()
+    rows = conn.execute(sql, params).fetchall()
+    release_db_connection(conn)
+
+    series = {}
+    for offset in range(days):
+        day = (today - timedelta(days=days - 1 - offset)).isoformat()
+        series[day] = {'date': day, 'Uploaded': 0, 'Approved': 0, 'Rejected': 0}
+    for row in rows:
+        if row['day'] in series:
+            series[row['day']][row['status']] = row['count']
+    return list(series.values())
+
+def rebuild_status_rollups():
+    """Rebuilds the status rollups (dashboard stats and charts) from documents.
+
+    Returns the number of uploaders with any status count or daily rollup
+    row that had drifted.
+    """
+    conn = get_db_connection()
+    try:
+        drifted = conn.execute(
+            f"""WITH actual_status AS ({_STATUS_COUNTS_SQL}),
+                     actual_daily AS ({_STATUS_DAILY_SQL}),
+                     stored_status AS (SELECT uploader_id, status, count FROM doc_status_by_uploader
+                                       WHERE count != 0),
+                     stored_daily AS (SELECT uploader_id, day, status, count FROM doc_status_daily
+                                      WHERE count != 0)
+                SELECT COUNT(DISTINCT uploader_id) FROM (
+                    SELECT uploader_id FROM (SELECT * FROM actual_status EXCEPT SELECT * FROM stored_status)
+                    UNION ALL
+                    SELECT uploader_id FROM (SELECT * FROM stored_status EXCEPT SELECT * FROM actual_status)
+                    UNION ALL
+                    SELECT uploader_id FROM (SELECT * FROM actual_daily EXCEPT SELECT * FROM stored_daily)
+                    UNION ALL
+                    SELECT uploader_id FROM (SELECT * FROM stored_daily EXCEPT SELECT * FROM actual_daily)
+                )"""
+        ).fetchone()[0]
+        _rebuild_status_rollups(conn.cursor())
+        conn.commit()
+        return drifted
+    finally:
+        release_db_connection(conn)
+
+# Document query builder
+def build_document_filters(user_id, status=None, file_type=None, date=None, alias='d'):
+    """Turns search filters into a parameterized WHERE clause.
+
+    date is 'YYYY-MM-DD' and becomes a half-open range on upload_date so the
+    (uploader_id, ..., upload_date) indexes can be used. Raises ValueError on a bad date.
+    """
+    where = [f"{alias}.uploader_id = ?"]
+    params = [user_id]
+    if status:
+        where.append(f"{alias}.status = ?")
+        params.append(status)
+    if file_type:
+        where.append(f"{alias}.file_type = ?")
+        params.append(file_type)
+    if date:
+        day = datetime.strptime(date, '%Y-%m-%d')
+        where.append(f"{alias}.upload_date >= ? AND {alias}.upload_date < ?")
+        params.extend([day.strftime('%Y-%m-%d'), (day + timedelta(days=1)).strftime('%Y-%m-%d')])
+    return ' AND '.join(where), params
+
+def encode_cursor(upload_date, doc_id):
+    """Opaque keyset cursor for (upload_date, id) (or any (timestamp, id) pair)."""
+    raw = json.dumps([upload_date, doc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Reverses encode_cursor; raises ValueError if the cursor is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_date, doc_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(upload_date, str) or not isinstance(doc_id, int):
+        raise ValueError("Invalid cursor")
+    return upload_date, doc_id
+
+# Columns /api/documents callers may select; id and upload_date are always returned
+DOCUMENT_COLUMNS = ('id', 'filename', 'status', 'upload_date', 'last_modified', 'file_type',
+                    'file_size', 'description', 'content_hash')
+
+def list_documents(user_id, status=None, file_type=None, date=None, limit=50, cursor=None, columns=None):
+    """Newest-first page of a user's documents with keyset pagination on (upload_date, id).
+
+    columns limits the selected columns (names from DOCUMENT_COLUMNS).
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    Raises ValueError on a bad filter, cursor or column.
+    """
+    if columns:
+        unknown = set(columns) - set(DOCUMENT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+        selected = ', '.join(f"d.{c}" for c in DOCUMENT_COLUMNS if c in columns or c in ('id', 'upload_date'))
+    else:
+        selected = 'd.*'
+
+    where_sql, params = build_document_filters(user_id, status, file_type, date)
+    if cursor:
+        where_sql += " AND (d.upload_date, d.id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+
+    conn = get_db_connection()
+    rows = conn.execute(
+        f"""SELECT {selected} FROM documents d
+            WHERE {where_sql}
+            ORDER BY d.upload_date DESC, d.id DESC
+            LIMIT ?""",
+        params + [limit + 1]
+    ).fetchall()
+    release_db_connection(conn)
+
+    documents = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = documents[-1]
+        next_cursor = encode_cursor(last['upload_date'], last['id'])
+    return documents, next_cursor
+
+def count_documents(user_id, status=None, file_type=None, date=None):
+    """Counts a user's documents matching the filters (index-only scan)."""
+    where_sql, params = build_document_filters(user_id, status, file_type, date)
+    conn = get_db_connection()
+    total = conn.execute(f"SELECT COUNT(*) FROM documents d WHERE {where_sql}", params).fetchone()[0]
+    release_db_connection(conn)
+    return total
+
+# Entity store queries
+def _entity_filters(label=None, value=None, prefix=False):
+    """WHERE clause on document_entities e; value is normalized, prefix matches value starts."""
+    where, params = [], []
+    if label:
+        where.append("e.label = ?")
+        params.append(label)
+    if value:
+        value_norm = normalize_entity(value)
+        if prefix:
+            # Range scan taaki (label, value_norm) / (value_norm) index use ho
+            where.append("e.value_norm >= ? AND e.value_norm < ?")
+            params.extend([value_norm, value_norm + '\U0010ffff'])
+        else:
+            where.append("e.value_norm = ?")
+            params.append(value_norm)
+    return ' AND '.join(where) or '1', params
+
+def find_documents_by_entity(user_id, label=None, value=None, prefix=False, limit=50, cursor=None):
+    """A user's documents mentioning a matching entity, newest first.
+
+    Returns (documents, next_cursor) like list_documents.
+    """
+    where_sql, params = _entity_filters(label, value, prefix)
+    sql = f"""SELECT d.id, d.filename, d.status, d.file_type, d.upload_date, d.last_modified
+              FROM documents d
+              WHERE d.uploader_id = ?
+                AND d.id IN (SELECT e.document_id FROM document_entities e WHERE {where_sql})"""
+    params = [user_id] + params
+    if cursor:
+        sql += " AND (d.upload_date, d.id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    sql += " ORDER BY d.upload_date DESC, d.id DESC LIMIT ?"
+
+    conn = get_db_connection()
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    release_db_connection(conn)
+
+    documents = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = documents[-1]
+        next_cursor = encode_cursor(last['upload_date'], last['id'])
+    return documents, next_cursor
+
+def get_entity_facets(user_id, label=None, value=None, prefix=False, limit=20):
+    """Document counts per (label, value) over a user's documents, most common first."""
+    where_sql, params = _entity_filters(label, value, prefix)
+    conn = get_db_connection()
+    rows = conn.execute(
+        f"""SELECT e.label, min(e.value) AS value, e.value_norm, COUNT(*) AS count
+            FROM document_entities e
+            JOIN documents d ON d.id = e.document_id
+            WHERE d.uploader_id = ? AND {where_sql}
+            GROUP BY e.label, e.value_norm
+            ORDER BY count DESC, e.label, e.value_norm
+            LIMIT ?""",
+        [user_id] + params + [limit]
+    ).fetchall()
+    release_db_connection(conn)
+    return [dict(row) for row in rows]
+
+# Search functions
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+def _fts_query(text):
+    """User input ko safe FTS5 query banata hai: har word ek quoted prefix term (AND)."""
+    terms = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+def _highlight(snippet):
+    """Escapes snippet text and turns the FTS markers into <mark> tags."""
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+def search_documents(user_id, query, status=None, file_type=None, date=None, page=1, per_page=20):
+    """BM25-ranked full-text search over a user's documents.
+
+    Searches filename, description, tags, extracted text and entities.
+    Returns (documents, total); each document has 'snippet' and 'score'.
+    """
+    match = _fts_query(query)
+    if not match:
+        return [], 0
+    filter_sql, filter_params = build_document_filters(user_id, status, file_type, date)
+    where_sql = "documents_fts MATCH ? AND " + filter_sql
+    params = [match] + filter_params
+
+    conn = get_db_connection()
+    total = conn.execute(
+        f"SELECT COUNT(*) FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid WHERE {where_sql}",
+        params
+    ).fetchone()[0]
+    rows = conn.execute(
+        f"""SELECT d.*, -bm25(documents_fts, 10.0, 4.0, 6.0, 1.0, 3.0) AS score,
+                   snippet(documents_fts, -1, ?, ?, '…', 12) AS snippet
+            FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+            WHERE {where_sql}
+            ORDER BY score DESC LIMIT ? OFFSET ?""",
+        [SNIPPET_START, SNIPPET_END] + params + [per_page, (page - 1) * per_page]
+    ).fetchall()
+    release_db_connection(conn)
+
+    documents = []
+    for row in rows:
+        doc = dict(row)
+        doc['snippet'] = _highlight(doc['snippet'])
+        documents.append(doc)
+    return documents, total
+
+# Facet name -> SQL expression; classification latest successful IDP result se aata hai
+SEARCH_FACETS = {
+    'status': "d.status",
+    'type': "coalesce(d.file_type, '')",
+    'classification': "coalesce(ir.classification, 'Unclassified')",
+    'month': "substr(d.upload_date, 1, 7)",
+}
+
+def get_search_facets(user_id, query=None, status=None, file_type=None, date=None, facets=tuple(SEARCH_FACETS)):
+    """Counts per value of each requested facet for the current search, in one SQL pass.
+
+    The query groups by all requested facets at once and the per-facet
+    counts are rolled up in Python, since SQLite has no GROUPING SETS.
+    Returns {facet: [{'value': ..., 'count': ...}, ...]}, most common first
+    (months newest first). Raises ValueError on a bad date or facet name.
+    """
+    unknown = set(facets) - set(SEARCH_FACETS)
+    if unknown:
+        raise ValueError(f"Unknown facet(s): {', '.join(sorted(unknown))}")
+    facets = [f for f in SEARCH_FACETS if f in facets]
+    if not facets:
+        return {}
+
+    where_sql, params = build_document_filters(user_id, status, file_type, date)
+    from_sql = "documents d"
+    if query:
+        match = _fts_query(query)
+        if not match:
+            return {facet: [] for facet in facets}
+        from_sql = "documents_fts JOIN documents d ON d.id = documents_fts.rowid"
+        where_sql = "documents_fts MATCH ? AND " + where_sql
+        params = [match] + params
+    if 'classification' in facets:
+        from_sql += """ LEFT JOIN idp_latest l ON l.document_id = d.id
+                        LEFT JOIN idp_results ir ON ir.id = l.result_id"""
+
+    columns = ', '.join(f"{SEARCH_FACETS[f]} AS {f}" for f in facets)
+    conn = get_db_connection()
+    rows = conn.execute(
+        f"""SELECT {columns}, COUNT(*) AS count FROM {from_sql}
+            WHERE {where_sql}
+            GROUP BY {', '.join(str(i) for i in range(1, len(facets) + 1))}""",
+        params
+    ).fetchall()
+    release_db_connection(conn)
+
+    totals = {facet: {} for facet in facets}
+    for row in rows:
+        for facet in facets:
+            totals[facet][row[facet]] = totals[facet].get(row[facet], 0) + row['count']
+    result = {}
+    for facet, counts in totals.items():
+        if facet == 'month':
+            ordered = sorted(counts.items(), reverse=True)
+        else:
+            ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        result[facet] = [{'value': value, 'count': count} for value, count in ordered]
+    return result
+
+# IDP job queue functions
+def enqueue_idp_job(document_id, file_path, max_attempts=3):
+    """Queues a document for background IDP processing."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            "INSERT INTO idp_jobs (document_id, file_path, max_attempts) VALUES (?, ?, ?)",
+            (document_id, file_path, max_attempts)
+        )
+        job_id = cursor.lastrowid
+        conn.commit()
+        return job_id
+    finally:
+        release_db_connection(conn)
+
+def claim_idp_job(worker_id):
+    """Atomically claims the oldest runnable job, or returns None."""
+    conn = get_db_connection()
+    try:
+        job = conn.execute(
+            """UPDATE idp_jobs
+               SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                   locked_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+               WHERE id = (SELECT id FROM idp_jobs
+                           WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                           ORDER BY run_after, id LIMIT 1)
+               RETURNING *""",
+            (worker_id,)
+        ).fetchone()
+        conn.commit()
+        return dict(job) if job else None
+    finally:
+        release_db_connection(conn)
+
+def complete_idp_job(job_id):
+    """Marks a job as done."""
+    conn = get_db_connection()
+    try:
+        conn.execute(
+            """UPDATE idp_jobs SET status = 'done', locked_by = NULL, last_error = NULL,
+               updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+            (job_id,)
+        )
+        conn.commit()
+    finally:
+        release_db_connection(conn)
+
+def fail_idp_job(job_id, error, backoff_seconds=30):
+    """Requeues a failed job with exponential backoff, or marks it failed.
+
+    Returns True if the job will be retried.
+    """
+    conn = get_db_connection()
+    try:
+        job = conn.execute(
+            "SELECT attempts, max_attempts FROM idp_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        retry = job is not None and job['attempts'] < job['max_attempts']
+        if retry:
+            delay = backoff_seconds * 2 ** (job['attempts'] - 1)
+            conn.execute(
+                """UPDATE idp_jobs SET status = 'queued', locked_by = NULL, last_error = ?,
+                   run_after = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?""",
+                (error, f'+{int(delay)} seconds', job_id)
+            )
+        else:
+            conn.execute(
+                """UPDATE idp_jobs SET status = 'failed', locked_by = NULL, last_error = ?,
+                   updated_at = CURRENT_TIMESTAMP WHERE id = ?""",
+                (error, job_id)
+            )
+        conn.commit()
+        return retry
+    finally:
+        release_db_connection(conn)
+
+def requeue_stale_idp_jobs(lease_seconds=600):
+    """Requeues running jobs whose worker died without finishing them."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            """UPDATE idp_jobs SET status = 'queued', locked_by = NULL, updated_at = CURRENT_TIMESTAMP
+               WHERE status = 'running' AND locked_at <= datetime('now', ?)""",
+            (f'-{int(lease_seconds)} seconds',)
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        release_db_connection(conn)
+
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,54 @@
+"""
+Lazy registry for heavy optional dependencies (PyMuPDF, Tesseract, PIL, spaCy).
+
+Web workers never pay for these unless they actually process a document;
+IDP worker processes call preload() once at startup instead.
+"""
+import importlib
+import threading
+
+_loaders = {}
+_loaded = {}
+_lock = threading.RLock()
+
+def register(name, loader):
+    """Registers a zero-argument loader under name."""
+    _loaders[name] = loader
+
+def get(name):
+    """Returns the dependency, loading it on first use."""
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _loaded:
+            _loaded[name] = _loaders[name]()
+        return _loaded[name]
+
+def is_loaded(name):
+    """Whether name has already been loaded in this process."""
+    return name in _loaded
+
+def preload(*names):
+    """Loads the given dependencies (all registered ones by default) right away."""
+    for name in names or tuple(_loaders):
+        get(name)
+
+def _module(path):
+    return lambda: importlib.import_module(path)
+
+def _load_nlp():
+    # Try to load spaCy model, but make it optional
+    from idp import load_ner_model
+    try:
+        return load_ner_model()
+    except OSError:
+        print("Warning: spaCy model 'en_core_web_sm' not found. AI processing will be disabled.")
+        return None
+
+register('fitz', _module('fitz'))
+register('pytesseract', _module('pytesseract'))
+register('PIL.Image', _module('PIL.Image'))
+register('spacy', _module('spacy'))
+register('nlp', _load_nlp)
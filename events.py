@@ -0,0 +1,133 @@
+"""
+In-process pub/sub for live dashboard updates over server-sent events (SSE).
+
+Each subscriber gets a bounded buffer; if a slow client falls behind, the
+oldest events are dropped and the client is told to resync.
+"""
+import json
+import queue
+import threading
+import time
+
+BUFFER_SIZE = 100
+HEARTBEAT_SECONDS = 15
+IDP_POLL_SECONDS = 2.0
+
+class Subscriber:
+    """One connected SSE client."""
+
+    def __init__(self, user_id, buffer_size=BUFFER_SIZE):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.lost = 0
+
+    def offer(self, event):
+        """Buffers an event, dropping the oldest one if the buffer is full."""
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.lost += 1
+                except queue.Empty:
+                    pass
+
+class EventBus:
+    """Fans events out to subscribers, either to one user or to everyone."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, buffer_size=BUFFER_SIZE):
+        subscriber = Subscriber(user_id, buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, data, user_id=None):
+        """Sends an event to user_id's subscribers, or to all when user_id is None."""
+        with self._lock:
+            targets = [s for s in self._subscribers if user_id is None or s.user_id == user_id]
+        event = (event_type, data)
+        for subscriber in targets:
+            subscriber.offer(event)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+bus = EventBus()
+
+def publish(event_type, data, user_id=None):
+    """Publishes on the process-wide bus."""
+    if len(bus):
+        bus.publish(event_type, data, user_id)
+
+def format_sse(event_type, data):
+    """Serialises one SSE message."""
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream(subscriber, heartbeat=HEARTBEAT_SECONDS):
+    """Generator for a text/event-stream response; unsubscribes when the client goes away."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event_type, data = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if subscriber.lost:
+                yield format_sse('resync', {'dropped': subscriber.lost})
+                subscriber.lost = 0
+            yield format_sse(event_type, data)
+    finally:
+        bus.unsubscribe(subscriber)
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+def _poll_idp_results(last_id):
+    """One watcher tick: publishes results newer than last_id and returns the new last_id.
+
+    Jab koi subscriber nahi hota, last_id bas latest tak badh jaata hai, taaki
+    idle period ke baad pehle client ko purane results ki baadh na mile.
+    """
+    from database import get_idp_results_since, get_latest_idp_result_id
+
+    if not len(bus):
+        return get_latest_idp_result_id()
+    for result in get_idp_results_since(last_id):
+        last_id = result['id']
+        publish('idp_result', {
+            'document_id': result['document_id'],
+            'status': result['status'],
+            'classification': result['classification'],
+        }, user_id=result['uploader_id'])
+    return last_id
+
+def _watch_idp_results(interval):
+    """IDP results worker processes mein bante hain; yeh thread naye rows publish karta hai."""
+    from database import get_latest_idp_result_id
+
+    last_id = get_latest_idp_result_id()
+    while True:
+        time.sleep(interval)
+        try:
+            last_id = _poll_idp_results(last_id)
+        except Exception as e:
+            print(f"IDP result watcher error: {e}")
+
+def start_idp_result_watcher(interval=IDP_POLL_SECONDS):
+    """Starts the per-process idp_results watcher thread once."""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = threading.Thread(target=_watch_idp_results, args=(interval,), daemon=True)
+            _watcher.start()
@@ -0,0 +1,186 @@
+"""
+Streaming text extractors, picked by the file's magic bytes rather than its extension.
+
+Each extractor is a generator yielding text pieces; iter_text() regroups them
+into chunks of at most EXTRACT_CHUNK_CHARS so downstream stages never see
+one huge string per read. Office Open XML files (docx/xlsx/pptx/ppsx) are
+read part by part with iterparse straight from the zip, detaching each
+element once it is handled, so a large workbook is never fully in memory.
+"""
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+EXTRACT_CHUNK_CHARS = 64 * 1024
+# Zip bomb / bahut bade exports se bachne ke liye per-document text ki upper limit
+EXTRACT_MAX_CHARS = 20 * 1024 * 1024
+SNIFF_BYTES = 8192
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PPTX = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_S = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+_extractors = {}
+
+def register(mime, extractor):
+    """Registers a generator function extractor(file_path) for a MIME type."""
+    _extractors[mime] = extractor
+
+def detect_type(file_path):
+    """Sniffs the MIME type from the first bytes (and zip layout for OOXML); None if unknown."""
+    with open(file_path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if head.startswith(b'%PDF-'):
+        return 'application/pdf'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'image/tiff'
+    if head.startswith(b'PK\x03\x04'):
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                names = set(zf.namelist())
+        except zipfile.BadZipFile:
+            return None
+        if 'word/document.xml' in names:
+            return DOCX
+        if 'xl/workbook.xml' in names:
+            return XLSX
+        if 'ppt/presentation.xml' in names:
+            return PPTX
+        return 'application/zip'
+    if head and b'\x00' not in head:
+        try:
+            # Sniff window ke aakhri multi-byte character ke kat jaane ko ignore karo
+            head.decode('utf-8')
+        except UnicodeDecodeError as e:
+            if e.start < len(head) - 3:
+                return None
+        return 'text/plain'
+    return None
+
+def iter_text(file_path, chunk_chars=EXTRACT_CHUNK_CHARS, max_chars=EXTRACT_MAX_CHARS):
+    """Yields the document's text in chunks of at most chunk_chars.
+
+    Yields nothing for file types without a registered extractor; stops
+    after max_chars characters.
+    """
+    extractor = _extractors.get(detect_type(file_path))
+    if extractor is None:
+        return
+    buffer, size, total = [], 0, 0
+    for piece in extractor(file_path):
+        if total + len(piece) > max_chars:
+            piece = piece[:max_chars - total]
+        total += len(piece)
+        buffer.append(piece)
+        size += len(piece)
+        while size >= chunk_chars:
+            joined = ''.join(buffer)
+            yield joined[:chunk_chars]
+            rest = joined[chunk_chars:]
+            buffer, size = [rest], len(rest)
+        if total >= max_chars:
+            break
+    if size:
+        yield ''.join(buffer)
+
+def _iter_ended(stream):
+    """iterparse jo har element uske end par deta hai aur phir use parent se hata deta hai.
+
+    Har element apne end par hi process hota hai, isliye tree mein sirf
+    current path bachta hai aur memory part ke size se nahi badhti.
+    """
+    parents = []
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        yield elem
+        if parents:
+            parents[-1].remove(elem)
+
+def _iter_xml_text(stream, text_tag, break_tags, tab_tags=()):
+    """Streams text out of one XML part."""
+    for elem in _iter_ended(stream):
+        if elem.tag == text_tag:
+            if elem.text:
+                yield elem.text
+        elif elem.tag in tab_tags:
+            yield '\t'
+        elif elem.tag in break_tags:
+            yield '\n'
+
+def _numbered_parts(zf, prefix):
+    """Zip parts like prefix1.xml, prefix2.xml, ... in numeric order."""
+    pattern = re.compile(re.escape(prefix) + r'(\d+)\.xml$')
+    parts = [(int(m.group(1)), name) for name in zf.namelist() if (m := pattern.match(name))]
+    return [name for _, name in sorted(parts)]
+
+def _iter_docx(file_path):
+    with zipfile.ZipFile(file_path) as zf:
+        with zf.open('word/document.xml') as part:
+            yield from _iter_xml_text(part, _W + 't', {_W + 'p'}, {_W + 'tab'})
+
+def _shared_strings(zf):
+    """xlsx shared string table; cells refer to it by index."""
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    strings, parts = [], []
+    with zf.open('xl/sharedStrings.xml') as part:
+        for elem in _iter_ended(part):
+            if elem.tag == _S + 't':
+                parts.append(elem.text or '')
+            elif elem.tag == _S + 'si':
+                strings.append(''.join(parts))
+                parts = []
+    return strings
+
+def _iter_xlsx(file_path):
+    with zipfile.ZipFile(file_path) as zf:
+        strings = _shared_strings(zf)
+        for name in _numbered_parts(zf, 'xl/worksheets/sheet'):
+            with zf.open(name) as part:
+                row, cell = [], []
+                # Cell ke children (v, inline t) unke end par hi hat jaate hain, isliye text pehle jama karte hain
+                for elem in _iter_ended(part):
+                    if elem.tag in (_S + 'v', _S + 't'):
+                        cell.append(elem.text or '')
+                    elif elem.tag == _S + 'c':
+                        value = ''.join(cell)
+                        cell = []
+                        if elem.get('t') == 's' and value:
+                            value = strings[int(value)]
+                        if value:
+                            row.append(value)
+                    elif elem.tag == _S + 'row':
+                        if row:
+                            yield '\t'.join(row) + '\n'
+                            row = []
+
+def _iter_pptx(file_path):
+    with zipfile.ZipFile(file_path) as zf:
+        for name in _numbered_parts(zf, 'ppt/slides/slide'):
+            with zf.open(name) as part:
+                yield from _iter_xml_text(part, _A + 't', {_A + 'p'})
+            yield '\n'
+
+def _iter_plain_text(file_path, block_size=EXTRACT_CHUNK_CHARS):
+    with open(file_path, encoding='utf-8', errors='replace') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+register(DOCX, _iter_docx)
+register(XLSX, _iter_xlsx)
+register(PPTX, _iter_pptx)
+register('text/plain', _iter_plain_text)
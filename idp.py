@@ -0,0 +1,264 @@
+"""
+Intelligent document processing (IDP) pipeline for KMRL DMS.
+"""
+import atexit
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import classifier
+import deps
+import extractors
+from database import create_idp_results, get_document_content_hashes, reuse_idp_results
+from storage import file_sha256
+
+# Extraction, OCR, NER model ya classifier rules badlein to ise badhao: purane results
+# tab "stale" ho jaate hain aur reprocess.py unhe dobara banata hai
+PIPELINE_VERSION = '2026.10.1'
+
+# NER batching settings
+NER_BATCH_SIZE = 32
+NER_PROCESSES = 1
+NER_MAX_CHARS = 100000
+NER_CHUNK_OVERLAP = 200
+
+# PDF extraction settings: bade PDFs page ranges mein process pool par bant jaate hain.
+# Yeh pool har process ka apna hota hai: worker.py aur reprocess.py jaise multi-process
+# callers ise cpu_count / processes (ya 1) par set karte hain, warna cpu_count^2 processes
+# ban jaate hain. NER ka n_process alag phase mein chalta hai (extraction ke baad), isliye
+# dono ek saath busy nahi hote.
+PDF_PROCESSES = int(os.environ.get('PDF_PROCESSES', os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = 32
+PDF_PARALLEL_MIN_PAGES = 64
+
+# OCR fallback settings for scanned (image-only) PDF pages
+OCR_DPI = 300
+OCR_CACHE_DIR = os.path.join('cache', 'ocr')
+
+# Sirf ye components entity extraction ke liye chahiye, baaki disable rehte hain
+NER_COMPONENTS = ('tok2vec', 'ner')
+
+def load_ner_model(name="en_core_web_sm"):
+    """Loads a spaCy model with only the components NER needs enabled."""
+    model = deps.get('spacy').load(name)
+    model.select_pipes(disable=[p for p in model.pipe_names if p not in NER_COMPONENTS])
+    return model
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+def _get_pdf_executor():
+    """Shared process pool for PDF page extraction, created on first use."""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(max_workers=PDF_PROCESSES)
+            atexit.register(_pdf_executor.shutdown)
+        return _pdf_executor
+
+def _extract_page_range(file_path, start, stop):
+    """Worker task: opens its own document handle and extracts pages [start, stop)."""
+    with deps.get('fitz').open(file_path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+def _text_layer_pages(file_path):
+    """Yields the embedded text layer of each PDF page in order.
+
+    Large PDFs are split into page ranges extracted in parallel processes.
+    """
+    with deps.get('fitz').open(file_path) as doc:
+        page_count = doc.page_count
+        if PDF_PROCESSES <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            for page in doc:
+                yield page.get_text()
+            return
+
+    executor = _get_pdf_executor()
+    futures = [
+        executor.submit(_extract_page_range, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+    for future in futures:
+        yield from future.result()
+
+def _write_atomic(path, write):
+    """Writes via a temp file so a crashed worker never leaves a half cache entry."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _ocr_pdf_page(file_path, page_number, content_hash, dpi):
+    """Worker task: renders one page at dpi and OCRs it, caching both by content hash."""
+    cache_dir = os.path.join(OCR_CACHE_DIR, content_hash)
+    text_path = os.path.join(cache_dir, f"{page_number}-{dpi}.txt")
+    if os.path.exists(text_path):
+        with open(text_path, encoding='utf-8') as f:
+            return f.read()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    image_path = os.path.join(cache_dir, f"{page_number}-{dpi}.png")
+    if not os.path.exists(image_path):
+        with deps.get('fitz').open(file_path) as doc:
+            pixmap = doc[page_number].get_pixmap(dpi=dpi)
+        _write_atomic(image_path, lambda tmp: pixmap.save(tmp, output='png'))
+
+    with deps.get('PIL.Image').open(image_path) as image:
+        text = deps.get('pytesseract').image_to_string(image)
+
+    def write_text(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+    _write_atomic(text_path, write_text)
+    return text
+
+def iter_pdf_pages(file_path):
+    """Yields the text of each PDF page in order.
+
+    Pages with no text layer (scans) are rendered at OCR_DPI and OCR'd,
+    fanned out across the process pool when more than one process is allowed.
+    """
+    content_hash = None
+    pending = deque()
+    for page_number, text in enumerate(_text_layer_pages(file_path)):
+        if text.strip():
+            pending.append(text)
+        else:
+            content_hash = content_hash or file_sha256(file_path)
+            if PDF_PROCESSES > 1:
+                pending.append(_get_pdf_executor().submit(_ocr_pdf_page, file_path, page_number, content_hash, OCR_DPI))
+            else:
+                pending.append(_ocr_pdf_page(file_path, page_number, content_hash, OCR_DPI))
+        # Jo pages ready hain unhe order mein aage bhej do
+        while pending and not isinstance(pending[0], Future):
+            yield pending.popleft()
+    for item in pending:
+        yield item.result() if isinstance(item, Future) else item
+
+def _iter_image_text(file_path):
+    """OCR for a single image file."""
+    with deps.get('PIL.Image').open(file_path) as image:
+        yield deps.get('pytesseract').image_to_string(image)
+
+extractors.register('application/pdf', iter_pdf_pages)
+for _mime in ('image/png', 'image/jpeg', 'image/tiff'):
+    extractors.register(_mime, _iter_image_text)
+
+def extract_text(file_path):
+    """Extracts a document's text with the extractor matching its magic bytes (see extractors.py)."""
+    return ''.join(extractors.iter_text(file_path))
+
+def chunk_text(text, max_chars=NER_MAX_CHARS, overlap=NER_CHUNK_OVERLAP):
+    """Splits long text into overlapping chunks so NER memory stays bounded."""
+    if len(text) <= max_chars:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            # Word ke beech mein na kaatein
+            space = text.rfind(' ', start + overlap + 1, end)
+            if space != -1:
+                end = space
+        chunks.append(text[start:end])
+        if end == len(text):
+            break
+        start = end - overlap
+    return chunks
+
+def extract_entities_batch(texts, model=None, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES):
+    """Runs NER over many texts with nlp.pipe, returning one entity dict per text."""
+    if model is None:
+        model = deps.get('nlp')
+    results = [{} for _ in texts]
+    if model is None:
+        return results
+
+    chunks = ((chunk, i) for i, text in enumerate(texts) for chunk in chunk_text(text))
+    for doc_nlp, i in model.pipe(chunks, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        entities = results[i]
+        for ent in doc_nlp.ents:
+            entities.setdefault(ent.label_, set()).add(ent.text)
+
+    # Make entity lists unique
+    return [{label: list(items) for label, items in entities.items()} for entities in results]
+
+def analyze_documents(items, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES):
+    """Runs extraction, NER and classification for (file_path, doc_id, content_hash) items without writing anything.
+
+    Returns a list of (doc_id, result, error): result is a
+    (doc_id, classification, entities, status, confidence, text,
+    PIPELINE_VERSION, content_hash) tuple ready for create_idp_results, or
+    None when extraction failed (error is then set). status is 'Success',
+    or 'Empty' when no text could be extracted, so the document is not
+    picked up again until the pipeline version changes. A missing
+    content_hash is computed from the file.
+    """
+    errors = {}
+    texts = []
+    empty = {}
+    for file_path, doc_id, content_hash in items:
+        try:
+            text = extract_text(file_path)
+            content_hash = content_hash or file_sha256(file_path)
+        except Exception as e:
+            errors[doc_id] = e
+            continue
+        if text and text.strip():
+            texts.append((doc_id, text, content_hash))
+        else:
+            empty[doc_id] = (doc_id, None, {}, 'Empty', 0.0, None, PIPELINE_VERSION, content_hash)
+
+    entities_list = extract_entities_batch([text for _, text, _ in texts], batch_size=batch_size, n_process=n_process)
+    labels = classifier.classify_batch([text for _, text, _ in texts])
+    results = {
+        doc_id: (doc_id, label, entities, 'Success', confidence, text, PIPELINE_VERSION, content_hash)
+        for (doc_id, text, content_hash), entities, (label, confidence) in zip(texts, entities_list, labels)
+    }
+    results.update(empty)
+    return [(doc_id, results.get(doc_id), errors.get(doc_id)) for _, doc_id, _ in items]
+
+def skip_current(items, stale_before=None):
+    """Drops (file_path, doc_id, content_hash) items whose content this PIPELINE_VERSION already processed.
+
+    Matching results of other documents are copied over (see
+    reuse_idp_results), so re-uploads and redeploys cost no OCR or NER.
+    Results processed before stale_before are not reused. Returns the
+    items that still need processing.
+    """
+    covered = reuse_idp_results([(doc_id, content_hash) for _, doc_id, content_hash in items], PIPELINE_VERSION,
+                                stale_before)
+    for doc_id in covered:
+        print(f"IDP result for doc_id {doc_id} is current, skipping")
+    return [item for item in items if item[1] not in covered]
+
+def process_documents(items, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES):
+    """Processes a batch of (file_path, doc_id) pairs, running NER in one nlp.pipe pass.
+
+    Documents whose content already has a result from this PIPELINE_VERSION
+    are skipped. Results are written in one transaction. Returns a list of
+    (doc_id, error) pairs; error is None on success.
+    """
+    hashes = get_document_content_hashes([doc_id for _, doc_id in items])
+    todo = skip_current([(file_path, doc_id, hashes.get(doc_id)) for file_path, doc_id in items])
+    analyzed = {doc_id: (result, error) for doc_id, result, error in analyze_documents(todo, batch_size, n_process)}
+    results = [result for result, _ in analyzed.values() if result]
+    write_error = None
+    try:
+        create_idp_results(results)
+    except Exception as e:
+        write_error = e
+    else:
+        for result in results:
+            if result[3] == 'Empty':
+                print(f"No text extracted for doc_id: {result[0]}")
+            else:
+                print(f"IDP Processing successful for doc_id: {result[0]}")
+
+    outcomes = []
+    for _, doc_id in items:
+        # Skipped documents analyzed mein nahi hote; unka outcome success hai
+        result, error = analyzed.get(doc_id, (None, None))
+        outcomes.append((doc_id, error or (write_error if result else None)))
+    return outcomes
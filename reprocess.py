@@ -0,0 +1,174 @@
+"""
+Backfills IDP results for existing documents.
+
+Finds documents with no successful IDP result from the current
+idp.PIPELINE_VERSION (or, with --stale-before, only results older than that
+timestamp), runs extraction, NER and classification across a process pool
+and writes each batch in one transaction. Documents whose content was
+already processed by this version under another document just get a copy
+of that result, and files with no extractable text get an 'Empty' result so
+later runs skip them. Progress is checkpointed so an interrupted run resumes
+where it stopped:
+
+    flask reprocess --processes 4
+    flask reprocess --stale-before "2026-10-01 00:00:00"
+
+or, without the app, python reprocess.py with the same options.
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import deps
+from database import count_documents_for_reprocessing, create_idp_results, get_documents_for_reprocessing
+from idp import PIPELINE_VERSION, skip_current
+
+UPLOAD_FOLDER = 'uploads'
+CHECKPOINT_PATH = os.path.join('cache', 'reprocess-checkpoint.json')
+BATCH_SIZE = 16
+SCAN_PAGE = 500
+PROGRESS_SECONDS = 5.0
+# Checkpoint mein itne failed ids tak yaad rakhte hain
+MAX_FAILED_IDS = 1000
+
+def resolve_path(doc, upload_folder=UPLOAD_FOLDER):
+    """Where a document's bytes live: its blob, or uploads/<filename> for pre-blob uploads."""
+    return doc['storage_path'] or os.path.join(upload_folder, doc['filename'])
+
+def load_checkpoint(path, stale_before, pipeline_version=PIPELINE_VERSION):
+    """Saved progress for the same --stale-before and pipeline version, or a fresh one."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        checkpoint = None
+    if (not checkpoint or checkpoint.get('stale_before') != stale_before
+            or checkpoint.get('pipeline_version') != pipeline_version):
+        checkpoint = {'stale_before': stale_before, 'pipeline_version': pipeline_version,
+                      'last_id': 0, 'processed': 0, 'failed': []}
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    """Atomically writes the checkpoint file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def iter_batches(after_id, stale_before, batch_size, upload_folder):
+    """Yields lists of (file_path, doc_id, content_hash) in id order."""
+    while True:
+        docs = get_documents_for_reprocessing(after_id, SCAN_PAGE, stale_before, PIPELINE_VERSION)
+        if not docs:
+            return
+        for start in range(0, len(docs), batch_size):
+            yield [(resolve_path(doc, upload_folder), doc['id'], doc['content_hash'])
+                   for doc in docs[start:start + batch_size]]
+        after_id = docs[-1]['id']
+
+def _init_worker():
+    """Pool worker: documents pehle se parallel hain, isliye PDF pages ke liye naya pool nahi."""
+    import idp
+    idp.PDF_PROCESSES = 1
+    deps.preload('nlp')
+
+def analyze_batch(items):
+    """Pool task: analyzes one batch, returning picklable (doc_id, result, error message) rows."""
+    from idp import analyze_documents
+    try:
+        analyzed = analyze_documents(items)
+    except Exception as e:
+        return [(doc_id, None, str(e)) for _, doc_id, _ in items]
+    return [(doc_id, result, str(error) if error else None) for doc_id, result, error in analyzed]
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+def reprocess(processes=os.cpu_count() or 1, batch_size=BATCH_SIZE, stale_before=None,
+              checkpoint_path=CHECKPOINT_PATH, restart=False, upload_folder=UPLOAD_FOLDER,
+              progress_seconds=PROGRESS_SECONDS):
+    """Runs the backfill and returns the final checkpoint dict.
+
+    Batches are written in submission order, so the checkpoint's last_id
+    always means "everything up to here is done".
+    """
+    checkpoint = load_checkpoint(checkpoint_path, stale_before)
+    if restart:
+        checkpoint.update(last_id=0, processed=0, failed=[])
+    total = count_documents_for_reprocessing(checkpoint['last_id'], stale_before, PIPELINE_VERSION)
+    print(f"Reprocessing {total} document(s) after id {checkpoint['last_id']} with {processes} process(es).")
+
+    executor = None
+    if processes > 1:
+        executor = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker)
+    started = last_report = time.monotonic()
+    done = succeeded = empty = reused = 0
+    pending = deque()
+
+    def write(batch, rows, skipped=0):
+        nonlocal done, succeeded, empty, reused, last_report
+        results = [result for _, result, _ in rows if result]
+        create_idp_results(results)
+        failed = [doc_id for doc_id, _, error in rows if error]
+        for doc_id, _, error in rows:
+            if error:
+                print(f"Document {doc_id} failed: {error}")
+        checkpoint['failed'] = (checkpoint['failed'] + failed)[-MAX_FAILED_IDS:]
+        checkpoint['last_id'] = batch[-1][1]
+        checkpoint['processed'] += len(results) + skipped
+        save_checkpoint(checkpoint_path, checkpoint)
+        done += len(batch)
+        succeeded += len(results)
+        empty += sum(1 for result in results if result[3] == 'Empty')
+        reused += skipped
+
+        now = time.monotonic()
+        if now - last_report >= progress_seconds:
+            last_report = now
+            rate = done / (now - started)
+            eta = format_eta((total - done) / rate) if rate else '?'
+            print(f"{done}/{total} documents, {rate:.1f} docs/s, ETA {eta}")
+
+    try:
+        for batch in iter_batches(checkpoint['last_id'], stale_before, batch_size, upload_folder):
+            # Jinka content is version se pehle process ho chuka, unka result copy ho jaata hai
+            todo = skip_current(batch, stale_before)
+            skipped = len(batch) - len(todo)
+            if executor is None:
+                write(batch, analyze_batch(todo) if todo else [], skipped)
+                continue
+            pending.append((batch, executor.submit(analyze_batch, todo) if todo else None, skipped))
+            # Sirf kuch batches aage chalte hain, taaki memory aur checkpoint bounded rahein
+            if len(pending) >= processes * 2:
+                batch, future, skipped = pending.popleft()
+                write(batch, future.result() if future else [], skipped)
+        while pending:
+            batch, future, skipped = pending.popleft()
+            write(batch, future.result() if future else [], skipped)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.monotonic() - started
+    print(f"Done: {succeeded - empty} result(s) written, {empty} without text, {reused} reused, "
+          f"{done - succeeded - reused} failed, "
+          f"{done / elapsed if elapsed else 0:.1f} docs/s over {format_eta(elapsed)}.")
+    return checkpoint
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfill IDP results for existing documents.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--stale-before', help="Also redo results processed before this UTC timestamp.")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--restart', action='store_true', help="Ignore the saved checkpoint.")
+    parser.add_argument('--upload-folder', default=UPLOAD_FOLDER)
+    args = parser.parse_args()
+    reprocess(args.processes, args.batch_size, args.stale_before, args.checkpoint,
+              args.restart, args.upload_folder)
@@ -23,7 +23,9 @@ def run_tests():
         ("API Tests", "tests/test_api.py"),
         ("Authentication Tests", "tests/test_auth.py"),
         ("Dashboard Tests", "tests/test_dashboard.py"),
+        ("Database Tests", "tests/test_database.py"),
         ("File Upload Tests", "tests/test_file_upload.py"),
+        ("IDP Pipeline Tests", "tests/test_idp.py"),
         ("Integration Tests", "tests/test_integration.py")
     ]
     
@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', function () {
     initUpdates();
     applyDataHighlighting();
     initPrintExport();
+    initLiveEvents();
 });
 
 // Theme management
@@ -721,4 +722,20 @@ function initPrintExport() {
         // Clean up
         document.body.removeChild(link);
     }
-}
\ No newline at end of file
+}
+// Live document status / activity updates over server-sent events
+function initLiveEvents() {
+    if (!window.EventSource || !document.querySelector('[data-live-events]')) return;
+
+    const source = new EventSource('/api/events');
+    ['document_status', 'idp_result', 'activity', 'resync'].forEach(type => {
+        source.addEventListener(type, function(e) {
+            const detail = JSON.parse(e.data);
+            document.dispatchEvent(new CustomEvent(`dms:${type}`, { detail }));
+
+            if (type === 'document_status') {
+                showToast(`Document #${detail.document_id} is now ${detail.status}`, 'success');
+            }
+        });
+    });
+}
@@ -0,0 +1,136 @@
+"""
+Content-addressed upload storage for KMRL DMS.
+
+Files are hashed (SHA-256) while they stream to disk and stored once under
+uploads/blobs/<aa>/<sha256>.<ext>; the blobs table keeps a refcount.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from database import acquire_blob, release_blob, delete_upload_session, get_stale_upload_sessions
+
+CHUNK_SIZE = 1024 * 1024
+
+# Chunked uploads ka running hash, taaki finalize par poori file dobara na padhni pade.
+# Kisi doosre process ne chunk liya ho to finalize file ko disk se hash kar leta hai.
+_partial_digests = {}
+_partial_lock = threading.Lock()
+
+def save_stream(stream, upload_folder):
+    """Streams a file object to a temp file, hashing as it goes.
+
+    Returns (tmp_path, sha256, size).
+    """
+    tmp_dir = os.path.join(upload_folder, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+def file_sha256(file_path):
+    """SHA-256 of a file's contents, read in CHUNK_SIZE blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def partial_path(upload_folder, upload_id):
+    """Temp file holding a chunked upload's bytes so far."""
+    return os.path.join(upload_folder, 'tmp', f"{upload_id}.part")
+
+def start_partial(upload_folder, upload_id):
+    """Creates the empty temp file for a chunked upload."""
+    path = partial_path(upload_folder, upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    with _partial_lock:
+        _partial_digests[upload_id] = (0, hashlib.sha256())
+
+def write_chunk(upload_folder, upload_id, offset, stream, max_bytes=None):
+    """Writes a request body stream at offset, hashing it if the running hash is in sync.
+
+    Returns the number of bytes written. A failed or dropped chunk is
+    overwritten when the client resends it from the same offset.
+    """
+    with _partial_lock:
+        state = _partial_digests.pop(upload_id, None)
+    digest = state[1] if state and state[0] == offset else None
+
+    written = 0
+    with open(partial_path(upload_folder, upload_id), 'r+b') as out:
+        out.seek(offset)
+        out.truncate()
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            if max_bytes is not None and written + len(chunk) > max_bytes:
+                raise ValueError("Chunk goes past the declared file size")
+            out.write(chunk)
+            if digest:
+                digest.update(chunk)
+            written += len(chunk)
+    if digest:
+        with _partial_lock:
+            _partial_digests[upload_id] = (offset + written, digest)
+    return written
+
+def finish_partial(upload_folder, upload_id, size):
+    """Returns (tmp_path, sha256) for a completed chunked upload."""
+    path = partial_path(upload_folder, upload_id)
+    with _partial_lock:
+        state = _partial_digests.pop(upload_id, None)
+    if state and state[0] == size:
+        return path, state[1].hexdigest()
+    return path, file_sha256(path)
+
+def discard_partial(upload_folder, upload_id):
+    """Deletes an upload session and its temp file."""
+    with _partial_lock:
+        _partial_digests.pop(upload_id, None)
+    delete_upload_session(upload_id)
+    path = partial_path(upload_folder, upload_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+def cleanup_stale_uploads(upload_folder, max_age_hours=24):
+    """Discards chunked uploads abandoned for more than max_age_hours."""
+    stale = get_stale_upload_sessions(max_age_hours)
+    for upload_id in stale:
+        discard_partial(upload_folder, upload_id)
+    return len(stale)
+
+def blob_path(upload_folder, sha256, file_type=None):
+    """Storage path for a blob."""
+    name = f"{sha256}.{file_type}" if file_type else sha256
+    return os.path.join(upload_folder, 'blobs', sha256[:2], name)
+
+def store_blob(upload_folder, tmp_path, sha256, size, file_type=None):
+    """Moves a hashed temp file into blob storage, or drops it if the bytes already exist.
+
+    Returns (storage_path, is_new).
+    """
+    candidate = blob_path(upload_folder, sha256, file_type)
+    os.makedirs(os.path.dirname(candidate), exist_ok=True)
+    storage_path, refcount = acquire_blob(sha256, candidate, size)
+    if os.path.exists(storage_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, storage_path)
+    return storage_path, refcount == 1
+
+def release(sha256):
+    """Drops one reference to a blob, deleting the file with the last one."""
+    storage_path = release_blob(sha256)
+    if storage_path and os.path.exists(storage_path):
+        os.remove(storage_path)
@@ -60,3 +60,31 @@ def test_document():
         'filename': 'test_document.pdf',
         'content': b'%PDF-1.4\n1 0 obj\n<<\n/Type /Catalog\n/Pages 2 0 R\n>>\nendobj\n2 0 obj\n<<\n/Type /Pages\n/Kids [3 0 R]\n/Count 1\n>>\nendobj\n3 0 obj\n<<\n/Type /Page\n/Parent 2 0 R\n/MediaBox [0 0 612 792]\n>>\nendobj\nxref\n0 4\n0000000000 65535 f \n0000000009 00000 n \n0000000058 00000 n \n0000000115 00000 n \ntrailer\n<<\n/Size 4\n/Root 1 0 R\n>>\nstartxref\n174\n%%EOF'
     }
+
+@pytest.fixture(scope="function")
+def temp_db(tmp_path, monkeypatch):
+    """Point database.py at a fresh temporary SQLite file."""
+    import database
+    import cache
+    monkeypatch.setattr(database, 'DATABASE_NAME', str(tmp_path / 'test.db'))
+    cache.dashboard_cache.clear()
+    cache.activity_cache.clear()
+    cache.count_cache.clear()
+    database.init_db()
+    yield database
+    database.get_pool().close()
+
+@pytest.fixture(scope="function")
+def user_client(temp_db, tmp_path):
+    """Flask test client logged in as a regular user, on a temporary database."""
+    old_upload_folder = app.config['UPLOAD_FOLDER']
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    user_id = temp_db.create_user('Test User', 'test@kmrl.com', 'hashed')
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['user_name'] = 'Test User'
+            sess['user_role'] = 'user'
+        client.user_id = user_id
+        yield client
+    app.config['UPLOAD_FOLDER'] = old_upload_folder
@@ -50,3 +50,295 @@ class TestAPIEndpoints:
         """Test that reject document endpoint requires authentication."""
         response = test_app.get('/reject/1')
         assert response.status_code == 302  # Redirects to dashboard
+
+
+class TestSearchAPI:
+    """Test /api/search with the Flask test client."""
+
+    def test_filter_only_search_paginates(self, user_client, temp_db):
+        """Test that filter-only searches return a keyset cursor."""
+        for name in ('one.pdf', 'two.pdf', 'three.txt'):
+            temp_db.create_document(name, user_client.user_id, name.rsplit('.', 1)[-1], 1)
+
+        data = user_client.get('/api/search?type=PDF&per_page=1').get_json()
+        assert len(data['documents']) == 1
+        assert data['documents'][0]['type'] == 'PDF'
+        data = user_client.get(f"/api/search?type=PDF&per_page=1&cursor={data['next_cursor']}").get_json()
+        assert len(data['documents']) == 1
+        assert data['next_cursor'] is None
+
+    def test_text_search_returns_snippets(self, user_client, temp_db):
+        """Test that text queries are ranked and highlighted."""
+        temp_db.create_document('tender_notice.pdf', user_client.user_id, 'pdf', 1)
+        data = user_client.get('/api/search?q=tend').get_json()
+        assert data['total'] == 1
+        assert '<mark>' in data['documents'][0]['snippet']
+
+    def test_results_come_with_facets(self, user_client, temp_db):
+        """Test that one response carries both results and facet counts."""
+        temp_db.create_document('tender_notice.pdf', user_client.user_id, 'pdf', 1)
+        data = user_client.get('/api/search?q=tender&facets=status,type').get_json()
+        assert data['total'] == 1
+        assert data['facets'] == {'status': [{'value': 'Pending', 'count': 1}],
+                                  'type': [{'value': 'pdf', 'count': 1}]}
+
+    def test_bad_date_is_rejected(self, user_client):
+        """Test that a malformed date filter is a 400, not a 500."""
+        response = user_client.get('/api/search?date=yesterday')
+        assert response.status_code == 400
+
+
+class TestDocumentListAPI:
+    """Test cursor-paginated /api/documents."""
+
+    def test_pages_follow_cursor_without_overlap(self, user_client, temp_db):
+        """Test that walking next_cursor visits every document exactly once."""
+        for i in range(5):
+            temp_db.create_document(f'doc{i}.pdf', user_client.user_id, 'pdf', 1)
+
+        seen, cursor = [], ''
+        while True:
+            data = user_client.get(f'/api/documents?limit=2&cursor={cursor}').get_json()
+            assert data['total'] == 5 and data['total_exact']
+            seen.extend(doc['id'] for doc in data['documents'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen)) == 5
+
+    def test_fields_and_filtered_total(self, user_client, temp_db):
+        """Test that fields limits the columns and filtered totals are counted."""
+        temp_db.create_document('a.pdf', user_client.user_id, 'pdf', 1)
+        temp_db.create_document('b.txt', user_client.user_id, 'txt', 1)
+
+        data = user_client.get('/api/documents?type=pdf&fields=filename').get_json()
+        assert data['total'] == 1 and not data['total_exact']
+        assert set(data['documents'][0]) == {'id', 'filename', 'upload_date'}
+
+    def test_unknown_field_is_rejected(self, user_client):
+        """Test that columns outside the whitelist are a 400."""
+        response = user_client.get('/api/documents?fields=password')
+        assert response.status_code == 400
+
+
+class TestAdminQueue:
+    """Test the manager pending-approval page."""
+
+    def test_manager_sees_filtered_page(self, user_client, temp_db, monkeypatch):
+        """Test that the admin page renders pending rows and a next-page link."""
+        with user_client.session_transaction() as sess:
+            sess['user_role'] = 'manager'
+        for name in ('a.pdf', 'b.pdf', 'c.txt'):
+            temp_db.create_document(name, user_client.user_id, name.rsplit('.', 1)[-1], 1)
+
+        monkeypatch.setattr('app.ADMIN_PAGE_SIZE', 1)
+        html = user_client.get('/admin?type=pdf').get_data(as_text=True)
+        assert 'b.pdf' in html and 'c.txt' not in html
+        assert 'Next page' in html
+
+
+class TestBulkStatusAPI:
+    """Test POST /api/documents/bulk_status."""
+
+    def test_requires_manager(self, user_client):
+        """Test that regular users cannot bulk-approve."""
+        response = user_client.post('/api/documents/bulk_status', json={'ids': [1], 'status': 'Approved'})
+        assert response.status_code == 403
+
+    def test_updates_and_reports_skipped(self, user_client, temp_db):
+        """Test that one call updates pending documents and lists the rest as skipped."""
+        with user_client.session_transaction() as sess:
+            sess['user_role'] = 'manager'
+        ids = [temp_db.create_document(f'doc{i}.pdf', user_client.user_id, 'pdf', 1) for i in range(3)]
+        temp_db.update_document_status(ids[2], 'Approved')
+
+        data = user_client.post('/api/documents/bulk_status',
+                                json={'ids': ids + [9999], 'status': 'Approved'}).get_json()
+        assert data['updated'] == ids[:2]
+        assert data['skipped'] == [{'id': ids[2], 'reason': 'unchanged'}, {'id': 9999, 'reason': 'not_found'}]
+        assert temp_db.get_user_stats(user_client.user_id)['pending_approval'] == 0
+        actions = [a['action'] for a in temp_db.get_recent_activity(limit=10)]
+        assert actions.count('approve') == 2
+
+    def test_rejects_bad_payload(self, user_client):
+        """Test that an unknown status or non-list ids is a 400."""
+        with user_client.session_transaction() as sess:
+            sess['user_role'] = 'manager'
+        assert user_client.post('/api/documents/bulk_status', json={'ids': [1], 'status': 'Deleted'}).status_code == 400
+        assert user_client.post('/api/documents/bulk_status', json={'ids': '1', 'status': 'Approved'}).status_code == 400
+
+
+class TestAuditAPI:
+    """Test the manager audit-trail endpoint."""
+
+    def test_manager_queries_audit_trail(self, user_client, temp_db):
+        """Test that /api/audit filters entries newest first and pages with a cursor."""
+        with user_client.session_transaction() as sess:
+            sess['user_role'] = 'manager'
+        for i in range(3):
+            temp_db.add_audit_log(user_client.user_id, 'upload', 'document', i)
+        temp_db.add_audit_log(user_client.user_id, 'login', 'user', user_client.user_id)
+
+        data = user_client.get('/api/audit?action=upload&limit=2').get_json()
+        assert [e['target_id'] for e in data['entries']] == [2, 1]
+        assert data['truncated']
+        rest = user_client.get(f"/api/audit?action=upload&limit=2&cursor={data['next_cursor']}").get_json()
+        assert [e['target_id'] for e in rest['entries']] == [0]
+        assert not rest['truncated'] and rest['next_cursor'] is None
+
+        oldest = user_client.get('/api/audit?action=upload&limit=1&order=asc').get_json()
+        assert [e['target_id'] for e in oldest['entries']] == [0]
+        assert user_client.get('/api/audit?cursor=nope').status_code == 400
+
+    def test_requires_manager(self, user_client):
+        """Test that regular users cannot read the audit trail."""
+        assert user_client.get('/api/audit').status_code == 403
+
+
+class TestEntitiesAPI:
+    """Test /api/entities."""
+
+    def test_returns_documents_and_facets(self, user_client, temp_db):
+        """Test that a label/value query returns matching documents with facet counts."""
+        doc = temp_db.create_document('supply.pdf', user_client.user_id, 'pdf', 1)
+        temp_db.create_document('other.pdf', user_client.user_id, 'pdf', 1)
+        temp_db.create_idp_result(doc, 'Purchase Order', {'ORG': ['Acme Corp']})
+
+        data = user_client.get('/api/entities?label=ORG&value=acme&match=prefix').get_json()
+        assert [d['name'] for d in data['documents']] == ['supply.pdf']
+        assert data['facets'] == [{'label': 'ORG', 'value': 'Acme Corp', 'value_norm': 'acme corp', 'count': 1}]
+
+
+class TestChartsAPI:
+    """Test chart endpoints served from rollups."""
+
+    def test_status_chart_revalidates(self, user_client, temp_db):
+        """Test the per-user status chart and its 304 on an unchanged ETag."""
+        temp_db.create_document('a.pdf', user_client.user_id, 'pdf', 1)
+        first = user_client.get('/api/charts/document_status')
+        assert first.get_json()['labels'] == ['Pending']
+        again = user_client.get('/api/charts/document_status', headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+
+    def test_timeseries_chart(self, user_client, temp_db):
+        """Test that the time series has one label per day."""
+        temp_db.create_document('a.pdf', user_client.user_id, 'pdf', 1)
+        data = user_client.get('/api/charts/document_timeseries?days=14').get_json()
+        assert len(data['labels']) == 14
+        assert data['datasets']['Uploaded'][-1] == 1
+
+
+class TestDashboardAPICache:
+    """Test cached /api/dashboard payloads and conditional requests."""
+
+    def test_unchanged_poll_returns_304(self, user_client, temp_db):
+        """Test that If-None-Match with the current ETag returns an empty 304."""
+        first = user_client.get('/api/dashboard')
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+
+        again = user_client.get('/api/dashboard', headers={'If-None-Match': etag})
+        assert again.status_code == 304
+        assert again.data == b''
+
+    def test_writes_invalidate_cached_payload(self, user_client, temp_db):
+        """Test that an update through the API is visible on the next poll."""
+        from io import BytesIO
+        user_client.post('/upload', data={'document': (BytesIO(b'hello'), 'memo.txt')},
+                         content_type='multipart/form-data')
+        first = user_client.get('/api/dashboard')
+        doc_id = first.get_json()['documents'][0]['id']
+        assert first.get_json()['stats']['total_documents'] == 1
+
+        user_client.post(f'/api/update_document/{doc_id}', json={'filename': 'renamed memo.txt'})
+        second = user_client.get('/api/dashboard', headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 200
+        assert second.get_json()['documents'][0]['name'] == 'renamed_memo.txt'
+
+        user_client.delete(f'/api/delete_document/{doc_id}')
+        assert user_client.get('/api/dashboard').get_json()['documents'] == []
+
+    def test_lru_bound_and_ttl(self):
+        """Test that the cache evicts the least recently used entry and expires old ones."""
+        from cache import TTLCache
+        lru = TTLCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        assert lru.get('b') is None
+        assert lru.get('a') == 1
+
+        expired = TTLCache(maxsize=2, ttl=-1)
+        expired.set('a', 1)
+        assert expired.get('a') is None
+
+
+class TestLiveEvents:
+    """Test the SSE pub/sub used by /api/events."""
+
+    def test_events_reach_only_their_user(self):
+        """Test that user-targeted events skip other users and broadcasts reach all."""
+        from events import EventBus
+        bus = EventBus()
+        alice, bob = bus.subscribe(1), bus.subscribe(2)
+        bus.publish('document_status', {'document_id': 7, 'status': 'Approved'}, user_id=1)
+        bus.publish('activity', {'action': 'login'})
+        assert alice.queue.qsize() == 2
+        assert bob.queue.get_nowait() == ('activity', {'action': 'login'})
+
+    def test_slow_subscriber_is_bounded_and_resyncs(self):
+        """Test that a full buffer drops the oldest events and the stream asks for a resync."""
+        import events
+        subscriber = events.bus.subscribe(1, buffer_size=2)
+        for i in range(5):
+            events.bus.publish('activity', {'n': i})
+        assert subscriber.queue.qsize() == 2
+        assert subscriber.lost == 3
+
+        stream = events.stream(subscriber, heartbeat=0.01)
+        assert next(stream).startswith('retry:')
+        assert next(stream).startswith('event: resync')
+        assert '"n": 3' in next(stream)
+        assert '"n": 4' in next(stream)
+        assert next(stream) == ': heartbeat\n\n'
+        stream.close()
+        assert subscriber not in events.bus._subscribers
+
+    def test_status_change_is_published(self, temp_db):
+        """Test that update_document_status notifies the document owner."""
+        import events
+        doc_id = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        subscriber = events.bus.subscribe(1)
+        try:
+            temp_db.update_document_status(doc_id, 'Approved')
+            assert subscriber.queue.get_nowait() == ('document_status', {'document_id': doc_id, 'status': 'Approved'})
+        finally:
+            events.bus.unsubscribe(subscriber)
+
+    def test_events_endpoint_requires_login(self, test_app):
+        """Test that /api/events requires authentication."""
+        assert test_app.get('/api/events').status_code == 401
+
+    def test_dashboard_enables_live_events(self, user_client, temp_db):
+        """Test that the dashboard has the hook that starts the SSE client."""
+        response = user_client.get('/dashboard')
+        assert response.status_code == 200
+        assert b'data-live-events' in response.data
+
+    def test_idle_watcher_does_not_replay_old_results(self, temp_db):
+        """Test that results created with no subscribers are not sent to the first client."""
+        import events
+        doc_id = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_idp_result(doc_id, 'Invoice', {})
+        last_id = events._poll_idp_results(0)
+        assert last_id == temp_db.get_latest_idp_result_id()
+
+        subscriber = events.bus.subscribe(1)
+        try:
+            temp_db.create_idp_result(doc_id, 'Drawing', {})
+            events._poll_idp_results(last_id)
+            assert subscriber.queue.qsize() == 1
+            assert subscriber.queue.get_nowait()[1]['classification'] == 'Drawing'
+        finally:
+            events.bus.unsubscribe(subscriber)
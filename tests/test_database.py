@@ -0,0 +1,587 @@
+"""
+Database layer tests for KMRL DMS.
+"""
+import threading
+from datetime import datetime
+import pytest
+from database import ConnectionPool
+
+class TestConnectionPool:
+    """Test pooled SQLite connections."""
+
+    def test_connection_is_configured_once(self, tmp_path):
+        """Test that pooled connections use WAL and synchronous=NORMAL."""
+        pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=2)
+        conn = pool.acquire()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        pool.release(conn)
+
+        again = pool.acquire()
+        assert again is conn
+        pool.release(again)
+        stats = pool.stats()
+        assert stats['created'] == 1
+        assert stats['checkouts'] == 2
+        assert stats['in_use'] == 0
+
+    def test_pool_is_bounded(self, tmp_path):
+        """Test that acquire waits when every connection is checked out."""
+        pool = ConnectionPool(str(tmp_path / 'pool.db'), max_size=1, timeout=0.05)
+        conn = pool.acquire()
+        with pytest.raises(TimeoutError):
+            pool.acquire()
+
+        threading.Timer(0.01, pool.release, args=(conn,)).start()
+        pool.timeout = 1.0
+        pool.release(pool.acquire())
+        stats = pool.stats()
+        assert stats['waits'] == 2
+        assert stats['peak_in_use'] == 1
+
+    def test_request_reuses_one_connection(self, temp_db):
+        """Test that helpers share one connection inside an app context."""
+        from app import app
+        before = temp_db.get_pool_stats()
+        with app.app_context():
+            temp_db.get_user_by_email('manager@kmrl.com')
+            temp_db.get_user_stats(1)
+            temp_db.get_recent_activity(5)
+        after = temp_db.get_pool_stats()
+        assert after['checkouts'] - before['checkouts'] == 1
+        assert after['in_use'] == before['in_use']
+
+
+class TestIDPJobQueue:
+    """Test the persistent background processing queue."""
+
+    def test_claim_and_complete(self, temp_db):
+        """Test that a queued job is claimed once and marked done."""
+        doc_id = temp_db.create_document('a.pdf', 1, 'pdf', 10)
+        job_id = temp_db.enqueue_idp_job(doc_id, 'uploads/a.pdf')
+
+        job = temp_db.claim_idp_job('w1')
+        assert job['id'] == job_id
+        assert job['status'] == 'running'
+        assert job['attempts'] == 1
+        assert temp_db.claim_idp_job('w2') is None
+
+        temp_db.complete_idp_job(job_id)
+        assert temp_db.get_document_details(doc_id)['processing']['status'] == 'done'
+
+    def test_failure_retries_with_backoff(self, temp_db):
+        """Test that failed jobs are delayed, then marked failed when exhausted."""
+        doc_id = temp_db.create_document('b.pdf', 1, 'pdf', 10)
+        job_id = temp_db.enqueue_idp_job(doc_id, 'uploads/b.pdf', max_attempts=2)
+
+        temp_db.claim_idp_job('w1')
+        assert temp_db.fail_idp_job(job_id, 'boom', backoff_seconds=60) is True
+        assert temp_db.claim_idp_job('w1') is None  # still backing off
+
+        conn = temp_db.get_db_connection()
+        conn.execute("UPDATE idp_jobs SET run_after = datetime('now', '-1 seconds')")
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+        assert temp_db.claim_idp_job('w1')['attempts'] == 2
+        assert temp_db.fail_idp_job(job_id, 'boom again') is False
+        processing = temp_db.get_document_details(doc_id)['processing']
+        assert processing['status'] == 'failed'
+        assert processing['last_error'] == 'boom again'
+
+
+class TestFullTextSearch:
+    """Test the FTS5 document index."""
+
+    def test_index_follows_documents_tags_and_idp_results(self, temp_db):
+        """Test that triggers keep filename, tags, text and entities searchable."""
+        doc_id = temp_db.create_document('metro_circular.pdf', 1, 'pdf', 10)
+        other = temp_db.create_document('budget.xlsx', 1, 'xlsx', 10)
+        temp_db.create_idp_result(doc_id, 'General Document', {'ORG': ['Kochi Metro Rail']},
+                                  text='Safety circular for <Aluva> depot staff')
+        conn = temp_db.get_db_connection()
+        conn.execute("INSERT INTO document_tags (document_id, tag_name) VALUES (?, 'urgent')", (other,))
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+        assert [d['id'] for d in temp_db.search_documents(1, 'circular')[0]] == [doc_id]
+        assert [d['id'] for d in temp_db.search_documents(1, 'aluv')[0]] == [doc_id]
+        assert [d['id'] for d in temp_db.search_documents(1, 'Kochi Rail')[0]] == [doc_id]
+        assert [d['id'] for d in temp_db.search_documents(1, 'urgent')[0]] == [other]
+        assert temp_db.search_documents(2, 'circular') == ([], 0)
+
+        snippet = temp_db.search_documents(1, 'depot')[0][0]['snippet']
+        assert '<mark>depot</mark>' in snippet
+        assert '&lt;Aluva&gt;' in snippet
+
+        temp_db.delete_document(doc_id)
+        assert temp_db.search_documents(1, 'circular') == ([], 0)
+
+    def test_index_stores_no_text_and_stays_consistent(self, temp_db):
+        """Test that the index reads text from idp_results and matches it after every kind of change."""
+        doc_id = temp_db.create_document('old_name.pdf', 1, 'pdf', 10)
+        temp_db.create_idp_result(doc_id, 'General Document', {'ORG': ['Acme']}, text='first draft')
+        temp_db.create_idp_result(doc_id, 'General Document', {'ORG': ['Globex']}, text='final version')
+        temp_db.update_document(doc_id, filename='new_name.pdf')
+        conn = temp_db.get_db_connection()
+        conn.execute("INSERT INTO document_tags (document_id, tag_name) VALUES (?, 'urgent')", (doc_id,))
+        conn.execute("DELETE FROM document_tags WHERE document_id = ?", (doc_id,))
+        conn.commit()
+        # rank = 1: index ko content (documents_search view) ke against check karo
+        conn.execute("INSERT INTO documents_fts (documents_fts, rank) VALUES ('integrity-check', 1)")
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'documents_fts_content'").fetchone()[0] == 0
+        temp_db.release_db_connection(conn)
+
+        assert [d['id'] for d in temp_db.search_documents(1, 'final Globex new_name')[0]] == [doc_id]
+        assert temp_db.search_documents(1, 'draft') == ([], 0)
+        assert temp_db.search_documents(1, 'Acme') == ([], 0)
+
+    def test_triggers_are_only_recreated_when_changed(self, temp_db):
+        """Test that unchanged triggers are left alone and changed ones are swapped in one transaction."""
+        import sqlite3
+        conn = sqlite3.connect(':memory:')
+        conn.execute("CREATE TABLE t (a)")
+        old = "CREATE TRIGGER t_insert AFTER INSERT ON t BEGIN SELECT 1; END"
+        new = "CREATE TRIGGER t_insert AFTER INSERT ON t BEGIN SELECT 2; END"
+        temp_db._sync_triggers(conn.cursor(), [old])
+        statements = []
+        conn.set_trace_callback(statements.append)
+
+        temp_db._sync_triggers(conn.cursor(), [old])
+        assert not [sql for sql in statements if 'TRIGGER' in sql]
+
+        del statements[:]
+        temp_db._sync_triggers(conn.cursor(), [new])
+        assert [sql.strip() for sql in statements[1:]] == [
+            'BEGIN IMMEDIATE;', 'DROP TRIGGER IF EXISTS t_insert;', f'{new};', 'COMMIT;']
+        assert conn.execute("SELECT sql FROM sqlite_master WHERE name = 't_insert'").fetchone()[0] == new
+
+    def test_ranking_and_pagination(self, temp_db):
+        """Test that filename matches rank first and pages are bounded."""
+        body_match = temp_db.create_document('notes.txt', 1, 'txt', 1)
+        temp_db.create_idp_result(body_match, 'General Document', {}, text='mentions invoice once')
+        name_match = temp_db.create_document('invoice_march.pdf', 1, 'pdf', 1)
+
+        docs, total = temp_db.search_documents(1, 'invoice', per_page=1)
+        assert total == 2
+        assert [d['id'] for d in docs] == [name_match]
+        docs, _ = temp_db.search_documents(1, 'invoice', page=2, per_page=1)
+        assert [d['id'] for d in docs] == [body_match]
+
+    def test_query_syntax_is_escaped(self, temp_db):
+        """Test that FTS operators in user input do not raise."""
+        temp_db.create_document('a "quoted" NEAR(file).pdf', 1, 'pdf', 1)
+        docs, total = temp_db.search_documents(1, '"quoted" NEAR(')
+        assert total == 1
+        assert temp_db.search_documents(1, 'AND OR NOT *')[1] == 0
+
+
+class TestDocumentQueryBuilder:
+    """Test SQL-side filters and keyset pagination."""
+
+    def make_docs(self, temp_db):
+        conn = temp_db.get_db_connection()
+        rows = [
+            ('a.pdf', 'pdf', 'Pending', '2024-03-01 09:00:00'),
+            ('b.pdf', 'pdf', 'Approved', '2024-03-01 18:30:00'),
+            ('c.txt', 'txt', 'Pending', '2024-03-02 10:00:00'),
+            ('d.pdf', 'pdf', 'Pending', '2024-03-02 10:00:00'),
+            ('e.pdf', 'pdf', 'Pending', '2024-03-03 08:00:00'),
+        ]
+        for name, file_type, status, date in rows:
+            conn.execute(
+                """INSERT INTO documents (filename, uploader_id, file_type, status, upload_date)
+                   VALUES (?, 1, ?, ?, ?)""", (name, file_type, status, date))
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+    def test_keyset_pages_cover_everything_once(self, temp_db):
+        """Test that cursor pages are newest first with ties broken by id."""
+        self.make_docs(temp_db)
+        names, cursor = [], None
+        while True:
+            docs, cursor = temp_db.list_documents(1, limit=2, cursor=cursor)
+            names.extend(d['filename'] for d in docs)
+            if cursor is None:
+                break
+        assert names == ['e.pdf', 'd.pdf', 'c.txt', 'b.pdf', 'a.pdf']
+
+    def test_filters(self, temp_db):
+        """Test status, type and date filters."""
+        self.make_docs(temp_db)
+        docs, _ = temp_db.list_documents(1, status='Pending', file_type='pdf')
+        assert [d['filename'] for d in docs] == ['e.pdf', 'd.pdf', 'a.pdf']
+        docs, _ = temp_db.list_documents(1, date='2024-03-01')
+        assert [d['filename'] for d in docs] == ['b.pdf', 'a.pdf']
+        with pytest.raises(ValueError):
+            temp_db.list_documents(1, date='01/03/2024')
+        with pytest.raises(ValueError):
+            temp_db.list_documents(1, cursor='not-a-cursor')
+
+    def test_filters_use_indexes(self, temp_db):
+        """Test that the filtered listing is an index search, not a table scan."""
+        where_sql, params = temp_db.build_document_filters(1, status='Pending', date='2024-03-01')
+        conn = temp_db.get_db_connection()
+        plan = ' '.join(row[3] for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM documents d WHERE {where_sql} ORDER BY d.upload_date DESC, d.id DESC",
+            params))
+        temp_db.release_db_connection(conn)
+        assert 'idx_documents_uploader_status_date' in plan
+        assert 'SCAN d' not in plan
+
+
+class TestDashboardStats:
+    """Test single-query stats and the rollup-backed counters."""
+
+    def test_counters_follow_create_status_and_delete(self, temp_db):
+        """Test that stats follow creates, status changes and deletes via the rollup triggers."""
+        first = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.update_document_status(first, 'Approved')
+        expected = {'total_documents': 2, 'uploaded_today': 2, 'pending_approval': 1, 'archived_count': 0}
+        assert temp_db.get_user_stats(1) == expected
+
+        temp_db.delete_document(first)
+        assert temp_db.get_user_stats(1) == {'total_documents': 1, 'uploaded_today': 1, 'pending_approval': 1,
+                                             'archived_count': 0}
+        assert temp_db.rebuild_status_rollups() == 0
+
+    def test_grouped_query_matches_rollups(self, temp_db, monkeypatch):
+        """Test that the fallback single query agrees with the rollups."""
+        doc = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.update_document_status(doc, 'Rejected')
+        conn = temp_db.get_db_connection()
+        conn.execute("INSERT INTO documents (filename, uploader_id, upload_date) VALUES ('old.pdf', 1, '2020-01-01 00:00:00')")
+        conn.commit()
+        temp_db.release_db_connection(conn)
+        with_rollups = temp_db.get_user_stats(1)
+        monkeypatch.setattr(temp_db, 'USE_STATUS_ROLLUPS', False)
+        assert temp_db.get_user_stats(1) == with_rollups
+
+    def test_rebuild_repairs_drift(self, temp_db):
+        """Test that the repair command fixes rollups edited behind the triggers' back."""
+        temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        conn = temp_db.get_db_connection()
+        conn.execute("UPDATE doc_status_by_uploader SET count = 5 WHERE uploader_id = 1")
+        conn.execute("INSERT INTO doc_status_by_uploader (uploader_id, status, count) VALUES (99, 'Pending', 5)")
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+        assert temp_db.rebuild_status_rollups() == 2
+        assert temp_db.get_user_stats(1)['total_documents'] == 2
+        assert temp_db.get_user_stats(1)['uploaded_today'] == 2
+        assert temp_db.get_user_stats(99)['total_documents'] == 0
+        assert temp_db.rebuild_status_rollups() == 0
+
+    def test_status_day_survives_edits(self, temp_db):
+        """Test that a rename after approval does not move the approval's day in the daily rollup."""
+        doc = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        other = temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.update_document_status(doc, 'Approved')
+        temp_db.update_document_status(other, 'Approved')
+        conn = temp_db.get_db_connection()
+        # Approval ek purane din hui thi
+        conn.execute("UPDATE documents SET status_changed_at = '2026-01-05 10:00:00' WHERE id = ?", (doc,))
+        conn.execute("UPDATE doc_status_daily SET count = count - 1 WHERE day = date('now') AND status = 'Approved'")
+        conn.execute("INSERT INTO doc_status_daily VALUES (1, '2026-01-05', 'Approved', 1)")
+        conn.commit()
+        temp_db.update_document(doc, filename='renamed.pdf')
+        temp_db.update_document_status(other, 'Rejected')
+        temp_db.delete_document(doc)
+        rows = conn.execute("SELECT day, status, count FROM doc_status_daily WHERE status != 'Uploaded'").fetchall()
+        temp_db.release_db_connection(conn)
+
+        assert {(row['day'], row['status']): row['count'] for row in rows if row['count']} == {
+            (datetime.utcnow().strftime('%Y-%m-%d'), 'Rejected'): 1}
+        assert temp_db.rebuild_status_rollups() == 0
+
+    def test_drift_check_compares_every_daily_row(self, temp_db):
+        """Test that a wrong count on a past day is reported, not just silently rewritten."""
+        temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        conn = temp_db.get_db_connection()
+        conn.execute("INSERT INTO doc_status_daily VALUES (1, '2026-01-05', 'Approved', 1)")
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+        assert temp_db.rebuild_status_rollups() == 1
+        assert temp_db.rebuild_status_rollups() == 0
+
+
+class TestPendingQueue:
+    """Test the paginated admin pending queue."""
+
+    def test_dates_are_datetimes_and_pages_chain(self, temp_db):
+        """Test that upload_date is converted by SQLite and the cursor pages through."""
+        alice = temp_db.create_user('Alice', 'alice@kmrl.com', 'x')
+        for i in range(3):
+            temp_db.create_document(f'doc{i}.pdf', alice, 'pdf', 1)
+
+        first, cursor = temp_db.get_pending_documents(limit=2)
+        assert len(first) == 2 and cursor
+        assert isinstance(first[0]['upload_date'], datetime)
+        assert first[0]['full_name'] == 'Alice'
+        rest, cursor = temp_db.get_pending_documents(limit=2, cursor=cursor)
+        assert len(rest) == 1 and cursor is None
+
+    def test_filters(self, temp_db):
+        """Test uploader, type and age filters."""
+        alice = temp_db.create_user('Alice', 'alice@kmrl.com', 'x')
+        bob = temp_db.create_user('Bob', 'bob@kmrl.com', 'x')
+        temp_db.create_document('a.pdf', alice, 'pdf', 1)
+        temp_db.create_document('b.txt', bob, 'txt', 1)
+        conn = temp_db.get_db_connection()
+        conn.execute("""INSERT INTO documents (filename, uploader_id, file_type, upload_date)
+                        VALUES ('old.pdf', ?, 'pdf', '2020-01-01 00:00:00')""", (bob,))
+        conn.commit()
+        temp_db.release_db_connection(conn)
+
+        names = lambda **kw: [d['filename'] for d in temp_db.get_pending_documents(**kw)[0]]
+        assert names(uploader_id=bob) == ['b.txt', 'old.pdf']
+        assert names(file_type='pdf') == ['a.pdf', 'old.pdf']
+        assert names(older_than_days=30) == ['old.pdf']
+        assert [u['full_name'] for u in temp_db.get_pending_uploaders()] == ['Alice', 'Bob']
+
+
+class TestAuditSink:
+    """Test the batched audit-log writer in each durability mode."""
+
+    def _count(self, temp_db):
+        conn = temp_db.get_db_connection()
+        count = conn.execute("SELECT COUNT(*) FROM audit_log").fetchone()[0]
+        temp_db.release_db_connection(conn)
+        return count
+
+    @pytest.mark.parametrize('mode', ['sync', 'group'])
+    def test_entry_is_committed_when_log_returns(self, temp_db, mode):
+        """Test that sync and group callers see their row as soon as log() returns."""
+        from audit import AuditSink
+        sink = AuditSink(mode=mode)
+        try:
+            sink.log(1, 'login', 'user', 1)
+            assert self._count(temp_db) == 1
+        finally:
+            sink.close()
+
+    def test_async_batches_and_flushes_on_close(self, temp_db):
+        """Test that async entries are written in batches and close() drains the queue."""
+        from audit import AuditSink
+        sink = AuditSink(mode='async', batch_size=50, flush_interval=60)
+        for i in range(120):
+            sink.log(1, 'upload', 'document', i)
+        sink.close()
+        assert self._count(temp_db) == 120
+
+    def test_concurrent_group_commits_share_transactions(self, temp_db, monkeypatch):
+        """Test that waiting group-mode callers are committed together."""
+        import audit
+        batches = []
+        real = audit.add_audit_logs
+        monkeypatch.setattr(audit, 'add_audit_logs', lambda entries, conn=None: (batches.append(len(entries)), real(entries, conn))[1])
+        sink = audit.AuditSink(mode='group')
+        threads = [threading.Thread(target=sink.log, args=(1, 'login', 'user', i)) for i in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        sink.close()
+        assert sum(batches) == 40
+        assert self._count(temp_db) == 40
+
+
+class TestAuditRetention:
+    """Test archival of old audit rows and queries spanning live and archived data."""
+
+    def _seed(self, temp_db):
+        temp_db.add_audit_logs([
+            (1, 'login', 'user', 1, None, '2024-01-15 10:00:00'),
+            (2, 'upload', 'document', 7, None, '2024-02-03 09:00:00'),
+            (1, 'upload', 'document', 8, None, '2024-02-20 12:00:00'),
+        ])
+        temp_db.add_audit_log(1, 'login', 'user', 1)
+
+    def test_old_rows_move_to_monthly_archives(self, temp_db, tmp_path):
+        """Test that rows past retention land in per-month gzip files and leave the table."""
+        import audit
+        self._seed(temp_db)
+        archive_dir = tmp_path / 'archive'
+        assert audit.archive_old_entries(retention_days=30, archive_dir=str(archive_dir)) == 3
+        assert sorted(p.name for p in archive_dir.iterdir()) == ['audit-2024-01.jsonl.gz', 'audit-2024-02.jsonl.gz']
+        assert len(temp_db.get_audit_logs()) == 1
+
+    def test_query_spans_archive_and_live_table(self, temp_db, tmp_path):
+        """Test that query() merges both sources in order and applies filters."""
+        import audit
+        self._seed(temp_db)
+        audit.archive_old_entries(retention_days=30, archive_dir=str(tmp_path))
+
+        rows = list(audit.query(archive_dir=str(tmp_path)))
+        assert [r['action'] for r in rows] == ['login', 'upload', 'upload', 'login']
+        feb = list(audit.query(start='2024-02-01', end='2024-03-01', user_id=1, archive_dir=str(tmp_path)))
+        assert [r['target_id'] for r in feb] == [8]
+
+    def test_rows_left_behind_by_a_crash_are_not_duplicated(self, temp_db, tmp_path):
+        """Test that a row both archived and still live is returned once."""
+        import audit
+        self._seed(temp_db)
+        old = temp_db.get_audit_logs(end='2024-02-01')
+        audit._append_archive(audit.archive_path('2024-01', str(tmp_path)), old)
+
+        rows = list(audit.query(end='2024-02-01', archive_dir=str(tmp_path)))
+        assert [r['id'] for r in rows] == [old[0]['id']]
+
+    def test_newest_first_pages_across_sources(self, temp_db, tmp_path, monkeypatch):
+        """Test desc order and keyset paging over archives plus a paged live table."""
+        import audit
+        monkeypatch.setattr(audit, 'AUDIT_QUERY_PAGE', 1)
+        self._seed(temp_db)
+        audit.archive_old_entries(retention_days=30, archive_dir=str(tmp_path))
+        temp_db.add_audit_log(2, 'logout', 'user', 2)
+        # Ek aur archive append, jaise crash ke baad dobara likha gaya ho
+        audit._append_archive(audit.archive_path('2024-01', str(tmp_path)),
+                              list(audit.query(end='2024-02-01', archive_dir=str(tmp_path))))
+
+        rows = list(audit.query(desc=True, archive_dir=str(tmp_path)))
+        assert [r['action'] for r in rows[:2]] == ['logout', 'login']
+        assert [r['timestamp'][:10] for r in rows[2:]] == ['2024-02-20', '2024-02-03', '2024-01-15']
+        first = list(audit.query(desc=True, limit=2, archive_dir=str(tmp_path)))
+        after = (first[-1]['timestamp'], first[-1]['id'])
+        rest = list(audit.query(desc=True, after=after, archive_dir=str(tmp_path)))
+        assert first + rest == rows
+
+
+class TestEntityStore:
+    """Test the normalized document_entities index."""
+
+    def test_results_are_normalized_and_replaced(self, temp_db):
+        """Test that IDP results fill the index and a newer result replaces the old rows."""
+        doc = temp_db.create_document('po.pdf', 1, 'pdf', 1)
+        temp_db.create_idp_result(doc, 'Invoice', {'ORG': ['Acme  Corp.', 'ACME corp'], 'GPE': ['Kochi']})
+        facets = temp_db.get_entity_facets(1)
+        assert {(f['label'], f['value_norm'], f['count']) for f in facets} == {('ORG', 'acme corp', 1), ('GPE', 'kochi', 1)}
+
+        temp_db.create_idp_result(doc, 'Invoice', {'ORG': ['Globex']})
+        assert [f['value_norm'] for f in temp_db.get_entity_facets(1)] == ['globex']
+
+    def test_lookup_by_label_value_and_prefix(self, temp_db):
+        """Test exact and prefix lookups and per-facet counts, scoped to the uploader."""
+        a = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        b = temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        other = temp_db.create_document('c.pdf', 2, 'pdf', 1)
+        for doc in (a, b, other):
+            temp_db.create_idp_result(doc, 'Invoice', {'ORG': ['Acme Corp']})
+        temp_db.create_idp_result(b, 'Invoice', {'ORG': ['Acme Corp', 'Acme Rail']})
+
+        docs, _ = temp_db.find_documents_by_entity(1, label='ORG', value='ACME CORP')
+        assert {d['id'] for d in docs} == {a, b}
+        facets = temp_db.get_entity_facets(1, label='ORG', value='acme', prefix=True)
+        assert [(f['value'], f['count']) for f in facets] == [('Acme Corp', 2), ('Acme Rail', 1)]
+
+    def test_plan_uses_label_value_index(self, temp_db):
+        """Test that label/value lookups are index searches, not scans."""
+        conn = temp_db.get_db_connection()
+        plan = ' '.join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT document_id FROM document_entities WHERE label = 'ORG' AND value_norm = 'x'"))
+        temp_db.release_db_connection(conn)
+        assert 'SEARCH' in plan
+
+
+class TestSearchFacets:
+    """Test one-pass facet counts."""
+
+    def test_counts_for_current_filters(self, temp_db):
+        """Test status, type, classification and month counts under a filter."""
+        a = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        b = temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.create_document('c.txt', 1, 'txt', 1)
+        temp_db.create_document('d.pdf', 2, 'pdf', 1)
+        temp_db.update_document_status(b, 'Approved')
+        temp_db.create_idp_result(a, 'Invoice', {})
+
+        facets = temp_db.get_search_facets(1, file_type='pdf')
+        assert facets['type'] == [{'value': 'pdf', 'count': 2}]
+        assert facets['status'] == [{'value': 'Approved', 'count': 1}, {'value': 'Pending', 'count': 1}]
+        assert facets['classification'] == [{'value': 'Invoice', 'count': 1}, {'value': 'Unclassified', 'count': 1}]
+        assert sum(m['count'] for m in facets['month']) == 2
+
+    def test_text_query_and_subset(self, temp_db):
+        """Test that facets follow the full-text query and only requested facets are computed."""
+        temp_db.create_document('tender_notice.pdf', 1, 'pdf', 1)
+        temp_db.create_document('salary.txt', 1, 'txt', 1)
+        assert temp_db.get_search_facets(1, query='tender', facets=['type']) == {'type': [{'value': 'pdf', 'count': 1}]}
+        with pytest.raises(ValueError):
+            temp_db.get_search_facets(1, facets=['owner'])
+
+
+class TestStatusRollups:
+    """Test trigger-maintained chart rollups."""
+
+    def test_counts_follow_inserts_updates_and_deletes(self, temp_db):
+        """Test that per-uploader status counts track every change."""
+        a = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        b = temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.create_document('c.pdf', 2, 'pdf', 1)
+        temp_db.update_document_status(a, 'Approved')
+        temp_db.bulk_update_document_status([b], 'Rejected', 1, 'reject')
+        temp_db.delete_document(a)
+
+        assert temp_db.get_document_status_counts(1) == {'Rejected': 1}
+        assert temp_db.get_document_status_counts() == {'Pending': 1, 'Rejected': 1}
+
+    def test_timeseries_is_zero_filled(self, temp_db):
+        """Test that today's uploads and approvals land in the last point of the series."""
+        doc = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.update_document_status(doc, 'Approved')
+
+        series = temp_db.get_status_timeseries(1, days=7)
+        assert len(series) == 7
+        assert series[-1]['Uploaded'] == 2 and series[-1]['Approved'] == 1
+        assert all(point['Uploaded'] == 0 for point in series[:-1])
+
+    def test_rebuild_matches_triggers(self, temp_db):
+        """Test that rebuilding from documents gives the same status counts."""
+        doc = temp_db.create_document('a.pdf', 1, 'pdf', 1)
+        temp_db.create_document('b.pdf', 1, 'pdf', 1)
+        temp_db.update_document_status(doc, 'Approved')
+        before = temp_db.get_document_status_counts(1)
+        temp_db.rebuild_status_rollups()
+        assert temp_db.get_document_status_counts(1) == before
+
+
+class TestVersionedResults:
+    """Test pipeline-versioned IDP results and the latest pointer."""
+
+    def test_latest_pointer_follows_successful_results(self, temp_db):
+        """Test that details show the newest successful result, not any row."""
+        doc = temp_db.create_document('a.pdf', 1, 'pdf', 1, content_hash='abc')
+        temp_db.create_idp_result(doc, 'Invoice', {'ORG': ['Acme']}, pipeline_version='v1')
+        temp_db.create_idp_result(doc, 'Drawing', {}, confidence=0.5, pipeline_version='v2')
+        temp_db.create_idp_result(doc, 'Unknown', {}, status='Failed', pipeline_version='v2')
+
+        idp = temp_db.get_document_details(doc)['idp']
+        assert idp['classification'] == 'Drawing' and idp['pipeline_version'] == 'v2'
+        conn = temp_db.get_db_connection()
+        hashes = {row[0] for row in conn.execute("SELECT content_hash FROM idp_results")}
+        temp_db.release_db_connection(conn)
+        assert hashes == {'abc'}
+
+        temp_db.delete_document(doc)
+        conn = temp_db.get_db_connection()
+        assert conn.execute("SELECT COUNT(*) FROM idp_latest").fetchone()[0] == 0
+        temp_db.release_db_connection(conn)
+
+    def test_reuse_skips_current_and_copies_matches(self, temp_db):
+        """Test skip-if-current for one document and a result copy for a re-upload."""
+        a = temp_db.create_document('a.pdf', 1, 'pdf', 1, content_hash='abc')
+        b = temp_db.create_document('b.pdf', 1, 'pdf', 1, content_hash='abc')
+        c = temp_db.create_document('c.pdf', 1, 'pdf', 1, content_hash='def')
+        temp_db.create_idp_result(a, 'Invoice', {'ORG': ['Acme']}, pipeline_version='v1')
+
+        assert temp_db.reuse_idp_results([(a, 'abc'), (b, 'abc'), (c, 'def')], 'v1') == {a, b}
+        assert temp_db.reuse_idp_results([(a, 'abc'), (b, 'abc')], 'v2') == set()
+        assert temp_db.get_document_details(b)['metadata'] == {'ORG': ['Acme']}
+        assert temp_db.count_documents_for_reprocessing(pipeline_version='v1') == 1
+        assert temp_db.count_documents_for_reprocessing(pipeline_version='v2') == 3
+        assert not temp_db.clone_idp_result(c, 'abc', 'v2')
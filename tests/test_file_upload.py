@@ -9,6 +9,7 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
+from idp import PIPELINE_VERSION
 
 class TestFileUpload:
     """Test file upload functionality."""
@@ -198,3 +199,101 @@ class TestFileUpload:
         file_input = browser.find_element(By.ID, 'file-input')
         # File input might be hidden but still present in DOM
         assert file_input is not None
+
+
+class TestContentAddressedUpload:
+    """Test upload storage and deduplication (Flask test client, no browser)."""
+
+    def upload(self, client, name, content):
+        from io import BytesIO
+        return client.post('/upload', data={'document': (BytesIO(content), name)},
+                           content_type='multipart/form-data')
+
+    def test_identical_uploads_share_one_blob(self, user_client, temp_db, test_document):
+        """Test that re-uploading the same bytes stores them once and reuses IDP results."""
+        response = self.upload(user_client, test_document['filename'], test_document['content'])
+        assert response.status_code == 302
+        first = temp_db.get_user_documents(user_client.user_id)[0]
+        assert first['file_type'] == 'pdf'
+        assert first['file_size'] == len(test_document['content'])
+        temp_db.create_idp_result(first['id'], 'Invoice', {'ORG': ['KMRL']}, pipeline_version=PIPELINE_VERSION)
+
+        self.upload(user_client, 'copy.pdf', test_document['content'])
+        docs = temp_db.get_user_documents(user_client.user_id)
+        second = [d for d in docs if d['filename'] == 'copy.pdf'][0]
+        assert second['content_hash'] == first['content_hash']
+
+        conn = temp_db.get_db_connection()
+        blob = conn.execute("SELECT storage_path, refcount FROM blobs").fetchone()
+        jobs = conn.execute("SELECT COUNT(*) FROM idp_jobs").fetchone()[0]
+        temp_db.release_db_connection(conn)
+        assert blob['refcount'] == 2
+        assert jobs == 1  # second upload reused the first result
+        assert temp_db.get_document_details(second['id'])['metadata'] == {'ORG': ['KMRL']}
+        with open(blob['storage_path'], 'rb') as f:
+            assert f.read() == test_document['content']
+
+    def test_same_name_does_not_overwrite(self, user_client, temp_db):
+        """Test that two different files with one name are both kept."""
+        self.upload(user_client, 'report.txt', b'first version')
+        self.upload(user_client, 'report.txt', b'second version')
+        conn = temp_db.get_db_connection()
+        paths = [row[0] for row in conn.execute("SELECT storage_path FROM blobs")]
+        temp_db.release_db_connection(conn)
+        assert len(paths) == 2
+        assert sorted(open(p, 'rb').read() for p in paths) == [b'first version', b'second version']
+
+    def test_delete_releases_last_reference(self, user_client, temp_db):
+        """Test that deleting the last document using a blob removes the file."""
+        self.upload(user_client, 'note.txt', b'only copy')
+        doc = temp_db.get_user_documents(user_client.user_id)[0]
+        conn = temp_db.get_db_connection()
+        path = conn.execute("SELECT storage_path FROM blobs").fetchone()[0]
+        temp_db.release_db_connection(conn)
+
+        response = user_client.delete(f"/api/delete_document/{doc['id']}")
+        assert response.status_code == 200
+        assert not os.path.exists(path)
+        assert temp_db.get_document_by_id(doc['id']) is None
+
+
+class TestChunkedUpload:
+    """Test the resumable chunked upload API (Flask test client, no browser)."""
+
+    def test_chunked_upload_resumes_and_finalizes(self, user_client, temp_db):
+        """Test init, out-of-order rejection, resume from the server offset and finalize."""
+        import hashlib
+        content = b'scanned drawing bundle ' * 1000
+        response = user_client.post('/api/uploads', json={'filename': 'bundle.pdf', 'size': len(content)})
+        assert response.status_code == 201
+        upload_id = response.get_json()['upload_id']
+
+        first, rest = content[:7000], content[7000:]
+        response = user_client.put(f'/api/uploads/{upload_id}?offset=0', data=first)
+        assert response.get_json()['offset'] == len(first)
+
+        # Wrong offset is refused with the offset to resume from
+        response = user_client.put(f'/api/uploads/{upload_id}?offset=0', data=rest)
+        assert response.status_code == 409
+        resume_at = user_client.get(f'/api/uploads/{upload_id}').get_json()['offset']
+        assert resume_at == len(first)
+
+        # Finalizing early is refused
+        assert user_client.post(f'/api/uploads/{upload_id}/finalize').status_code == 409
+
+        user_client.put(f'/api/uploads/{upload_id}?offset={resume_at}', data=rest)
+        response = user_client.post(f'/api/uploads/{upload_id}/finalize')
+        body = response.get_json()
+        assert body['sha256'] == hashlib.sha256(content).hexdigest()
+
+        doc = temp_db.get_document_by_id(body['document_id'])
+        assert doc['filename'] == 'bundle.pdf'
+        assert doc['file_size'] == len(content)
+        assert user_client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+    def test_chunk_past_declared_size_rejected(self, user_client):
+        """Test that a chunk overflowing the declared size is refused."""
+        upload_id = user_client.post('/api/uploads', json={'filename': 'a.txt', 'size': 4}).get_json()['upload_id']
+        response = user_client.put(f'/api/uploads/{upload_id}?offset=0', data=b'too long')
+        assert response.status_code == 400
+        assert user_client.get(f'/api/uploads/{upload_id}').get_json()['offset'] == 0
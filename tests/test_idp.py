@@ -0,0 +1,387 @@
+"""
+IDP pipeline tests for KMRL DMS.
+"""
+import pytest
+import spacy
+import idp
+from idp import chunk_text, extract_entities_batch
+
+@pytest.fixture(scope="module")
+def ruler_model():
+    """A tiny deterministic NER pipeline."""
+    model = spacy.blank('en')
+    ruler = model.add_pipe('entity_ruler')
+    ruler.add_patterns([
+        {'label': 'ORG', 'pattern': 'KMRL'},
+        {'label': 'GPE', 'pattern': 'Kochi'},
+    ])
+    return model
+
+class TestNERBatching:
+    """Test batched entity extraction."""
+
+    def test_chunk_text_overlaps(self):
+        """Test that long text is split into bounded, overlapping chunks."""
+        text = ' '.join(f'word{i}' for i in range(500))
+        chunks = chunk_text(text, max_chars=400, overlap=50)
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 400 for chunk in chunks)
+        for prev, nxt in zip(chunks, chunks[1:]):
+            assert prev[-50:] == nxt[:50]
+        assert chunks[0].startswith('word0 ') and chunks[-1].endswith('word499')
+
+    def test_short_text_is_single_chunk(self):
+        """Test that short text is passed through unchanged."""
+        assert chunk_text('KMRL Kochi') == ['KMRL Kochi']
+
+    def test_batch_returns_one_result_per_text(self, ruler_model):
+        """Test that entities are grouped back per input text and deduplicated."""
+        results = extract_entities_batch(
+            ['KMRL office in Kochi', 'nothing here', 'KMRL and KMRL'],
+            model=ruler_model, batch_size=2
+        )
+        assert sorted(results[0]) == ['GPE', 'ORG']
+        assert results[1] == {}
+        assert results[2] == {'ORG': ['KMRL']}
+
+
+class TestLazyDependencies:
+    """Test the lazy dependency registry."""
+
+    def test_loader_runs_once(self):
+        """Test that a registered loader runs on first use only."""
+        import deps
+        calls = []
+        deps.register('test-dep', lambda: calls.append(1) or object())
+        assert not deps.is_loaded('test-dep')
+        first = deps.get('test-dep')
+        assert deps.get('test-dep') is first
+        assert calls == [1]
+
+    def test_app_import_skips_heavy_modules(self, tmp_path):
+        """Test that importing app does not import PyMuPDF, Tesseract or spaCy."""
+        import os
+        import subprocess
+        import sys
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        probe = ("import sys, app; "
+                 "print([m for m in ('fitz', 'pytesseract', 'spacy') if m in sys.modules])")
+        out = subprocess.run([sys.executable, '-c', probe], cwd=tmp_path, capture_output=True,
+                             text=True, env=dict(os.environ, PYTHONPATH=repo), check=True)
+        assert out.stdout.strip().splitlines()[-1] == '[]'
+
+
+class TestPDFExtraction:
+    """Test page-level PDF text extraction."""
+
+    def make_pdf(self, path, pages):
+        import fitz
+        doc = fitz.open()
+        for i in range(pages):
+            doc.new_page().insert_text((72, 72), f"Page number {i}")
+        doc.save(path)
+        return str(path)
+
+    def test_parallel_extraction_keeps_page_order(self, tmp_path, monkeypatch):
+        """Test that page ranges from the process pool are joined in order."""
+        path = self.make_pdf(tmp_path / 'manual.pdf', 7)
+        monkeypatch.setattr(idp, 'PDF_PROCESSES', 2)
+        monkeypatch.setattr(idp, 'PDF_PARALLEL_MIN_PAGES', 2)
+        monkeypatch.setattr(idp, 'PDF_PAGES_PER_TASK', 3)
+
+        pages = list(idp.iter_pdf_pages(path))
+        assert [p.strip() for p in pages] == [f"Page number {i}" for i in range(7)]
+        assert idp.extract_text(path) == ''.join(pages)
+
+    def test_workers_share_the_cpus(self, temp_db, monkeypatch):
+        """Test that each of several workers gets a slice of the CPUs for its PDF pool."""
+        import deps
+        import worker
+        monkeypatch.setattr(worker.os, 'cpu_count', lambda: 8)
+        assert worker.pdf_processes_per_worker(4) == 2
+        assert worker.pdf_processes_per_worker(16) == 1
+
+        monkeypatch.setattr(deps, 'preload', lambda *names: None)
+        monkeypatch.setattr(idp, 'PDF_PROCESSES', 8)
+        worker.run_worker(max_jobs=0, pdf_processes=2)
+        assert idp.PDF_PROCESSES == 2
+
+    def test_ocr_fallback_for_image_only_pages(self, tmp_path, monkeypatch):
+        """Test that pages without a text layer are OCR'd once and then served from cache."""
+        import deps
+        import fitz
+        path = str(tmp_path / 'scan.pdf')
+        doc = fitz.open()
+        doc.new_page().insert_text((72, 72), "Typed cover page")
+        doc.new_page()  # scanned page: no text layer
+        doc.save(path)
+
+        calls = []
+        class FakeTesseract:
+            @staticmethod
+            def image_to_string(image):
+                calls.append(image.size)
+                return "Scanned circular text"
+
+        monkeypatch.setitem(deps._loaded, 'pytesseract', FakeTesseract)
+        monkeypatch.setattr(idp, 'PDF_PROCESSES', 1)
+        monkeypatch.setattr(idp, 'OCR_CACHE_DIR', str(tmp_path / 'ocr'))
+        monkeypatch.setattr(idp, 'OCR_DPI', 72)
+
+        pages = list(idp.iter_pdf_pages(path))
+        assert pages[0].strip() == "Typed cover page"
+        assert pages[1] == "Scanned circular text"
+        assert calls == [(595, 842)]  # A4 at 72 dpi
+
+        assert list(idp.iter_pdf_pages(path)) == pages
+        assert len(calls) == 1
+
+
+class TestClassifier:
+    """Test the rule-based classifier stage."""
+
+    def test_labels_and_confidence(self):
+        """Test that each class is recognised and confidence reflects the evidence."""
+        from classifier import classify_batch
+        results = classify_batch([
+            "TAX INVOICE\nInvoice No: 42\nGSTIN 32ABCDE\nAmount Due: 1000",
+            "Purchase Order\nPO No. 17\nDelivery schedule: June",
+            "Safety Circular No. 5 - all staff must wear PPE",
+            "Drawing No. KM-101, Scale 1:100, Sheet 2 of 4",
+            "Minutes of the weekly meeting",
+        ])
+        assert [label for label, _ in results] == [
+            'Invoice', 'Purchase Order', 'Safety Circular', 'Drawing', 'General Document'
+        ]
+        assert results[0][1] > 0.8
+        assert results[-1][1] == 0.0
+
+    def test_plural_and_past_forms(self):
+        """Test that keywords still match plural and -ed forms, as the old substring check did."""
+        from classifier import classify_batch
+        results = classify_batch([
+            "Pending invoices for March",
+            "Amount invoiced to the contractor",
+            "Open purchase orders",
+            "New safety circulars and incident reports",
+        ])
+        assert [label for label, _ in results] == ['Invoice', 'Invoice', 'Purchase Order', 'Safety Circular']
+
+    def test_mixed_evidence_lowers_confidence(self):
+        """Test that competing classes reduce the winner's confidence."""
+        from classifier import RuleClassifier
+        clf = RuleClassifier()
+        _, clean = clf.classify("Invoice No 1, amount due, bill to KMRL")
+        label, mixed = clf.classify("Invoice No 1, amount due, against purchase order")
+        assert label == 'Invoice'
+        assert mixed < clean
+
+    def test_rejects_capturing_groups(self):
+        """Test that rule patterns with capturing groups are refused."""
+        from classifier import RuleClassifier
+        with pytest.raises(ValueError):
+            RuleClassifier({'Bad': [(r'(invoice)', 1.0)]})
+
+
+class TestOfficeExtraction:
+    """Test magic-byte detection and streaming OOXML/text extraction."""
+
+    W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    S = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    A = ('xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main" '
+         'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"')
+
+    def make_zip(self, path, parts):
+        import zipfile
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, content in parts.items():
+                zf.writestr(name, content)
+        return str(path)
+
+    def test_docx_paragraphs(self, tmp_path):
+        """Test that docx paragraphs become lines, detected without the extension."""
+        import extractors
+        body = (f'<w:document {self.W}><w:body>'
+                '<w:p><w:r><w:t>Safety circular</w:t></w:r><w:r><w:tab/><w:t>No. 5</w:t></w:r></w:p>'
+                '<w:p><w:r><w:t>All staff</w:t></w:r></w:p></w:body></w:document>')
+        path = self.make_zip(tmp_path / 'upload.bin', {'word/document.xml': body})
+        assert extractors.detect_type(path) == extractors.DOCX
+        assert idp.extract_text(path) == 'Safety circular\tNo. 5\nAll staff\n'
+
+    def test_xlsx_rows_with_shared_strings(self, tmp_path):
+        """Test that workbook rows come out tab-separated, sheets in order."""
+        shared = f'<sst {self.S}><si><t>Item</t></si><si><t>Rail clip</t></si></sst>'
+        sheet = lambda rows: f'<worksheet {self.S}><sheetData>{rows}</sheetData></worksheet>'
+        path = self.make_zip(tmp_path / 'stock.xlsx', {
+            'xl/workbook.xml': '<workbook/>',
+            'xl/sharedStrings.xml': shared,
+            'xl/worksheets/sheet2.xml': sheet('<row><c t="inlineStr"><is><t>Sheet two</t></is></c></row>'),
+            'xl/worksheets/sheet1.xml': sheet('<row><c t="s"><v>0</v></c><c><v>12</v></c></row>'
+                                              '<row><c t="s"><v>1</v></c><c><v>3.5</v></c></row>'),
+        })
+        assert idp.extract_text(path) == 'Item\t12\nRail clip\t3.5\nSheet two\n'
+
+    def test_pptx_slides_in_order(self, tmp_path):
+        """Test that slide text is read slide by slide in numeric order."""
+        slide = lambda text: f'<p:sld {self.A}><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+        path = self.make_zip(tmp_path / 'deck.ppsx', {
+            'ppt/presentation.xml': '<presentation/>',
+            'ppt/slides/slide10.xml': slide('Ten'),
+            'ppt/slides/slide2.xml': slide('Two'),
+        })
+        assert idp.extract_text(path) == 'Two\n\nTen\n\n'
+
+    def test_text_is_emitted_in_bounded_chunks(self, tmp_path):
+        """Test that iter_text never yields more than chunk_chars at once."""
+        import extractors
+        path = tmp_path / 'notes.txt'
+        path.write_text('x' * 2500, encoding='utf-8')
+        chunks = list(extractors.iter_text(str(path), chunk_chars=1000))
+        assert [len(c) for c in chunks] == [1000, 1000, 500]
+
+    def test_parsed_elements_are_detached(self):
+        """Test that the streaming parser keeps only the current path of the XML tree."""
+        from io import BytesIO
+        import extractors
+        xml = b'<body>' + b'<p><t>row</t></p>' * 1000 + b'</body>'
+        ended = [elem for elem in extractors._iter_ended(BytesIO(xml))]
+        root = ended[-1]
+        assert root.tag == 'body' and len(root) == 0
+        assert sum(elem.tag == 't' for elem in ended) == 1000
+
+    def test_unknown_binary_is_skipped(self, tmp_path):
+        """Test that files without an extractor produce no text."""
+        path = tmp_path / 'blob.txt'
+        path.write_bytes(b'\x00\x01\x02 not really text')
+        assert idp.extract_text(str(path)) == ''
+
+
+class TestReprocess:
+    """Test the checkpointed IDP backfill."""
+
+    def make_docs(self, temp_db, folder, count):
+        folder.mkdir(exist_ok=True)
+        ids = []
+        for i in range(count):
+            (folder / f'note{i}.txt').write_text(f'Invoice No {i}, amount due', encoding='utf-8')
+            ids.append(temp_db.create_document(f'note{i}.txt', 1, 'txt', 1))
+        return ids
+
+    def test_backfills_missing_results_and_resumes(self, temp_db, tmp_path):
+        """Test that missing results are written and a second run has nothing left to do."""
+        import reprocess
+        ids = self.make_docs(temp_db, tmp_path / 'uploads', 5)
+        temp_db.create_document('gone.txt', 1, 'txt', 1)
+        checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+        checkpoint = reprocess.reprocess(processes=1, batch_size=2, checkpoint_path=checkpoint_path,
+                                         upload_folder=str(tmp_path / 'uploads'))
+        assert checkpoint['processed'] == 5
+        assert checkpoint['failed'] == [ids[-1] + 1]
+        assert temp_db.count_documents_for_reprocessing() == 1
+
+        again = reprocess.reprocess(processes=1, checkpoint_path=checkpoint_path,
+                                    upload_folder=str(tmp_path / 'uploads'))
+        assert again['processed'] == 5
+
+    def test_process_pool_and_stale_results(self, temp_db, tmp_path):
+        """Test the pool path and that --stale-before redoes older results."""
+        import reprocess
+        from storage import file_sha256
+        ids = self.make_docs(temp_db, tmp_path / 'uploads', 3)
+        temp_db.create_idp_result(ids[0], 'General Document', {})
+        # Is version aur hash ka result bhi stale ho sakta hai
+        path = tmp_path / 'uploads' / 'current.txt'
+        path.write_text('Invoice No 9, amount due', encoding='utf-8')
+        content_hash = file_sha256(str(path))
+        current = temp_db.create_document('current.txt', 1, 'txt', 1, content_hash=content_hash)
+        temp_db.create_idp_result(current, 'General Document', {}, pipeline_version=idp.PIPELINE_VERSION,
+                                  content_hash=content_hash)
+        conn = temp_db.get_db_connection()
+        conn.execute("UPDATE idp_results SET processed_at = '2020-01-01 00:00:00'")
+        conn.commit()
+        temp_db.release_db_connection(conn)
+        assert temp_db.count_documents_for_reprocessing() == 2
+        assert temp_db.count_documents_for_reprocessing(stale_before='2021-01-01') == 4
+
+        checkpoint = reprocess.reprocess(processes=2, batch_size=1, stale_before='2021-01-01',
+                                         checkpoint_path=str(tmp_path / 'cp.json'),
+                                         upload_folder=str(tmp_path / 'uploads'))
+        assert checkpoint['processed'] == 4
+        assert temp_db.count_documents_for_reprocessing(stale_before='2021-01-01') == 0
+        conn = temp_db.get_db_connection()
+        assert conn.execute("SELECT COUNT(*) FROM idp_results WHERE document_id = ?", (current,)).fetchone()[0] == 2
+        temp_db.release_db_connection(conn)
+
+    def test_documents_without_text_are_not_picked_again(self, temp_db, tmp_path):
+        """Test that a file with no text gets an Empty result and later runs skip it."""
+        import reprocess
+        ids = self.make_docs(temp_db, tmp_path / 'uploads', 1)
+        (tmp_path / 'uploads' / 'blank.txt').write_text('   ', encoding='utf-8')
+        blank = temp_db.create_document('blank.txt', 1, 'txt', 1)
+
+        checkpoint = reprocess.reprocess(processes=1, checkpoint_path=str(tmp_path / 'cp.json'),
+                                         upload_folder=str(tmp_path / 'uploads'))
+        assert checkpoint['processed'] == 2
+        assert temp_db.count_documents_for_reprocessing(pipeline_version=idp.PIPELINE_VERSION) == 0
+        conn = temp_db.get_db_connection()
+        statuses = dict(conn.execute("SELECT document_id, status FROM idp_results").fetchall())
+        temp_db.release_db_connection(conn)
+        assert statuses == {ids[0]: 'Success', blank: 'Empty'}
+
+        again = reprocess.reprocess(processes=1, checkpoint_path=str(tmp_path / 'cp.json'), restart=True,
+                                    upload_folder=str(tmp_path / 'uploads'))
+        assert again['processed'] == 0
+
+    def test_flask_command(self, temp_db, monkeypatch):
+        """Test that `flask reprocess` runs the backfill with the app's upload folder."""
+        import reprocess
+        from app import app
+        calls = []
+        monkeypatch.setattr(reprocess, 'reprocess', lambda *args, **kwargs: calls.append((args, kwargs)))
+        result = app.test_cli_runner().invoke(args=['reprocess', '--processes', '2', '--restart'])
+        assert result.exit_code == 0, result.output
+        assert calls == [((2, reprocess.BATCH_SIZE, None),
+                          {'restart': True, 'upload_folder': app.config['UPLOAD_FOLDER']})]
+
+
+class TestSkipIfCurrent:
+    """Test that content already processed by this pipeline version is not processed again."""
+
+    def test_reupload_and_rerun_are_cache_hits(self, temp_db, tmp_path, monkeypatch):
+        """Test that results are tagged, re-runs skip and a copy needs no extraction."""
+        from storage import file_sha256
+        path = tmp_path / 'note.txt'
+        path.write_text('Invoice No 7, amount due', encoding='utf-8')
+        content_hash = file_sha256(str(path))
+        first = temp_db.create_document('note.txt', 1, 'txt', 1, content_hash=content_hash)
+        assert idp.process_documents([(str(path), first)]) == [(first, None)]
+
+        def fail(file_path):
+            raise AssertionError("extraction should have been skipped")
+        monkeypatch.setattr(idp, 'extract_text', fail)
+        second = temp_db.create_document('copy.txt', 1, 'txt', 1, content_hash=content_hash)
+        assert idp.process_documents([(str(path), first), (str(path), second)]) == [(first, None), (second, None)]
+
+        conn = temp_db.get_db_connection()
+        rows = conn.execute("SELECT document_id, pipeline_version, content_hash FROM idp_results").fetchall()
+        temp_db.release_db_connection(conn)
+        assert sorted(tuple(row) for row in rows) == [(first, idp.PIPELINE_VERSION, content_hash),
+                                                     (second, idp.PIPELINE_VERSION, content_hash)]
+        assert temp_db.get_document_details(second)['idp']['classification'] == 'Invoice'
+
+    def test_new_pipeline_version_reprocesses(self, temp_db, tmp_path):
+        """Test that bumping PIPELINE_VERSION makes old results stale for reprocess.py."""
+        import reprocess
+        folder = tmp_path / 'uploads'
+        folder.mkdir()
+        (folder / 'note.txt').write_text('Purchase Order, vendor code 12', encoding='utf-8')
+        doc = temp_db.create_document('note.txt', 1, 'txt', 1)
+        temp_db.create_idp_result(doc, 'General Document', {}, pipeline_version='old')
+
+        checkpoint = reprocess.reprocess(processes=1, checkpoint_path=str(tmp_path / 'cp.json'),
+                                         upload_folder=str(folder))
+        assert checkpoint['processed'] == 1
+        details = temp_db.get_document_details(doc)['idp']
+        assert details['pipeline_version'] == idp.PIPELINE_VERSION
+        assert details['classification'] == 'Purchase Order'
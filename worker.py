@@ -0,0 +1,124 @@
+"""
+Background IDP worker pool for KMRL DMS.
+
+Run alongside the web app:
+    python worker.py --processes 4
+
+Each worker process runs one stage at a time: PDF page extraction (up to
+--pdf-processes pool processes) and then NER (up to --ner-processes via
+nlp.pipe). By default the PDF pool gets cpu_count / --processes, so the
+workers together use about one process per CPU instead of cpu_count^2;
+keep --processes * --ner-processes near cpu_count for the same reason.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+
+import deps
+from database import (
+    claim_idp_job, complete_idp_job, fail_idp_job, requeue_stale_idp_jobs,
+    create_idp_result
+)
+
+POLL_INTERVAL = 1.0
+BACKOFF_SECONDS = 30
+# Worker model load karke warm rakhta hai; itne jobs ek nlp.pipe batch mein jaate hain
+NER_BATCH_SIZE = 16
+NER_PROCESSES = 1
+LEASE_SECONDS = 600
+
+def finish_job(job, error):
+    """Records the outcome of one job."""
+    if error is None:
+        complete_idp_job(job['id'])
+        return True
+    print(f"Job {job['id']} failed (attempt {job['attempts']}): {error}")
+    if not fail_idp_job(job['id'], str(error), BACKOFF_SECONDS):
+        create_idp_result(job['document_id'], "Unknown", {}, status='Failed')
+    return False
+
+def run_jobs(jobs, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES):
+    """Processes claimed jobs together so NER runs as one nlp.pipe batch."""
+    from idp import process_documents
+
+    try:
+        outcomes = process_documents(
+            [(job['file_path'], job['document_id']) for job in jobs],
+            batch_size=batch_size, n_process=n_process
+        )
+    except Exception as e:
+        outcomes = [(job['document_id'], e) for job in jobs]
+    return [finish_job(job, error) for job, (_, error) in zip(jobs, outcomes)]
+
+def claim_batch(worker_id, size):
+    """Claims up to size runnable jobs."""
+    jobs = []
+    while len(jobs) < size:
+        job = claim_idp_job(worker_id)
+        if job is None:
+            break
+        jobs.append(job)
+    return jobs
+
+def pdf_processes_per_worker(processes):
+    """CPU share of one worker's PDF pool when processes workers run side by side."""
+    return max(1, (os.cpu_count() or 1) // max(processes, 1))
+
+def run_worker(poll_interval=POLL_INTERVAL, max_jobs=None, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES,
+               pdf_processes=None):
+    """Claims and runs jobs until stopped (or until max_jobs have run).
+
+    pdf_processes caps this worker's PDF page pool (idp.PDF_PROCESSES).
+    """
+    if pdf_processes is not None:
+        import idp
+        idp.PDF_PROCESSES = pdf_processes
+    # Model aur extraction libraries pehle hi load karke worker ko warm rakhein
+    deps.preload()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        size = batch_size if max_jobs is None else min(batch_size, max_jobs - processed)
+        jobs = claim_batch(worker_id, size)
+        if not jobs:
+            if max_jobs is not None:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_jobs(jobs, batch_size, n_process)
+        processed += len(jobs)
+    return processed
+
+def start_workers(processes, poll_interval=POLL_INTERVAL, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES,
+                  pdf_processes=None):
+    """Starts worker processes and waits for them."""
+    requeue_stale_idp_jobs(LEASE_SECONDS)
+    if pdf_processes is None and 'PDF_PROCESSES' not in os.environ:
+        pdf_processes = pdf_processes_per_worker(processes)
+    workers = [
+        # daemon nahi, taaki nlp.pipe(n_process > 1) aur PDF pool apne child processes bana sakein
+        multiprocessing.Process(target=run_worker, args=(poll_interval, None, batch_size, n_process, pdf_processes))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background IDP workers.")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    parser.add_argument('--ner-batch-size', type=int, default=NER_BATCH_SIZE)
+    parser.add_argument('--ner-processes', type=int, default=NER_PROCESSES)
+    parser.add_argument('--pdf-processes', type=int,
+                        help="PDF page pool size per worker (default: cpu_count / processes).")
+    args = parser.parse_args()
+    start_workers(args.processes, args.poll_interval, args.ner_batch_size, args.ner_processes,
+                  args.pdf_processes)